@@ -0,0 +1,260 @@
+"""Coverage and anomaly alerts over the queue snapshots.
+
+Each rule checks either one queue or one rep's memberships across queues:
+
+    zero_weight     active queue whose members all have weight 0
+    thin_queue      active queue with fewer than min_members reps
+    rep_overloaded  rep in at least max_queues active queues (e.g. left, never removed)
+    cs_in_sales     rep of a `home` workspace queue also sitting in `foreign` workspace queues
+
+AlertEngine keeps an index of the queues it last evaluated. Every update
+diffs the new elements against it and re-checks only the queues that
+changed and the reps whose memberships they touched, so it runs after every
+refresh. CHILI_ALERT_RULES (JSON) turns rules off or sets their parameters,
+e.g. {"thin_queue": {"min_members": 3}, "cs_in_sales": false}. Opened and
+resolved alerts are appended to CHILI_ALERTS_FILE (JSON lines) and POSTed
+to CHILI_ALERTS_WEBHOOK when those are set.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+import metrics
+from snapshots import Debounced
+
+logger = logging.getLogger(__name__)
+
+# Rule -> (severity, default parameters)
+RULES = {
+    'zero_weight': ('critical', {}),
+    'thin_queue': ('warning', {'min_members': 2}),
+    'rep_overloaded': ('warning', {'max_queues': 30}),
+    'cs_in_sales': ('warning', {'home': "CS", 'foreign': "Sales"}),
+}
+QUEUE_RULES = ('zero_weight', 'thin_queue')
+REP_RULES = ('rep_overloaded', 'cs_in_sales')
+
+# Queues that aren't routed to and are never checked
+EXCLUDED_QUEUES = {"Existing Customer - Owner"}
+
+# Queue names listed in a rep alert's message before "and N more"
+MAX_LISTED = 5
+
+
+# Enabled rules with their parameters, from CHILI_ALERT_RULES over the defaults
+def load_rules(raw=None):
+    raw = os.getenv("CHILI_ALERT_RULES") if raw is None else raw
+    rules = {name: dict(params) for name, (_, params) in RULES.items()}
+    if not raw:
+        return rules
+    try:
+        for name, value in json.loads(raw).items():
+            if name not in RULES:
+                logger.warning(f"Ignoring unknown alert rule {name}")
+            elif value is False:
+                rules.pop(name, None)
+            elif isinstance(value, dict):
+                rules[name].update(value)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Ignoring invalid CHILI_ALERT_RULES: {str(e)}")
+    return rules
+
+
+# What the rules look at in a queue: (name, workspace name, active, ((user id, name, weight), ...))
+def fingerprint(queue, workspace_names):
+    return (
+        queue['name'],
+        workspace_names.get(queue['workspaceId'], queue['workspaceId']),
+        bool(queue['active']) and queue['name'] not in EXCLUDED_QUEUES,
+        tuple((m['id'], m['name'], m['weight']) for m in queue.get('members', [])),
+    )
+
+
+def _listed(names):
+    names = sorted(names)
+    more = f" and {len(names) - MAX_LISTED} more" if len(names) > MAX_LISTED else ""
+    return ", ".join(names[:MAX_LISTED]) + more
+
+
+def check_zero_weight(queue, params):
+    name, _, active, members = queue
+    if active and members and all(weight == 0 for _, _, weight in members):
+        return f"All {len(members)} reps of {name} have weight 0, so it routes to no one"
+
+
+def check_thin_queue(queue, params):
+    name, _, active, members = queue
+    if active and len(members) < params['min_members']:
+        if not members:
+            return f"{name} has no reps"
+        return f"{name} has only {len(members)} rep{'s' if len(members) > 1 else ''}"
+
+
+# `queues` are the fingerprints of the rep's active queues
+def check_rep_overloaded(rep_name, queues, params):
+    if len(queues) >= params['max_queues']:
+        return f"{rep_name} is in {len(queues)} active queues"
+
+
+def check_cs_in_sales(rep_name, queues, params):
+    if any(workspace == params['home'] for _, workspace, _, _ in queues):
+        foreign = [name for name, workspace, _, _ in queues if workspace == params['foreign']]
+        if foreign:
+            return f"{params['home']} rep {rep_name} is in {params['foreign']} queues: {_listed(foreign)}"
+
+
+CHECKS = {
+    'zero_weight': check_zero_weight,
+    'thin_queue': check_thin_queue,
+    'rep_overloaded': check_rep_overloaded,
+    'cs_in_sales': check_cs_in_sales,
+}
+
+
+class AlertEngine:
+    """Incrementally evaluated alerts of one set of queues (one tenant's WorkspaceStore)."""
+
+    def __init__(self, name="", rules=None, sinks=()):
+        self.name = name
+        self.rules = load_rules() if rules is None else rules
+        self.sinks = list(sinks)
+        self.lock = threading.Lock()
+        self.queues = {}  # queue id -> (queue dict, fingerprint)
+        self.rep_queues = {}  # user id -> {queue id}
+        self.rep_names = {}  # user id -> latest name
+        self.alerts = {}  # (rule, queue or user id) -> alert dict
+        self.evaluated_at = None
+        self.last_checked = (0, 0)  # (queues, reps) re-checked by the last update
+
+    # Re-check what changed since the last update; returns the opened and resolved alerts
+    def update(self, elements, workspace_names):
+        with self.lock, metrics.span("alerts.evaluate"):
+            changed, touched, seen = [], set(), set()
+            for queue in elements:
+                queue_id = queue['id']
+                seen.add(queue_id)
+                previous = self.queues.get(queue_id)
+                # Patched snapshots keep the dicts of queues that didn't change
+                if previous is not None and previous[0] is queue:
+                    continue
+                current = fingerprint(queue, workspace_names)
+                if previous is not None and previous[1] == current:
+                    self.queues[queue_id] = (queue, current)
+                    continue
+                self._reindex(queue_id, previous[1] if previous else None, current, touched)
+                self.queues[queue_id] = (queue, current)
+                changed.append(queue_id)
+            for queue_id in [q for q in self.queues if q not in seen]:
+                self._reindex(queue_id, self.queues.pop(queue_id)[1], None, touched)
+                changed.append(queue_id)
+
+            events = []
+            for queue_id in changed:
+                entry = self.queues.get(queue_id)
+                for rule in QUEUE_RULES:
+                    message = None
+                    if rule in self.rules and entry is not None:
+                        message = CHECKS[rule](entry[1], self.rules[rule])
+                    self._set(rule, queue_id, entry[1][0] if entry else None, message, events)
+            for user_id in touched:
+                queues = [self.queues[q][1] for q in self.rep_queues.get(user_id, ()) if self.queues[q][1][2]]
+                name = self.rep_names.get(user_id, user_id)
+                for rule in REP_RULES:
+                    message = CHECKS[rule](name, queues, self.rules[rule]) if rule in self.rules and queues else None
+                    self._set(rule, user_id, name, message, events)
+                if not self.rep_queues.get(user_id):
+                    self.rep_queues.pop(user_id, None)
+                    self.rep_names.pop(user_id, None)
+            self.evaluated_at = time.time()
+            self.last_checked = (len(changed), len(touched))
+        for event in events:
+            metrics.inc("alerts", event=event['event'], rule=event['rule'])
+        if events:
+            logger.info(f"Alerts: {sum(e['event'] == 'opened' for e in events)} opened, "
+                        f"{sum(e['event'] == 'resolved' for e in events)} resolved")
+            self._emit(events)
+        return events
+
+    # Move a queue's memberships in the rep index from `old` to `new` fingerprints,
+    # collecting the reps whose memberships may have changed
+    def _reindex(self, queue_id, old, new, touched):
+        for user_id, _, _ in (old[3] if old else ()):
+            self.rep_queues.get(user_id, set()).discard(queue_id)
+            touched.add(user_id)
+        for user_id, name, _ in (new[3] if new else ()):
+            self.rep_queues.setdefault(user_id, set()).add(queue_id)
+            self.rep_names[user_id] = name
+            touched.add(user_id)
+
+    def _set(self, rule, subject_id, subject, message, events):
+        key = (rule, subject_id)
+        existing = self.alerts.get(key)
+        if message is None:
+            if existing is not None:
+                del self.alerts[key]
+                events.append(dict(existing, event='resolved', at=time.time(), source=self.name))
+            return
+        if existing is not None and existing['message'] == message:
+            return
+        alert = {'rule': rule, 'severity': RULES[rule][0], 'subject_id': subject_id, 'subject': subject,
+                 'message': message, 'since': existing['since'] if existing else time.time()}
+        self.alerts[key] = alert
+        if existing is None:
+            events.append(dict(alert, event='opened', at=alert['since'], source=self.name))
+
+    def _emit(self, events):
+        for sink in self.sinks:
+            try:
+                sink(events)
+            except Exception as e:
+                logger.warning(f"Alert sink failed: {str(e)}")
+
+    # Open alerts, most severe and oldest first
+    def current(self):
+        with self.lock:
+            alerts = list(self.alerts.values())
+        order = {'critical': 0, 'warning': 1}
+        return sorted(alerts, key=lambda a: (order.get(a['severity'], 2), a['since'], a['message']))
+
+    # Evaluate a WorkspaceStore now and after every version it publishes. update()
+    # only re-checks what changed, so it looks at every workspace each time.
+    def watch(self, store):
+        listener = Debounced(lambda workspace_ids: self.update(store.payload("All").elements,
+                                                               store.workspace_names()), "alerts")
+        store.listeners.append(listener)
+        listener()
+        return self
+
+
+# Sink appending each event as a JSON line to `path`
+def file_sink(path):
+    lock = threading.Lock()
+
+    def write(events):
+        with lock, open(path, "a") as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+    return write
+
+
+# Sink POSTing each batch of events as a JSON list to `url`
+def webhook_sink(url):
+    def post(events):
+        request = urllib.request.Request(url, data=json.dumps(events).encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=5):
+            pass
+    return post
+
+
+# Sinks configured by CHILI_ALERTS_FILE / CHILI_ALERTS_WEBHOOK
+def configured_sinks():
+    sinks = []
+    if os.getenv("CHILI_ALERTS_FILE"):
+        sinks.append(file_sink(os.getenv("CHILI_ALERTS_FILE")))
+    if os.getenv("CHILI_ALERTS_WEBHOOK"):
+        sinks.append(webhook_sink(os.getenv("CHILI_ALERTS_WEBHOOK")))
+    return sinks
@@ -0,0 +1,190 @@
+"""Typed audit log and the analytics behind the Audit Log section.
+
+The Google Sheet's records are turned into one typed frame per audit
+version (a digest of the records), and every analytic is a vectorized
+groupby / resample over it, memoized on that version. A refresh that finds
+the sheet unchanged keeps the old AuditLog and everything computed from it.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['Timestamp', 'User', 'Action', 'Queue', 'Rep', 'Details']
+
+# Sheet header (lowercased) -> column
+COLUMN_ALIASES = {
+    'timestamp': 'Timestamp', 'time': 'Timestamp', 'date': 'Timestamp',
+    'user': 'User', 'email': 'User',
+    'action': 'Action',
+    'queue': 'Queue', 'queue name': 'Queue',
+    'rep': 'Rep', 'rep name': 'Rep', 'reps': 'Rep',
+    'details': 'Details',
+}
+
+# New weight in the details of weight updates ("Updated weight to 50", "..., weight 50")
+WEIGHT_PATTERN = r"weight (?:to )?(\d+)"
+
+# Bulk actions log several reps in one row, joined like this
+REP_SEPARATOR = ", "
+
+# How long fetched records are reused before the sheet is read again
+DEFAULT_TTL = 300
+
+ANALYTICS_CACHE_SIZE = 32
+
+# Periods are closed and labelled on the left, so each row is labelled with the day it
+# starts: weeks run Monday to Sunday under the Monday's date
+FREQUENCIES = {'Day': 'D', 'Week': 'W-MON', 'Month': 'MS'}
+
+
+def records_version(records):
+    return hashlib.blake2b(json.dumps(records, sort_keys=True, default=str).encode(), digest_size=8).hexdigest()
+
+
+# Sheet records -> frame with COLUMNS, a datetime Timestamp, categorical labels and
+# the new weight (NaN when the row isn't a weight change), sorted by time
+def typed_frame(records):
+    raw = pd.DataFrame.from_records(records)
+    raw = raw.rename(columns={c: COLUMN_ALIASES.get(str(c).strip().lower(), c) for c in raw.columns})
+    frame = pd.DataFrame(index=raw.index)
+    frame['Timestamp'] = pd.to_datetime(raw['Timestamp'], errors='coerce') if 'Timestamp' in raw else pd.NaT
+    for column in ('User', 'Action', 'Queue', 'Rep'):
+        values = raw[column].astype(str) if column in raw else pd.Series("", index=raw.index)
+        frame[column] = values.astype('category')
+    frame['Details'] = raw['Details'].astype(str) if 'Details' in raw else ""
+    frame['Weight'] = pd.to_numeric(frame['Details'].str.extract(WEIGHT_PATTERN, expand=False), errors='coerce')
+    dropped = int(frame['Timestamp'].isna().sum())
+    if dropped:
+        logger.warning(f"Ignoring {dropped} audit rows without a readable timestamp")
+    return frame.dropna(subset=['Timestamp']).sort_values('Timestamp', kind='stable').reset_index(drop=True)
+
+
+class AuditLog:
+    """One version of the audit log. Analytics are cached per filter combination."""
+
+    def __init__(self, frame, version):
+        self.frame = frame
+        self.version = version
+        self._derived = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _derive(self, key, fn):
+        with self._lock:
+            if key in self._derived:
+                self._derived.move_to_end(key)
+                metrics.inc("cache_hits", cache="audit")
+                return self._derived[key]
+        metrics.inc("cache_misses", cache="audit")
+        value = fn()
+        with self._lock:
+            self._derived[key] = value
+            while len(self._derived) > ANALYTICS_CACHE_SIZE:
+                self._derived.popitem(last=False)
+        return value
+
+    # Rows between two dates (inclusive, either may be None), for the given actions
+    # (None for all) and users whose address contains `user`
+    def filtered(self, start=None, end=None, actions=None, user=""):
+        def build():
+            frame = self.frame
+            mask = pd.Series(True, index=frame.index)
+            if start is not None:
+                mask &= frame['Timestamp'] >= pd.Timestamp(start)
+            if end is not None:
+                mask &= frame['Timestamp'] < pd.Timestamp(end) + pd.Timedelta(days=1)
+            if actions:
+                mask &= frame['Action'].isin(actions)
+            if user:
+                mask &= frame['User'].astype(str).str.contains(user, case=False, regex=False)
+            return frame[mask]
+        return self._derive(('filtered', start, end, tuple(actions or ()), user), build)
+
+    # One row per rep per change, for the reps of bulk actions
+    def _by_rep(self, filters):
+        def build():
+            frame = self.filtered(*filters)
+            reps = frame['Rep'].astype(str).str.split(REP_SEPARATOR, regex=False).explode()
+            return frame.drop(columns='Rep').join(reps.rename('Rep'))
+        return self._derive(('by_rep',) + filters, build)
+
+    # Changes per period (rows) and value of `by` (columns), keeping the `top` busiest
+    # values and summing the rest into "Other"
+    def counts_over_time(self, filters, by='Action', freq='W-MON', top=10):
+        def build():
+            frame = self._by_rep(filters) if by == 'Rep' else self.filtered(*filters)
+            period = pd.Grouper(key='Timestamp', freq=freq, label='left', closed='left')
+            counts = (frame.groupby([period, by], observed=True)
+                      .size().unstack(fill_value=0))
+            if counts.shape[1] > top:
+                busiest = counts.sum().nlargest(top).index
+                other = counts.drop(columns=busiest).sum(axis=1)
+                counts = counts[busiest].assign(Other=other)
+            return counts
+        return self._derive(('over_time', filters, by, freq, top), build)
+
+    # The n most changed values of `column` ('Queue', 'Rep' or 'User') with their
+    # change counts and last change
+    def most_changed(self, filters, column='Queue', n=20):
+        def build():
+            frame = self._by_rep(filters) if column == 'Rep' else self.filtered(*filters)
+            frame = frame[frame[column].astype(str) != ""]
+            grouped = frame.groupby(column, observed=True)['Timestamp'].agg(['size', 'max'])
+            grouped = grouped.nlargest(n, 'size').reset_index()
+            grouped.columns = [column, 'Changes', 'Last change']
+            return grouped
+        return self._derive(('most_changed', filters, column, n), build)
+
+    # Weight churn per rep: how many weight changes, the spread of the weights set and
+    # the average / largest jump from the previous weight in the same queue
+    def weight_volatility(self, filters):
+        def build():
+            frame = self._by_rep(filters).dropna(subset=['Weight'])
+            frame = frame.sort_values('Timestamp', kind='stable')
+            jumps = frame.groupby(['Rep', 'Queue'], observed=True)['Weight'].diff().abs()
+            result = frame.assign(Jump=jumps).groupby('Rep', observed=True).agg(
+                Changes=('Weight', 'size'),
+                Queues=('Queue', 'nunique'),
+                **{'Mean weight': ('Weight', 'mean'), 'Weight std': ('Weight', 'std'),
+                   'Mean jump': ('Jump', 'mean'), 'Max jump': ('Jump', 'max')}
+            )
+            return result.sort_values(['Weight std', 'Changes'], ascending=False).round(1).reset_index()
+        return self._derive(('volatility', filters), build)
+
+
+class AuditCache:
+    """The latest AuditLog, re-read from `fetch` (returning sheet records) after `ttl` seconds."""
+
+    def __init__(self, fetch, ttl=DEFAULT_TTL):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.current = None  # (AuditLog, fetched_at)
+
+    def get(self):
+        with self.lock:
+            if self.current is not None and time.time() - self.current[1] < self.ttl:
+                return self.current[0]
+            with metrics.span("audit.load"):
+                records = self.fetch()
+                version = records_version(records)
+                if self.current is not None and self.current[0].version == version:
+                    log = self.current[0]
+                else:
+                    log = AuditLog(typed_frame(records), version)
+            self.current = (log, time.time())
+            return log
+
+    # Read the sheet again on next use, e.g. after logging an action
+    def invalidate(self):
+        with self.lock:
+            if self.current is not None:
+                self.current = (self.current[0], 0)
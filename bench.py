@@ -0,0 +1,359 @@
+"""End-to-end load benchmark for the dashboard pipeline.
+
+Starts mock_server.py in-process (or targets --base-url), then times
+fetch -> generate_statistics -> render -> mutation using the real functions
+from chili.py and reports latency percentiles and peak memory per phase:
+
+    python bench.py --queues 500 --reps 2000 --iterations 20
+    python bench.py --json bench_output.txt                 # save a baseline
+    python bench.py --compare bench_output.txt --max-regression 0.25
+
+--freshness instead compares a polling-only snapshot cache with one fed by
+the webhook receiver, replaying the mock's recorded change events, and
+reports how long changes take to show up and how often /queue was polled:
+
+    python bench.py --freshness --duration 30 --poll-ttl 10
+
+--parallel times generate_statistics on a synthetic multi-workspace payload
+(generated in-process, no server) built serially and with 2, 4... pool workers,
+and reports the speedup over the serial build. The first example is just above
+queue_data.PARALLEL_MIN_MEMBERSHIPS (about 110k memberships), the smallest payload
+the dashboard builds on the pool:
+
+    python bench.py --parallel --queues 4000 --reps 10000 --workspaces 8 --max-members 60
+    python bench.py --parallel --queues 20000 --reps 10000 --workspaces 8 --max-members 60
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import queue as queue_module
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+import reports
+from mock_server import MockChiliServer, generate_account
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+# Time `fn` over several iterations, then run it once more under tracemalloc for peak memory
+def run_phase(name, fn, iterations):
+    timings = []
+    errors = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        if fn() is False:
+            errors += 1
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'phase': name,
+        'iterations': iterations,
+        'errors': errors,
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'max_ms': max(timings) if timings else 0.0,
+        'peak_mem_kb': peak / 1024,
+    }
+
+
+def build_phases(chili, rng):
+    state = {}
+
+    def fetch():
+        state['data'] = chili.fetch_queue_data()
+
+    def stats_all():
+        state['stats'] = chili.generate_statistics(state['data'], "All", "All", "All")
+
+    def stats_sales():
+        chili.generate_statistics(state['data'], "Sales", "All", "All")
+
+    def render_participation():
+        stats = state['stats']
+        html = ""
+        for queues, reps in ((stats['sales_queues'], None), (stats['cs_queues'], stats['cs_users'])):
+            if queues:
+                df = reports.build_participation_df(stats, queues, reps=reps)
+                html += reports.create_scrollable_table(df, stats['queue_links'])
+        return bool(html) or None
+
+    def pick_membership():
+        queue_name, reps = rng.choice(list(state['stats']['queue_pivot'].items()))
+        return queue_name, rng.choice(reps)
+
+    def mutate_weight():
+        queue_name, (rep_name, _, _, _, user_id, queue_id) = pick_membership()
+        return chili.update_queue_member_weight(queue_id, [user_id], rng.randint(1, 100), queue_name, rep_name)
+
+    def mutate_unassign_assign():
+        _, (_, weight, _, _, user_id, queue_id) = pick_membership()
+        if not chili.remove_reps_from_queue(queue_id, [user_id]):
+            return False
+        return chili.add_rep_to_queue(queue_id, [user_id], weight or None)
+
+    return [
+        ('fetch_queue_data', fetch),
+        ('generate_statistics[All]', stats_all),
+        ('generate_statistics[Sales]', stats_sales),
+        ('render_participation', render_participation),
+        ('update_weight', mutate_weight),
+        ('unassign+assign', mutate_unassign_assign),
+    ]
+
+
+# Mutate weights through the API for `duration` seconds while two caches are read
+# continuously: one that only polls every poll_ttl seconds, and one that polls at
+# webhooks.SAFETY_NET_TTL but gets the mock's change events replayed into a receiver.
+def run_freshness(server, args):
+    import chili_api
+    import snapshots
+    import webhooks
+
+    rng = random.Random(args.seed)
+    writer = chili_api.ChiliClient(server.base_url, "writer")
+    stores = {
+        'polling': snapshots.WorkspaceStore(chili_api.ChiliClient(server.base_url, "polling"), {},
+                                            default_ttl=args.poll_ttl),
+        'webhooks': snapshots.WorkspaceStore(chili_api.ChiliClient(server.base_url, "webhooks"), {},
+                                             default_ttl=webhooks.SAFETY_NET_TTL),
+    }
+    receiver = webhooks.WebhookReceiver().start()
+    receiver.register("bench", stores['webhooks'])
+    for store in stores.values():
+        store.payload("All")
+
+    # Recorded events are replayed to the receiver as they come in
+    recorded = queue_module.Queue()
+    server.account.listeners.append(recorded.put)
+    stop = threading.Event()
+
+    def replay_events():
+        while not stop.is_set():
+            try:
+                event = recorded.get(timeout=0.1)
+            except queue_module.Empty:
+                continue
+            webhooks.replay([event], receiver.url, speed=0)
+    replayer = threading.Thread(target=replay_events, daemon=True)
+    replayer.start()
+
+    memberships = [(q['id'], m['id']) for q in server.account.queues for m in q['members']]
+    pending = {name: {} for name in stores}  # (queue id, user id) -> (weight, changed at)
+    lags = {name: [] for name in stores}
+    next_change = time.time()
+    deadline = time.time() + args.duration
+    changes = 0
+    while time.time() < deadline:
+        now = time.time()
+        if now >= next_change:
+            queue_id, user_id = rng.choice(memberships)
+            weight = 1000 + changes
+            writer.update_weight(queue_id, [user_id], weight)
+            changes += 1
+            for name in stores:
+                pending[name][(queue_id, user_id)] = (weight, time.time())
+            next_change = now + args.change_interval
+        for name, store in stores.items():
+            snapshot = store.payload("All")
+            weights = snapshot.derive_index('bench_weights', lambda: {
+                (q['id'], m['id']): m['weight'] for q in snapshot.elements for m in q['members']})
+            for key, (weight, changed_at) in list(pending[name].items()):
+                if weights.get(key) == weight:
+                    lags[name].append(time.time() - changed_at)
+                    del pending[name][key]
+        time.sleep(0.02)
+    stop.set()
+    replayer.join()
+    receiver.stop()
+
+    print(f"\n{changes} weight changes over {args.duration:.0f}s, polling TTL {args.poll_ttl:.0f}s, "
+          f"safety-net TTL {webhooks.SAFETY_NET_TTL:.0f}s\n")
+    header = f"{'cache':<12}{'p50 lag s':>11}{'p95 lag s':>11}{'max lag s':>11}{'never seen':>12}{'GET /queue':>12}"
+    print(header)
+    print("-" * len(header))
+    for name in stores:
+        samples = lags[name]
+        polls = server.account.requests[("GET", "/queue", name)]
+        print(f"{name:<12}{percentile(samples, 50):>11.2f}{percentile(samples, 95):>11.2f}"
+              f"{max(samples, default=0):>11.2f}{len(pending[name]):>12}{polls:>12}")
+
+
+# generate_statistics over the same payload serially and with each worker count,
+# after one untimed build so imports and first-touch allocations aren't counted
+def run_parallel(args):
+    import queue_data
+
+    account = generate_account(n_queues=args.queues, n_reps=args.reps, n_workspaces=args.workspaces,
+                               max_members=args.max_members, seed=args.seed)
+    payload = {'elements': account['queues']}
+    memberships = sum(len(q['members']) for q in account['queues'])
+    # Always take the pool path, so small payloads show the overhead too
+    threshold = queue_data.PARALLEL_MIN_MEMBERSHIPS
+    queue_data.PARALLEL_MIN_MEMBERSHIPS = 0
+    # The serial build (one worker) is always the baseline
+    counts = [1] + [int(w) for w in args.workers.split(",") if int(w) > 1]
+
+    results = []
+    for workers in counts:
+        queue_data.generate_statistics(payload, "All", "All", "All", workers=workers)
+        results.append(run_phase(f"generate_statistics[{workers}w]", lambda: queue_data.generate_statistics(
+            payload, "All", "All", "All", workers=workers), args.iterations))
+
+    print(f"\n{args.queues} queues, {memberships} memberships in {args.workspaces} workspaces, "
+          f"{args.iterations} iterations, {os.cpu_count()} CPUs")
+    print(f"PARALLEL_MIN_MEMBERSHIPS is {threshold}: the dashboard builds this payload "
+          f"{'on the pool' if memberships >= threshold else 'serially'}\n")
+    header = f"{'workers':<10}{'p50 ms':>10}{'p95 ms':>10}{'speedup':>10}{'efficiency':>12}"
+    print(header)
+    print("-" * len(header))
+    base = results[0]['p50_ms']
+    for workers, r in zip(counts, results):
+        speedup = base / r['p50_ms'] if r['p50_ms'] else 0.0
+        print(f"{'serial' if workers == 1 else workers:<10}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{speedup:>9.2f}x{speedup / workers:>12.0%}")
+    return results
+
+
+def print_report(results, baseline=None):
+    header = f"{'phase':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'peak KiB':>11}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        line = (f"{r['phase']:<28}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                f"{r['max_ms']:>10.2f}{r['peak_mem_kb']:>11.0f}{r['errors']:>8}")
+        if baseline and r['phase'] in baseline:
+            before = baseline[r['phase']]['p50_ms']
+            if before:
+                line += f"  ({(r['p50_ms'] - before) / before:+.0%} p50)"
+        print(line)
+
+
+def find_regressions(results, baseline, max_regression):
+    regressions = []
+    for r in results:
+        before = baseline.get(r['phase'])
+        if not before:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            if before[key] and r[key] > before[key] * (1 + max_regression):
+                regressions.append(f"{r['phase']} {key}: {before[key]:.2f} -> {r[key]:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard pipeline against the mock API")
+    parser.add_argument("--base-url", help="use an already running mock server instead of starting one")
+    parser.add_argument("--queues", type=int, default=300)
+    parser.add_argument("--reps", type=int, default=1000)
+    parser.add_argument("--workspaces", type=int, default=2)
+    parser.add_argument("--max-members", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline results file written by --json")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="fail when p50/p95 is this fraction slower than the baseline")
+    parser.add_argument("--freshness", action="store_true",
+                        help="compare polling with webhook invalidation instead of timing phases")
+    parser.add_argument("--duration", type=float, default=20, help="--freshness run time in seconds")
+    parser.add_argument("--poll-ttl", type=float, default=5, help="--freshness polling interval in seconds")
+    parser.add_argument("--change-interval", type=float, default=0.5,
+                        help="--freshness seconds between weight changes")
+    parser.add_argument("--parallel", action="store_true",
+                        help="time generate_statistics with several pool sizes instead of timing phases")
+    parser.add_argument("--workers", default="2,4,8",
+                        help="--parallel pool worker counts, comma separated; the serial build is always timed")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.freshness and args.base_url:
+        parser.error("--freshness needs the in-process mock server; drop --base-url")
+
+    if args.parallel:
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.CRITICAL)
+        results = run_parallel(args)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({'args': vars(args), 'results': results}, f, indent=2)
+        return
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        server = MockChiliServer(
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+            n_queues=args.queues, n_reps=args.reps, n_workspaces=args.workspaces,
+            max_members=args.max_members, seed=args.seed,
+        ).start()
+        base_url = server.base_url
+
+    if args.freshness:
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.CRITICAL)
+        try:
+            run_freshness(server, args)
+        finally:
+            server.stop()
+        return
+
+    # chili.py reads its configuration at import time
+    os.environ["CHILI_API_BASE_URL"] = base_url
+    os.environ.setdefault("CHILI_API_KEY", "mock")
+    import chili
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    try:
+        results = [run_phase(name, fn, args.iterations)
+                   for name, fn in build_phases(chili, random.Random(args.seed))]
+    finally:
+        if server:
+            server.stop()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r['phase']: r for r in json.load(f)['results']}
+
+    print(f"\n{args.queues} queues, {args.reps} reps, {args.iterations} iterations against {base_url}\n")
+    print_report(results, baseline)
+    print(f"\nmax RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+    if baseline:
+        regressions = find_regressions(results, baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
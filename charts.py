@@ -0,0 +1,44 @@
+"""Chart data and Plotly figures for the Reps by Queue and Queues by Size sections.
+
+Figures are built from a snapshot's statistics and their specs cached on the
+snapshot by chili.py, keyed by the filters and top-N, so entering a chart
+section or rerunning for an unrelated widget only rebuilds the Figure object. Past the top N, the long tail
+is folded into one "Other" bar or slice to keep the figure spec sent to the
+browser bounded.
+"""
+import pandas as pd
+import plotly.express as px
+
+# Bars / slices shown before the rest is folded into "Other"
+DEFAULT_TOP_N = 30
+MAX_TOP_N = 200
+
+
+# Frame of (label, Count) sorted by count, with everything past the top_n rows
+# folded into one "Other" row using `other_agg` ('sum' or 'mean'). Returns the
+# frame and how many entries were folded.
+def top_n_frame(counts, label, top_n, other_agg='sum', noun='entries'):
+    frame = pd.DataFrame({label: list(counts.keys()), 'Count': list(counts.values())})
+    frame = frame.sort_values('Count', ascending=False, kind='stable').reset_index(drop=True)
+    if len(frame) <= top_n:
+        return frame, 0
+    tail = frame['Count'].iloc[top_n:]
+    other_label = f"Other ({len(tail)} {noun}{', avg' if other_agg == 'mean' else ''})"
+    other = pd.DataFrame({label: [other_label], 'Count': [round(float(tail.agg(other_agg)), 1)]})
+    return pd.concat([frame.iloc[:top_n], other], ignore_index=True), len(tail)
+
+
+# The "Other" bar shows the average queue size of the folded queues, so it stays
+# comparable with the bars next to it
+def reps_by_queue_chart(reps_by_queue, top_n=DEFAULT_TOP_N):
+    frame, folded = top_n_frame(reps_by_queue, 'Queue Name', top_n, other_agg='mean', noun='queues')
+    fig = px.bar(frame, x='Queue Name', y='Count', title='Reps by Queue')
+    fig.update_layout(xaxis_tickangle=-45, height=600)
+    return fig, folded
+
+
+def queues_by_size_chart(queues_by_size, top_n=DEFAULT_TOP_N):
+    sizes = {str(size): count for size, count in queues_by_size.items()}
+    frame, folded = top_n_frame(sizes, 'Number of Reps', top_n, other_agg='sum', noun='sizes')
+    fig = px.pie(frame, values='Count', names='Number of Reps', title='Distribution of Queue Sizes')
+    return fig, folded
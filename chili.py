@@ -1,19 +1,44 @@
 import streamlit as st
-import json
 import pandas as pd
-import requests
-from collections import Counter, defaultdict
+import numpy as np
+import plotly.graph_objects as go
 import os
 from dotenv import load_dotenv
 import logging
 from datetime import datetime
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+import cProfile
+import io
+import pstats
+import threading
+import alerts
+import audit
+import charts
+import chili_api
+import export
+import logs
+import metrics
+import rebalance
+import reconcile
+import reports
+import search
+import simulate
+import snapshots
+import stats_api
+import tenants
+import ui_state
+import webhooks
+from queue_data import WORKSPACE_CONFIG, extract_size_range
+from reports import build_participation_matrix
+
+# Google Sheets backs the audit log; without it actions just aren't logged
+try:
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+except ImportError:
+    gspread = None
+
+# Configure logging: JSON lines written off the script thread (see logs.py)
+logs.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Set page config (this must be the first Streamlit command)
@@ -22,27 +47,47 @@ st.set_page_config(page_title="BizOps 💥", page_icon="💥", layout="wide")
 # Load environment variables from .env file
 load_dotenv()
 
-# Chili Piper API configuration
-API_BASE_URL = "https://edge.na.chilipiper.com"
+# Chili Piper API configuration (override the base URL to point at mock_server.py)
+API_BASE_URL = os.getenv("CHILI_API_BASE_URL", chili_api.DEFAULT_BASE_URL)
 
 # Try to get API_KEY from environment variable first, then from Streamlit secrets
 API_KEY = os.getenv("CHILI_API_KEY")
-if not API_KEY:
+if not API_KEY and not os.getenv("CHILI_TENANTS"):
     try:
         API_KEY = st.secrets["CHILI_API_KEY"]
     except FileNotFoundError:
         st.error("CHILI_API_KEY is not set. Please set it in your .env file or Streamlit secrets.")
         st.stop()
 
-if not API_KEY:
-    st.error("CHILI_API_KEY is not set. Please set it in your .env file or Streamlit secrets.")
+# One tenant per (region, API key); see tenants.py for CHILI_TENANTS
+TENANTS = tenants.load_tenants(API_BASE_URL, API_KEY, WORKSPACE_CONFIG,
+                               default_discover=not os.getenv("CHILI_WORKSPACES"))
+if not TENANTS:
+    if os.getenv("CHILI_TENANTS"):
+        st.error("CHILI_TENANTS has no usable tenant. Check the logs for the reason.")
+    else:
+        st.error("CHILI_API_KEY is not set. Please set it in your .env file or Streamlit secrets.")
     st.stop()
 
-# Workspace ID to name mapping
-WORKSPACE_NAMES = {
-    "64ad3cc865a4906cd3cc2dcf": "Sales",
-    "61b9daad2747672e7282273d": "CS"
-}
+# Optional Prometheus endpoint (started once per process, survives reruns)
+METRICS_PORT = os.getenv("CHILI_METRICS_PORT")
+if METRICS_PORT:
+    metrics.start_metrics_server(int(METRICS_PORT))
+
+# Optional receiver for change events; while it runs, the snapshot cache only
+# polls the API as a safety net (see webhooks.py)
+WEBHOOK_PORT = os.getenv("CHILI_WEBHOOK_PORT")
+WEBHOOK_RECEIVER = None
+if WEBHOOK_PORT:
+    WEBHOOK_RECEIVER = webhooks.start_webhook_server(int(WEBHOOK_PORT), os.getenv("CHILI_WEBHOOK_HOST", "127.0.0.1"),
+                                                     os.getenv("CHILI_WEBHOOK_SECRET"))
+
+# Optional read-only JSON API over the same snapshot cache (see stats_api.py)
+STATS_API_PORT = os.getenv("CHILI_STATS_API_PORT")
+STATS_API = None
+if STATS_API_PORT:
+    STATS_API = stats_api.start_stats_api(int(STATS_API_PORT), os.getenv("CHILI_STATS_API_HOST", "127.0.0.1"),
+                                          os.getenv("CHILI_STATS_API_TOKEN"))
 
 # Custom CSS
 st.markdown("""
@@ -283,141 +328,152 @@ ACTION_TYPES = {
     "REP_ADD": "Added rep to queue"
 }
 
+# Audit action for each reconcile plan operation
+RECONCILE_ACTIONS = {
+    'add': ACTION_TYPES["REP_ADD"],
+    'remove': ACTION_TYPES["REP_REMOVE"],
+    'update': ACTION_TYPES["WEIGHT_UPDATE"]
+}
+
 # Add these constants at the top of the file with other constants
 SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive'
 ]
 
+# Bulk weight rebalancing strategies (see rebalance.py)
+REBALANCE_STRATEGIES = [
+    "Normalize queues to sum to 100",
+    "Set rep weight everywhere",
+    "Scale weights by factor"
+]
+
+# Membership reconciliation: concurrent API calls and where checkpoints are kept
+RECONCILE_WORKERS = 8
+CHECKPOINT_DIR = os.getenv("CHILI_CHECKPOINT_DIR", "checkpoints")
+
+# Spooled export files, one per snapshot version, dataset and format
+EXPORT_DIR = os.getenv("CHILI_EXPORT_DIR", "exports")
+
+# Precompute common views after every refresh (see reports.py); CHILI_REPORTS=0 turns it off
+MATERIALIZE_REPORTS = os.getenv("CHILI_REPORTS", "1").lower() not in ("0", "false", "no")
+
+# Coverage and anomaly alerts after every refresh (see alerts.py); CHILI_ALERTS=0 turns them off
+ALERTS_ENABLED = os.getenv("CHILI_ALERTS", "1").lower() not in ("0", "false", "no")
+
+# Number of reruns kept in the Performance panel's history
+PERF_HISTORY_SIZE = 20
+
+# Profiling: CHILI_PROFILE=N profiles the next N reruns after the server starts
+# ("true" for one); admins can profile a single rerun with ?profile=1. Reports are
+# written to CHILI_PROFILE_DIR, keeping the PROFILE_KEEP most recent.
+_profile_setting = os.getenv("CHILI_PROFILE", "").strip().lower()
+PROFILE_RERUNS = 1 if _profile_setting in ("true", "yes") else int(_profile_setting) if _profile_setting.isdigit() else 0
+PROFILE_DIR = os.getenv("CHILI_PROFILE_DIR", "profiles")
+PROFILE_TOP_N = 25
+PROFILE_KEEP = 20
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("CHILI_ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# Shared API client; cached so the pooled connections survive reruns
+@st.cache_resource
+def get_api_client(base_url, api_key, rate_limit=None):
+    return chili_api.ChiliClient(base_url, api_key, rate_limit=rate_limit)
+
+# Process-wide workspace snapshot cache of one tenant. Workspaces are discovered
+# from the data unless the tenant pins the list.
+@st.cache_resource
+def get_workspace_store(tenant_name):
+    tenant = TENANTS[tenant_name]
+    store = snapshots.WorkspaceStore(
+        get_tenant_client(tenant),
+        tenant.workspaces,
+        discover=tenant.discover,
+        default_ttl=webhooks.SAFETY_NET_TTL if WEBHOOK_RECEIVER else snapshots.DEFAULT_TTL,
+        app_url=tenant.app_url
+    )
+    if WEBHOOK_RECEIVER:
+        WEBHOOK_RECEIVER.register(tenant.slug, store)
+    if STATS_API:
+        STATS_API.register(tenant.slug, store)
+    if MATERIALIZE_REPORTS:
+        reports.ReportScheduler(store)
+    return store
+
+# Alert engine of one tenant, re-evaluated whenever its store publishes a new version
+@st.cache_resource
+def get_alert_engine(tenant_name):
+    return alerts.AlertEngine(tenant_name, sinks=alerts.configured_sinks()).watch(get_workspace_store(tenant_name))
+
+# Tenant picked in the sidebar (the first configured one by default)
+def active_tenant():
+    return TENANTS.get(st.session_state.get('tenant'), next(iter(TENANTS.values())))
+
+def get_tenant_client(tenant=None):
+    tenant = tenant or active_tenant()
+    return get_api_client(tenant.base_url, tenant.api_key, tenant.rate_limit)
+
+# Structures derived from a shared snapshot are cached on the snapshot itself,
+# so they are built once per version and released along with it
+def get_membership_frame(snapshot, workspace_names):
+    return snapshot.derive_index('membership_frame', lambda: rebalance.membership_frame(snapshot, workspace_names))
+
+def get_routing_model(snapshot, workspace_names):
+    return snapshot.derive_index('routing_model',
+                                 lambda: simulate.RoutingModel(get_membership_frame(snapshot, workspace_names)))
+
+def get_search_index(snapshot, workspace_names):
+    return snapshot.derive_index('search_index', lambda: search.SearchIndex(snapshot, workspace_names))
+
+# Queue, membership and user ids of a snapshot, for pruning session state
+def get_state_keys(snapshot):
+    return snapshot.derive_index('state_keys', lambda: ui_state.snapshot_keys(snapshot.elements))
+
+# Reps and size ranges offered by the filters
+def get_filter_options(snapshot):
+    def build():
+        all_reps = frozenset(member['name'] for q in snapshot['elements'] for member in q.get('members', []))
+        # Verify which ranges have active queues
+        active_size_ranges = set()
+        for queue in snapshot['elements']:
+            if queue['active'] and queue.get('members'):
+                size_range = extract_size_range(queue)
+                if size_range:
+                    active_size_ranges.add(size_range)
+        return all_reps, frozenset(active_size_ranges)
+    return snapshot.derive_index('filter_options', build)
+
+# (figure, folded count) of a chart section for the current filters; `stats` must be
+# the statistics of `snapshot` under those filters. Figures are mutable, so the
+# snapshot caches the figure's spec and every call gets a Figure of its own.
+def get_chart(snapshot, stats, chart, filters, top_n):
+    build = charts.reps_by_queue_chart if chart == 'reps_by_queue' else charts.queues_by_size_chart
+
+    def build_spec():
+        fig, folded = build(stats[chart], top_n)
+        return fig.to_dict(), folded
+    spec, folded = snapshot.derive(('chart', chart, filters, top_n), build_spec)
+    return go.Figure(spec), folded
+
 # Function to fetch queue data from Chili Piper API
+@metrics.timed()
 def fetch_queue_data():
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-    params = {
-        "pageSize": "100"
-    }
     try:
         logger.info("Fetching queue data from API")
-        response = requests.get(f"{API_BASE_URL}/queue", headers=headers, params=params)
-        response.raise_for_status()
-        logger.info(f"Successfully fetched queue data. Status code: {response.status_code}")
-        return response.json()
+        data = get_tenant_client().list_queues()
+        logger.info("Successfully fetched queue data. %d queues", len(data['elements']))
+        return data
     except Exception as e:
-        logger.error(f"Error fetching queue data: {str(e)}")
+        logger.error("Error fetching queue data: %s", e)
         raise
 
-# Function to generate statistics
-def generate_statistics(json_data, selected_workspace, selected_rep, selected_size):
-    # Filter active queues with members and sort by name, excluding "Existing Customer - Owner"
-    active_queues = sorted(
-        [q for q in json_data['elements'] if q['active'] and q.get('members') and 
-         q['name'] != "Existing Customer - Owner" and
-         (selected_workspace == "All" or WORKSPACE_NAMES.get(q['workspaceId'], q['workspaceId']) == selected_workspace) and
-         (selected_size == "All" or extract_size_range(q) == selected_size)],
-        key=lambda x: len(x.get('members', [])),
-        reverse=True
-    )
-
-    stats = {
-        'total_queues': len(active_queues),
-        'total_reps': sum(len(q.get('members', [])) for q in active_queues),
-        'queues_by_size': Counter(len(q.get('members', [])) for q in active_queues),
-        'reps_by_queue': {q['name']: len(q.get('members', [])) for q in active_queues},
-        'main_reps': sum(1 for q in active_queues for m in q.get('members', []) if m.get('main', False)),
-        'mandatory_reps': sum(1 for q in active_queues for m in q.get('members', []) if m.get('mandatory', False)),
-        'queue_pivot': {},
-        'rep_pivot': defaultdict(list),
-        'workspaces': set(),
-        'queue_links': {}
-    }
-
-    # Generate queue pivot and rep pivot
-    for queue in active_queues:
-        queue_name = queue['name']
-        stats['workspaces'].add(WORKSPACE_NAMES.get(queue['workspaceId'], queue['workspaceId']))
-        members = [(member['name'], member['weight'], member['order'], member['initialOrder'], member['id'], queue['id']) 
-                  for member in queue.get('members', [])
-                  if selected_rep == "All" or member['name'] == selected_rep]
-        if members:
-            stats['queue_pivot'][queue_name] = sorted(members, key=lambda x: x[2])
-        
-        for member in queue.get('members', []):
-            if selected_rep == "All" or member['name'] == selected_rep:
-                stats['rep_pivot'][member['name']].append((
-                    queue_name, 
-                    member['weight'], 
-                    member['order'], 
-                    member['initialOrder'],
-                    member['id'],  # Add user ID
-                    queue['id']    # Add queue ID
-                ))
-        
-        # Sort rep_pivot entries by order
-        for rep_name in stats['rep_pivot']:
-            stats['rep_pivot'][rep_name] = sorted(stats['rep_pivot'][rep_name], key=lambda x: x[2])
-
-        # Add queue link
-        stats['queue_links'][queue_name] = f"https://connecteam.na.chilipiper.com/admin-center/meetings/{queue['workspaceId']}/queues/edit/{queue['id']}"
-
-    # New: Generate AE participation data
-    ae_participation = defaultdict(lambda: defaultdict(int))
-    sales_queues = []
-    cs_queues = []
-
-    for queue in active_queues:
-        queue_name = queue['name']
-        workspace = WORKSPACE_NAMES.get(queue['workspaceId'], queue['workspaceId'])
-        
-        if workspace == "Sales":
-            sales_queues.append(queue_name)
-        elif workspace == "CS":
-            cs_queues.append(queue_name)
-        
-        for member in queue.get('members', []):
-            ae_participation[member['name']][queue_name] = member['weight']
-
-    # Remove users that only appear in "Existing Customer - Owner" queue
-    existing_customer_owner_queue = next((q for q in json_data['elements'] if q['name'] == "Existing Customer - Owner"), None)
-    if existing_customer_owner_queue:
-        existing_customer_owner_members = set(m['name'] for m in existing_customer_owner_queue.get('members', []))
-        users_to_remove = existing_customer_owner_members - set(ae_participation.keys())
-        for user in users_to_remove:
-            if user in ae_participation:
-                del ae_participation[user]
-
-    stats['ae_participation'] = ae_participation
-    stats['sales_queues'] = sorted(sales_queues)
-    stats['cs_queues'] = sorted(cs_queues)
-
-    # Inside the generate_statistics function, add this before returning stats:
-    cs_users = set()
-    for queue in active_queues:
-        if WORKSPACE_NAMES.get(queue['workspaceId']) == "CS":
-            for member in queue.get('members', []):
-                cs_users.add(member['name'])
-    stats['cs_users'] = list(cs_users)
-
-    return stats
-
 # Add this new function to handle API calls
 def update_queue_member_weight(queue_id, user_ids, weight, queue_name, rep_name):
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "users": user_ids,
-        "weight": weight
-    }
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/queue/{queue_id}/user/update/weighted",
-            headers=headers,
-            json=payload
-        )
-        response.raise_for_status()
+        logger.info("Updating weight of %d users in queue_id=%s to %s", len(user_ids), queue_id, weight,
+                    extra={'queue_id': queue_id, 'user_count': len(user_ids), 'weight': weight})
+        logger.debug("Updating weight of user_ids=%s in queue_id=%s", user_ids, queue_id)
+        get_tenant_client().update_weight(queue_id, user_ids, weight)
+        get_workspace_store(active_tenant().name).invalidate_queue(queue_id)
         
         # Log the successful action
         log_action(
@@ -428,64 +484,52 @@ def update_queue_member_weight(queue_id, user_ids, weight, queue_name, rep_name)
         )
         return True
     except Exception as e:
+        logger.error("Error updating weights: queue_id=%s, error=%s", queue_id, e, extra={'queue_id': queue_id})
         st.error(f"Error updating weights: {str(e)}")
         return False
 
 # Add these new functions to handle the API calls
 
 def remove_reps_from_queue(queue_id, user_ids):
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
     try:
-        logger.info(f"Attempting to remove users from queue_id={queue_id}, user_ids={user_ids}")
-        response = requests.post(
-            f"{API_BASE_URL}/queue/{queue_id}/user/unassign",
-            headers=headers,
-            json=user_ids
-        )
-        response.raise_for_status()
-        logger.info(f"Successfully removed users from queue_id={queue_id}")
+        logger.info("Attempting to remove %d users from queue_id=%s", len(user_ids), queue_id,
+                    extra={'queue_id': queue_id, 'user_count': len(user_ids)})
+        logger.debug("Removing user_ids=%s from queue_id=%s", user_ids, queue_id)
+        get_tenant_client().unassign(queue_id, user_ids)
+        get_workspace_store(active_tenant().name).invalidate_queue(queue_id)
+        logger.info("Successfully removed users from queue_id=%s", queue_id, extra={'queue_id': queue_id})
         return True
     except Exception as e:
-        logger.error(f"Error removing users: queue_id={queue_id}, error={str(e)}")
+        logger.error("Error removing users: queue_id=%s, error=%s", queue_id, e, extra={'queue_id': queue_id})
         st.error(f"Error removing users: {str(e)}")
         return False
 
 def add_rep_to_queue(queue_id, user_ids, weight=None):
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
     try:
-        if weight:
-            logger.info(f"Attempting to add users with weight to queue_id={queue_id}, user_ids={user_ids}, weight={weight}")
-            response = requests.post(
-                f"{API_BASE_URL}/queue/{queue_id}/user/assign/weighted",
-                headers=headers,
-                json={"users": user_ids, "weight": weight}
-            )
-        else:
-            logger.info(f"Attempting to add users to queue_id={queue_id}, user_ids={user_ids}")
-            response = requests.post(
-                f"{API_BASE_URL}/queue/{queue_id}/user/assign",
-                headers=headers,
-                json=user_ids
-            )
-        
-        response.raise_for_status()
-        logger.info(f"Successfully added users to queue_id={queue_id}")
+        logger.info("Attempting to add %d users to queue_id=%s, weight=%s", len(user_ids), queue_id, weight,
+                    extra={'queue_id': queue_id, 'user_count': len(user_ids), 'weight': weight})
+        logger.debug("Adding user_ids=%s to queue_id=%s", user_ids, queue_id)
+        get_tenant_client().assign(queue_id, user_ids, weight)
+        get_workspace_store(active_tenant().name).invalidate_queue(queue_id)
+        logger.info("Successfully added users to queue_id=%s", queue_id, extra={'queue_id': queue_id})
         return True
     except Exception as e:
-        logger.error(f"Error adding users: queue_id={queue_id}, error={str(e)}")
+        logger.error("Error adding users: queue_id=%s, error=%s", queue_id, e, extra={'queue_id': queue_id})
         st.error(f"Error adding users: {str(e)}")
         return False
 
+# Bulk changes are refused up front while the API circuit breaker is open,
+# instead of failing call by call
+def mutations_paused(tenant=None):
+    breaker = get_tenant_client(tenant).breaker
+    if breaker.state == "open":
+        st.error(f"Chili Piper API is unavailable, so changes are paused. Try again in {breaker.retry_in():.0f}s.")
+        return True
+    return False
+
 # Add this new function to handle the delete confirmation UI
-def show_delete_confirmation(queue_name, rep_name, queue_id, user_id, i, index):
-    with st.form(key=f"delete_confirmation_{i}_{index}"):
+def show_delete_confirmation(queue_name, rep_name, queue_id, user_id, ui):
+    with st.form(key=f"delete_confirmation_{queue_id}_{user_id}"):
         st.warning(f"⚠️ Are you sure you want to remove {rep_name} from {queue_name}?")
         st.write("This action cannot be undone.")
         
@@ -493,7 +537,7 @@ def show_delete_confirmation(queue_name, rep_name, queue_id, user_id, i, index):
         confirmation = st.selectbox(
             "Select a compliment to confirm removal:",
             options=BIZOPS_COMPLIMENTS,
-            key=f"delete_confirmation_input_{i}_{index}"
+            key=f"delete_confirmation_input_{queue_id}_{user_id}"
         )
         
         col1, col2 = st.columns([1, 1])
@@ -510,14 +554,14 @@ def show_delete_confirmation(queue_name, rep_name, queue_id, user_id, i, index):
             )
         
         if cancel_button:
-            st.session_state[f'removing_rep_{i}_{index}'] = False
+            ui.close(ui_state.REMOVE, queue_id, user_id)
             st.rerun()
             
         if confirm_button:
             if confirmation in BIZOPS_COMPLIMENTS:  # Check if a compliment was selected
                 if remove_reps_from_queue(queue_id, [user_id]):
                     st.success(f"Successfully removed {rep_name} from the queue")
-                    st.session_state[f'removing_rep_{i}_{index}'] = False
+                    ui.close(ui_state.REMOVE, queue_id, user_id)
                     st.rerun()
             else:
                 st.error("Please select a compliment to confirm the removal")
@@ -530,118 +574,118 @@ def validate_add_rep_form(weight, order, main, mandatory, lock):
         return False, "Order must be non-negative"
     return True, ""
 
-# Add this new function at the top level
-def get_sort_key(i, queue_name):
-    """Generate a unique key for storing sort state"""
-    return f"sort_state_{queue_name}_{i}"
-
-# Modify the extract_size_range function:
-def extract_size_range(queue):
-    for rule in queue.get('rules', []):
-        if (rule.get('entity') == 'Contact' and 
-            rule.get('field') == 'numofemployeesrange' and 
-            rule.get('operator') == '='):
-            value = rule.get('value')
-            # Group the ranges
-            if value:
-                try:
-                    # Extract first number from range (e.g., "11-30" -> 11)
-                    first_number = int(value.split('-')[0])
-                    if first_number <= 50:
-                        return "1-50"
-                    elif first_number <= 100:
-                        return "51-100"
-                    else:
-                        return "101 and above"
-                except:
-                    return "No Size"
-    return "No Size"  # Return "No Size" if no size rule is found
-
 # Add this new function to handle order updates
 def update_queue_member_order(queue_id, user_id, order):
     # Note: Since there's no direct API for order updates, we'll use the weight update for now
     # This is a placeholder for when the order update API becomes available
     return True
 
+# Get user email from Streamlit's authentication
+def get_user_email():
+    user_email = "unknown"
+    try:
+        if st.runtime.exists():
+            user_email = st.session_state.get('user_email', 'unknown')
+            if user_email == 'unknown' and hasattr(st, 'experimental_user'):
+                user_email = st.experimental_user.email or 'unknown'
+                st.session_state['user_email'] = user_email
+    except Exception as e:
+        logger.error(f"Error getting user email: {str(e)}")
+    return user_email
+
 # Add this new function to handle audit logging
+@metrics.timed()
 def log_action(action_type: str, queue_name: str, rep_name: str, details: str):
+    log_actions([(action_type, queue_name, rep_name, details)])
+
+# Write several audit entries as (action_type, queue_name, rep_name, details) in one Sheets call
+@metrics.timed()
+def log_actions(actions):
+    if not actions:
+        return
     try:
         sheet = get_google_sheet()
         if sheet:
-            # Get user email from Streamlit's authentication
-            user_email = "unknown"
-            try:
-                if st.runtime.exists():
-                    user_email = st.session_state.get('user_email', 'unknown')
-                    if user_email == 'unknown' and hasattr(st, 'experimental_user'):
-                        user_email = st.experimental_user.email
-                        st.session_state['user_email'] = user_email
-            except Exception as e:
-                logger.error(f"Error getting user email: {str(e)}")
-
-            # Create the log entry with user email
-            log_entry = [
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                user_email,
-                action_type,
-                queue_name,
-                rep_name,
-                details
+            user_email = get_user_email()
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+            # Create the log entries with user email
+            log_entries = [
+                [timestamp, user_email, action_type, queue_name, rep_name, details]
+                for action_type, queue_name, rep_name, details in actions
             ]
             
             # Log the user info for debugging
-            logger.info(f"Logging action by user: {user_email}")
+            logger.info(f"Logging {len(log_entries)} action(s) by user: {user_email}")
             
             # Append to the Google Sheet
-            sheet.append_row(log_entry)
-            logger.info(f"Successfully logged action: {action_type} by {user_email}")
+            with metrics.span("sheets.append_rows"):
+                sheet.append_rows(log_entries)
+            get_audit_cache().invalidate()
+            logger.info(f"Successfully logged {len(log_entries)} action(s) by {user_email}")
         else:
             logger.error("Failed to get Google Sheet connection")
             
     except Exception as e:
-        logger.error(f"Failed to log action: {str(e)}")
+        # Drop the cached connection in case its token or worksheet went stale
+        get_authorized_sheet.clear()
+        metrics.inc("sheets_errors", call="append_rows")
+        logger.error(f"Failed to log {len(actions)} action(s): {str(e)}")
+
+# Authorized worksheet shared by every session; raises on failure so a failed connect isn't cached
+@st.cache_resource
+def get_authorized_sheet():
+    credentials = ServiceAccountCredentials.from_json_keyfile_dict(
+        st.secrets["gcp_service_account"], 
+        SCOPES
+    )
+    gc = gspread.authorize(credentials)
+    return gc.open_by_url(st.secrets["private"]["sheet_url"]).sheet1
 
 # Add this function to handle the Google Sheets connection
+@metrics.timed()
 def get_google_sheet():
+    if gspread is None:
+        logger.error("gspread / oauth2client are not installed, audit logging is disabled")
+        return None
     try:
-        credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-            st.secrets["gcp_service_account"], 
-            SCOPES
-        )
-        gc = gspread.authorize(credentials)
-        return gc.open_by_url(st.secrets["private"]["sheet_url"]).sheet1
+        return get_authorized_sheet()
     except Exception as e:
+        metrics.inc("sheets_errors", call="connect")
         logger.error(f"Failed to connect to Google Sheets: {str(e)}")
         return None
 
+# Typed audit log shared by every session; re-read from the sheet after a few
+# minutes or when this process logs an action
+@st.cache_resource
+def get_audit_cache():
+    def fetch():
+        sheet = get_google_sheet()
+        if sheet is None:
+            raise RuntimeError("Could not connect to Google Sheets")
+        with metrics.span("sheets.get_all_records"):
+            return sheet.get_all_records()
+    return audit.AuditCache(fetch)
+
 # Streamlit app
 def main():
     st.title('BizOps 💥')
     st.subheader('Sales Queue Statistics Dashboard')
 
-    # Fetch queue data from API
+    # Every tenant keeps its own client and cache, so switching back to a warm one doesn't refetch
+    if len(TENANTS) > 1:
+        st.sidebar.selectbox("**Tenant**", list(TENANTS), key="tenant")
+    tenant = active_tenant()
+
+    # Known workspaces come from the snapshot cache (discovered on first use)
+    store = get_workspace_store(tenant.name)
+    alert_engine = get_alert_engine(tenant.name) if ALERTS_ENABLED else None
     try:
-        json_data = fetch_queue_data()
-        all_workspaces = set(WORKSPACE_NAMES.get(q['workspaceId'], q['workspaceId']) for q in json_data['elements'])
-        all_reps = set(member['name'] for q in json_data['elements'] for member in q.get('members', []))
-        
-        # Define the fixed size ranges in the desired order, including "No Size"
-        all_size_ranges = ["1-50", "51-100", "101 and above", "No Size"]
-        
-        # Verify which ranges have active queues
-        active_size_ranges = set()
-        for queue in json_data['elements']:
-            if queue['active'] and queue.get('members'):
-                size_range = extract_size_range(queue)
-                if size_range:
-                    active_size_ranges.add(size_range)
-        
-        # Only show ranges that have active queues
-        all_size_ranges = [size for size in all_size_ranges if size in active_size_ranges]
-        
+        workspace_names = store.workspace_names()
     except Exception as e:
         st.error(f"Error fetching data from Chili Piper API: {str(e)}")
         return
+    all_workspaces = set(workspace_names.values())
 
     # Filters
     col1, col2, col3 = st.columns(3)
@@ -662,6 +706,36 @@ def main():
             st.session_state.workspace_initialized = True
             st.rerun()  # Rerun to apply the default selection
 
+    # Shared, read-only snapshot of the selected workspace's queues (served from cache while fresh)
+    try:
+        json_data = store.payload(selected_workspace)
+        with metrics.span("main.preprocess"):
+            all_reps, active_size_ranges = get_filter_options(json_data)
+            # Editor and sort state of this session, keyed by queue / user ids
+            ui = ui_state.UIState(st.session_state)
+            ui.prune(json_data.version, get_state_keys(json_data))
+
+            # Define the fixed size ranges in the desired order, including "No Size"
+            all_size_ranges = ["1-50", "51-100", "101 and above", "No Size"]
+
+            # Only show ranges that have active queues
+            all_size_ranges = [size for size in all_size_ranges if size in active_size_ranges]
+        
+    except Exception as e:
+        st.error(f"Error fetching data from Chili Piper API: {str(e)}")
+        return
+
+    # Cached data keeps being served while the API is slow or down; say how old it is
+    fetched_at, refresh_error = store.freshness(selected_workspace)
+    breaker = get_tenant_client(tenant).breaker
+    as_of = datetime.fromtimestamp(fetched_at).strftime('%H:%M:%S') if fetched_at else "unknown"
+    if refresh_error is not None or breaker.state != "closed":
+        retry_in = breaker.retry_in()
+        st.warning(f"⚠️ Chili Piper API unavailable, showing data as of {as_of}. "
+                   + (f"Changes are paused; retrying in {retry_in:.0f}s." if retry_in else "Retrying in the background."))
+    else:
+        st.caption(f"Data as of {as_of}")
+
     with col2:
         selected_size = st.selectbox(
             "**Select Size Range**",
@@ -669,14 +743,26 @@ def main():
             help="Filter queues by employee size range"
         )
     with col3:
-        selected_rep = st.selectbox(
-            "**Select Rep**", 
-            ["All"] + list(all_reps), 
-            key="rep_selector"
-        )
+        # Only the top matches are sent to the browser, not every rep in the workspace
+        selected_rep, selected_queue = "All", None
+        query = st.text_input("**Search Reps & Queues**", key="search_query", placeholder="Name, email or id")
+        if query:
+            matches = get_search_index(json_data, workspace_names).search(query)
+            if matches:
+                labels = [f"{'👤' if m['kind'] == 'rep' else '📋'} {m['label']} · {m['workspace']}"
+                          + (f" · {m['detail']}" if m['detail'] else "") for m in matches]
+                choice = st.selectbox("Matches", ["Choose a match..."] + labels, label_visibility="collapsed")
+                if choice in labels:
+                    match = matches[labels.index(choice)]
+                    if match['kind'] == 'rep':
+                        selected_rep = match['label']
+                    else:
+                        selected_queue = match['label']
+            else:
+                st.caption("No matching reps or queues")
 
-    # Generate statistics based on all filters
-    stats = generate_statistics(json_data, selected_workspace, selected_rep, selected_size)
+    # Generate statistics based on all filters (precomputed per workspace, memoized otherwise)
+    stats = store.statistics(selected_workspace, selected_rep, selected_size)
 
     # Sidebar navigation
     st.sidebar.title("Navigation")
@@ -687,6 +773,11 @@ def main():
         "Reps by Queue",
         "Queues by Size",
         "Overall Statistics",
+        "Rebalance Weights",
+        "Routing Simulator",
+        "Reconcile Memberships",
+        "Export",
+        "Alerts",
         "Audit Log"
     ]
     for section in sections:
@@ -700,11 +791,23 @@ def main():
     if selected_rep != "All":
         current_section = "employees_and_their_queues"
         st.query_params["section"] = current_section
+    # A queue picked in search opens on its own in "Queues and Reps"
+    elif selected_queue is not None:
+        current_section = "queues_and_reps"
+        st.query_params["section"] = current_section
+
+    # Time whichever section renders on this rerun; metrics.finish_rerun stops it if the
+    # section raises or calls st.rerun()
+    section_span = metrics.span(f"section.{current_section}").start()
 
     # Display queues and reps in table view
     if current_section == "queues_and_reps":
         st.header('Queues and Reps')
-        for i, (queue_name, reps) in enumerate(stats['queue_pivot'].items()):
+        if selected_queue is not None and selected_queue not in stats['queue_pivot']:
+            st.info(f"{selected_queue} is inactive, empty or outside the size filter.")
+        for queue_name, reps in stats['queue_pivot'].items():
+            if selected_queue is not None and queue_name != selected_queue:
+                continue
             # Queue header with improved styling
             st.markdown(f"""
                 <div class="queue-header">
@@ -713,24 +816,21 @@ def main():
                 </div>
             """, unsafe_allow_html=True)
             
-            with st.expander("Show Details", expanded=False):
-                # Initialize sort state
-                sort_key = get_sort_key(i, queue_name)
-                if sort_key not in st.session_state:
-                    st.session_state[sort_key] = {'column': 'Order', 'ascending': True}
-
+            # Widgets and state of the queue are keyed by its id, which survives reordering
+            queue_id = reps[0][5]
+            with st.expander("Show Details", expanded=queue_name == selected_queue):
                 # Create DataFrame first
                 rep_df = pd.DataFrame(reps, columns=['Rep Name', 'Weight', 'Order', 'Initial Order', 'User ID', 'Queue ID'])
 
                 # Add New Rep button
-                if st.button("➕ Add New Rep", key=f"add_rep_button_{i}", 
+                if st.button("➕ Add New Rep", key=f"add_rep_button_{queue_id}", 
                             help="Add a new rep to this queue",
                             type="primary"):
-                    st.session_state[f'adding_rep_{i}'] = True
+                    ui.open(ui_state.ADD_REPS, queue_id)
                 
                 # Add New Rep form
-                if st.session_state.get(f'adding_rep_{i}', False):
-                    with st.form(key=f"add_rep_form_{i}"):
+                if ui.is_open(ui_state.ADD_REPS, queue_id):
+                    with st.form(key=f"add_rep_form_{queue_id}"):
                         st.subheader(f"Add New Reps to {queue_name}")
                         
                         # Get all available reps that aren't in this queue
@@ -760,19 +860,20 @@ def main():
                                 success = True
                                 failed_reps = []
                                 
-                                for selected_rep in selected_new_reps:
-                                    # Find user ID for selected rep
-                                    user_id = next((member['id'] for q in json_data['elements'] 
-                                                  for member in q.get('members', []) 
-                                                  if member['name'] == selected_rep), None)
+                                with logs.correlate(batch_id=logs.new_id(), batch="add_reps"):
+                                    for selected_rep in selected_new_reps:
+                                        # Find user ID for selected rep
+                                        user_id = next((member['id'] for q in json_data['elements'] 
+                                                      for member in q.get('members', []) 
+                                                      if member['name'] == selected_rep), None)
                                     
-                                    if user_id:
-                                        if not add_rep_to_queue(queue_id, [user_id], new_weight):
+                                        if user_id:
+                                            if not add_rep_to_queue(queue_id, [user_id], new_weight):
+                                                success = False
+                                                failed_reps.append(selected_rep)
+                                        else:
                                             success = False
                                             failed_reps.append(selected_rep)
-                                    else:
-                                        success = False
-                                        failed_reps.append(selected_rep)
                                 
                                 if success:
                                     st.success(f"""
@@ -780,7 +881,7 @@ def main():
                                         - Reps: {', '.join(selected_new_reps)}
                                         - Weight: {new_weight}
                                     """)
-                                    st.session_state[f'adding_rep_{i}'] = False
+                                    ui.close(ui_state.ADD_REPS, queue_id)
                                     st.rerun()
                                 else:
                                     if failed_reps:
@@ -789,7 +890,7 @@ def main():
                                         st.error("Failed to add reps. Please try again.")
                         with col2:
                             if st.form_submit_button("Cancel"):
-                                st.session_state[f'adding_rep_{i}'] = False
+                                ui.close(ui_state.ADD_REPS, queue_id)
                                 st.rerun()
 
                 # Create table container
@@ -798,26 +899,17 @@ def main():
                 # Table header
                 header_cols = st.columns([3, 2, 2, 1.5, 1.5])
                 with header_cols[0]:
-                    if st.button("Rep Name", key=f"sort_name_{i}", 
+                    if st.button("Rep Name", key=f"sort_name_{queue_id}", 
                                help="Click to sort by name"):
-                        if st.session_state[sort_key]['column'] == 'Rep Name':
-                            st.session_state[sort_key]['ascending'] = not st.session_state[sort_key]['ascending']
-                        else:
-                            st.session_state[sort_key] = {'column': 'Rep Name', 'ascending': True}
+                        ui.toggle_sort(queue_id, 'Rep Name')
                 with header_cols[1]:
-                    if st.button("Weight", key=f"sort_weight_{i}",
+                    if st.button("Weight", key=f"sort_weight_{queue_id}",
                                help="Click to sort by weight"):
-                        if st.session_state[sort_key]['column'] == 'Weight':
-                            st.session_state[sort_key]['ascending'] = not st.session_state[sort_key]['ascending']
-                        else:
-                            st.session_state[sort_key] = {'column': 'Weight', 'ascending': True}
+                        ui.toggle_sort(queue_id, 'Weight')
                 with header_cols[2]:
-                    if st.button("Order", key=f"sort_order_{i}",
+                    if st.button("Order", key=f"sort_order_{queue_id}",
                                help="Click to sort by order"):
-                        if st.session_state[sort_key]['column'] == 'Order':
-                            st.session_state[sort_key]['ascending'] = not st.session_state[sort_key]['ascending']
-                        else:
-                            st.session_state[sort_key] = {'column': 'Order', 'ascending': True}
+                        ui.toggle_sort(queue_id, 'Order')
                 with header_cols[3]:
                     st.write("Edit")
                 with header_cols[4]:
@@ -826,19 +918,15 @@ def main():
                 st.markdown('<hr style="margin: 0; padding: 0; border-color: #eee;">', unsafe_allow_html=True)
 
                 # Sort the DataFrame
-                if st.session_state[sort_key]['column']:
-                    rep_df = rep_df.sort_values(
-                        by=st.session_state[sort_key]['column'],
-                        ascending=st.session_state[sort_key]['ascending']
-                    )
+                sort_column, sort_ascending = ui.sort(queue_id)
+                rep_df = rep_df.sort_values(by=sort_column, ascending=sort_ascending)
 
                 # Display sort indicator
-                if st.session_state[sort_key]['column']:
-                    st.caption(f"Sorted by {st.session_state[sort_key]['column']} "
-                             f"({'ascending' if st.session_state[sort_key]['ascending'] else 'descending'})")
+                st.caption(f"Sorted by {sort_column} ({'ascending' if sort_ascending else 'descending'})")
 
                 # Display rep data
-                for index, row in rep_df.iterrows():
+                for _, row in rep_df.iterrows():
+                    membership = (row['Queue ID'], row['User ID'])
                     cols = st.columns([3, 2, 2, 1.5, 1.5])
                     with cols[0]:
                         st.write(f"{row['Rep Name']}")
@@ -847,18 +935,18 @@ def main():
                     with cols[2]:
                         st.write(f"{row['Order']}")
                     with cols[3]:
-                        if st.button("Edit", key=f"edit_button_{i}_{index}",
+                        if st.button("Edit", key=f"edit_button_{'_'.join(membership)}",
                                    help="Edit this rep's settings"):
-                            st.session_state[f'editing_{i}_{index}'] = True
+                            ui.open(ui_state.EDIT, *membership)
                     with cols[4]:
-                        if st.button("Remove", key=f"remove_button_{i}_{index}",
+                        if st.button("Remove", key=f"remove_button_{'_'.join(membership)}",
                                    type="secondary",
                                    help="Remove this rep from the queue"):
-                            st.session_state[f'removing_rep_{i}_{index}'] = True
+                            ui.open(ui_state.REMOVE, *membership)
 
                     # Show edit form if editing is active
-                    if st.session_state.get(f'editing_{i}_{index}', False):
-                        with st.form(key=f"edit_form_{i}_{index}"):
+                    if ui.is_open(ui_state.EDIT, *membership):
+                        with st.form(key=f"edit_form_{'_'.join(membership)}"):
                             new_weight = st.number_input(
                                 "New Weight",
                                 min_value=1,
@@ -876,22 +964,21 @@ def main():
                                 if st.form_submit_button("Save"):
                                     if update_queue_member_weight(row['Queue ID'], [row['User ID']], new_weight, queue_name, row['Rep Name']):
                                         st.success(f"Successfully updated {row['Rep Name']}'s weight to {new_weight}")
-                                        st.session_state[f'editing_{i}_{index}'] = False
+                                        ui.close(ui_state.EDIT, *membership)
                                         st.rerun()
                             with col2:
                                 if st.form_submit_button("Cancel"):
-                                    st.session_state[f'editing_{i}_{index}'] = False
+                                    ui.close(ui_state.EDIT, *membership)
                                     st.rerun()
 
                     # Show delete confirmation if remove button was clicked
-                    if st.session_state.get(f'removing_rep_{i}_{index}', False):
+                    if ui.is_open(ui_state.REMOVE, *membership):
                         show_delete_confirmation(
                             queue_name,
                             row['Rep Name'],
                             row['Queue ID'],
                             row['User ID'],
-                            i,
-                            index
+                            ui
                         )
 
     # Display employees and their queues
@@ -901,17 +988,19 @@ def main():
         # Sort the rep_pivot dictionary by the number of queues (in descending order)
         sorted_reps = sorted(stats['rep_pivot'].items(), key=lambda x: len(x[1]), reverse=True)
         
-        for i, (employee_name, queues) in enumerate(sorted_reps):
+        for employee_name, queues in sorted_reps:
+            # Index 4 is User ID in the tuple; it keys the rep's widgets and state
+            user_id = queues[0][4]
             with st.expander(f"{employee_name} ({len(queues)} queues)", 
                            expanded=(employee_name == selected_rep and selected_rep != "All")):
                 
                 # Add New Queue button
-                if st.button("➕ Add to Queue", key=f"add_queue_button_{i}"):
-                    st.session_state[f'adding_queue_{i}'] = True
+                if st.button("➕ Add to Queue", key=f"add_queue_button_{user_id}"):
+                    ui.open(ui_state.ADD_QUEUES, user_id)
 
                 # Add to Queue form
-                if st.session_state.get(f'adding_queue_{i}', False):
-                    with st.form(key=f"add_queue_form_{i}"):
+                if ui.is_open(ui_state.ADD_QUEUES, user_id):
+                    with st.form(key=f"add_queue_form_{user_id}"):
                         st.subheader(f"Add {employee_name} to Queue(s)")
                         
                         # Get all available queues for the workspace
@@ -920,7 +1009,7 @@ def main():
                             q for q in json_data['elements'] 
                             if q['active'] and 
                             q['name'] not in current_queue_names and
-                            WORKSPACE_NAMES.get(q['workspaceId'], '') == selected_workspace
+                            workspace_names.get(q['workspaceId'], '') == selected_workspace
                         ]
                         
                         # Multiple Queue selection
@@ -946,20 +1035,18 @@ def main():
                                 success = True
                                 failed_queues = []
                                 
-                                # Get user ID from the existing queues data
-                                user_id = next((q[4] for q in queues), None)  # Index 4 is User ID in the tuple
-                                
                                 if user_id:
-                                    for queue_name in selected_queues:
-                                        queue_obj = next((q for q in available_queues if q['name'] == queue_name), None)
-                                        if queue_obj:
-                                            if not add_rep_to_queue(queue_obj['id'], [user_id], new_weight):
-                                                success = False
-                                                failed_queues.append(queue_name)
+                                    with logs.correlate(batch_id=logs.new_id(), batch="add_to_queues"):
+                                        for queue_name in selected_queues:
+                                            queue_obj = next((q for q in available_queues if q['name'] == queue_name), None)
+                                            if queue_obj:
+                                                if not add_rep_to_queue(queue_obj['id'], [user_id], new_weight):
+                                                    success = False
+                                                    failed_queues.append(queue_name)
                                     
                                     if success:
                                         st.success(f"Successfully added {employee_name} to all selected queues with weight {new_weight}")
-                                        st.session_state[f'adding_queue_{i}'] = False
+                                        ui.close(ui_state.ADD_QUEUES, user_id)
                                         st.rerun()
                                     else:
                                         st.error(f"Failed to add to some queues: {', '.join(failed_queues)}")
@@ -967,7 +1054,7 @@ def main():
                                     st.error("Could not find user ID")
                         with col2:
                             if st.form_submit_button("Cancel"):
-                                st.session_state[f'adding_queue_{i}'] = False
+                                ui.close(ui_state.ADD_QUEUES, user_id)
                                 st.rerun()
 
                 # Display existing queues
@@ -976,25 +1063,26 @@ def main():
                 ])
                 
                 # Display each queue as a row with actions (keep only the columns we want to show)
-                for index, row in queue_df.iterrows():
+                for _, row in queue_df.iterrows():
+                    membership = (row['Queue ID'], row['User ID'])
                     cols = st.columns([4, 3, 1.5, 1.5])
                     with cols[0]:
                         st.write(f"{row['Queue Name']}")
                     with cols[1]:
                         st.write(f"Weight: {row['Weight']}")
                     with cols[2]:
-                        if st.button("Edit", key=f"edit_button_{i}_{index}",
+                        if st.button("Edit", key=f"edit_button_{'_'.join(membership)}",
                                    help="Edit rep's weight in this queue"):
-                            st.session_state[f'editing_{i}_{index}'] = True
+                            ui.open(ui_state.EDIT, *membership)
                     with cols[3]:
-                        if st.button("Remove", key=f"remove_button_{i}_{index}",
+                        if st.button("Remove", key=f"remove_button_{'_'.join(membership)}",
                                    type="secondary",
                                    help="Remove rep from this queue"):
-                            st.session_state[f'removing_rep_{i}_{index}'] = True
+                            ui.open(ui_state.REMOVE, *membership)
 
                     # Show edit form if editing is active
-                    if st.session_state.get(f'editing_{i}_{index}', False):
-                        with st.form(key=f"edit_form_{i}_{index}"):
+                    if ui.is_open(ui_state.EDIT, *membership):
+                        with st.form(key=f"edit_form_{'_'.join(membership)}"):
                             new_weight = st.number_input(
                                 "New Weight",
                                 min_value=1,
@@ -1004,23 +1092,23 @@ def main():
                             col1, col2 = st.columns([1, 1])
                             with col1:
                                 if st.form_submit_button("Save"):
-                                    if update_queue_member_weight(row['Queue ID'], [row['User ID']], new_weight, queue_name, row['Rep Name']):
+                                    if update_queue_member_weight(row['Queue ID'], [row['User ID']], new_weight, row['Queue Name'], employee_name):
                                         st.success(f"""
                                             ✅ Successfully updated {employee_name}'s weight in {row['Queue Name']}:
                                             - Weight: {row['Weight']} → {new_weight}
                                         """)
-                                        st.session_state[f'editing_{i}_{index}'] = False
+                                        ui.close(ui_state.EDIT, *membership)
                                         st.rerun()
                                     else:
                                         st.error("Failed to update weight. Please try again.")
                             with col2:
                                 if st.form_submit_button("Cancel"):
-                                    st.session_state[f'editing_{i}_{index}'] = False
+                                    ui.close(ui_state.EDIT, *membership)
                                     st.rerun()
 
                     # Show delete confirmation if remove button was clicked
-                    if st.session_state.get(f'removing_rep_{i}_{index}', False):
-                        with st.form(key=f"delete_confirmation_{i}_{index}"):
+                    if ui.is_open(ui_state.REMOVE, *membership):
+                        with st.form(key=f"delete_confirmation_{'_'.join(membership)}"):
                             st.warning(f"⚠️ Are you sure you want to remove {employee_name} from {row['Queue Name']}?")
                             st.write("This action cannot be undone.")
                             
@@ -1028,7 +1116,7 @@ def main():
                             confirmation = st.selectbox(
                                 "Select a compliment to confirm removal:",
                                 options=BIZOPS_COMPLIMENTS,
-                                key=f"delete_confirmation_input_{i}_{index}"
+                                key=f"delete_confirmation_input_{'_'.join(membership)}"
                             )
                             
                             col1, col2 = st.columns([1, 1])
@@ -1045,14 +1133,14 @@ def main():
                                 )
                             
                             if cancel_button:
-                                st.session_state[f'removing_rep_{i}_{index}'] = False
+                                ui.close(ui_state.REMOVE, *membership)
                                 st.rerun()
                                 
                             if confirm_button:
                                 if confirmation in BIZOPS_COMPLIMENTS:  # Check if a compliment was selected
                                     if remove_reps_from_queue(row['Queue ID'], [row['User ID']]):
                                         st.success(f"Successfully removed {employee_name} from {row['Queue Name']}")
-                                        st.session_state[f'removing_rep_{i}_{index}'] = False
+                                        ui.close(ui_state.REMOVE, *membership)
                                         st.rerun()
                                 else:
                                     st.error("Please select a compliment to confirm the removal")
@@ -1060,20 +1148,22 @@ def main():
     # Reps by Queue
     if current_section == "reps_by_queue":
         st.header('Reps by Queue')
-        reps_by_queue_df = pd.DataFrame.from_dict(stats['reps_by_queue'], orient='index', columns=['Count']).reset_index()
-        reps_by_queue_df.columns = ['Queue Name', 'Count']
-        reps_by_queue_df = reps_by_queue_df.sort_values('Count', ascending=False)
-        fig = px.bar(reps_by_queue_df, x='Queue Name', y='Count', title='Reps by Queue')
-        fig.update_layout(xaxis_tickangle=-45, height=600)
+        top_n = st.number_input("Queues shown", min_value=5, max_value=charts.MAX_TOP_N,
+                                value=charts.DEFAULT_TOP_N, step=5, key="reps_by_queue_top_n")
+        fig, folded = get_chart(json_data, stats, 'reps_by_queue', (selected_rep, selected_size), int(top_n))
         st.plotly_chart(fig, use_container_width=True, key="reps_by_queue_chart")
+        if folded:
+            st.caption(f"{folded} smaller queues are folded into the Other bar (their average size).")
 
     # Queues by Size
     if current_section == "queues_by_size":
         st.header('Queues by Size')
-        queues_by_size_df = pd.DataFrame.from_dict(stats['queues_by_size'], orient='index', columns=['Count']).reset_index()
-        queues_by_size_df.columns = ['Number of Reps', 'Count']
-        fig = px.pie(queues_by_size_df, values='Count', names='Number of Reps', title='Distribution of Queue Sizes')
+        top_n = st.number_input("Sizes shown", min_value=5, max_value=charts.MAX_TOP_N,
+                                value=charts.DEFAULT_TOP_N, step=5, key="queues_by_size_top_n")
+        fig, folded = get_chart(json_data, stats, 'queues_by_size', (selected_rep, selected_size), int(top_n))
         st.plotly_chart(fig, use_container_width=True, key="queues_by_size_chart")
+        if folded:
+            st.caption(f"{folded} less common sizes are folded into the Other slice.")
 
     # Display overall statistics
     if current_section == "overall_statistics":
@@ -1140,49 +1230,20 @@ def main():
         </style>
         """, unsafe_allow_html=True)
 
-        def create_scrollable_table(df, queue_links):
-            df = df.applymap(lambda x: f"{x:.0f}")  # Remove decimal places
-            table_html = f"""
-            <div class="scrollable-table-container">
-                <table class="scrollable-table">
-                    <thead>
-                        <tr>
-                            <th>Rep Name</th>
-                            {''.join(f'<th><a href="{queue_links.get(col, "#")}" class="queue-link" target="_blank">{col}</a></th>' for col in df.columns)}
-                        </tr>
-                    </thead>
-                    <tbody>
-                        {''.join(f'<tr><td>{index}</td>' + ''.join(f'<td class="{"zero-value" if cell == "0" else ""}">{cell}</td>' for cell in row) + '</tr>' for index, row in df.iterrows())}
-                    </tbody>
-                </table>
-            </div>
-            """
-            return table_html
+        # Both tables are usually materialized already (see reports.py)
+        sales_html, cs_html = reports.participation_tables(json_data, stats, selected_rep, selected_size)
 
         # Sales Queues
         st.subheader('Sales Queues')
-        if stats['sales_queues']:
-            sales_df = pd.DataFrame(stats['ae_participation']).T[stats['sales_queues']]
-            sales_df = sales_df.fillna(0)  # Replace NaN with 0
-            # Filter out reps that don't appear in any sales queue
-            sales_reps = list(sales_df.index[sales_df.sum(axis=1) > 0])
-            sales_df = sales_df.loc[sales_reps]
-            # Sort columns based on the number of reps in each queue
-            sales_df = sales_df.loc[:, sales_df.sum().sort_values(ascending=False).index]
-            st.markdown(create_scrollable_table(sales_df, stats['queue_links']), unsafe_allow_html=True)
+        if sales_html:
+            st.markdown(sales_html, unsafe_allow_html=True)
         else:
             st.write("No Sales Queues found.")
 
         # CS Queues
         st.subheader('CS Queues')
-        if stats['cs_queues']:
-            cs_df = pd.DataFrame(stats['ae_participation']).T[stats['cs_queues']]
-            cs_df = cs_df.fillna(0)  # Replace NaN with 0
-            # Filter to show only reps that are in CS workspace
-            cs_df = cs_df.loc[cs_df.index.intersection(stats['cs_users'])]
-            # Sort columns based on the number of reps in each queue
-            cs_df = cs_df.loc[:, cs_df.sum().sort_values(ascending=False).index]
-            st.markdown(create_scrollable_table(cs_df, stats['queue_links']), unsafe_allow_html=True)
+        if cs_html:
+            st.markdown(cs_html, unsafe_allow_html=True)
         else:
             st.write("No CS Queues found.")
 
@@ -1198,6 +1259,322 @@ def main():
         st.write("CS Queues:")
         st.write(stats['cs_queues'])
 
+    # Rebalance weights across many queues at once
+    if current_section == "rebalance_weights":
+        st.header('Rebalance Weights')
+
+        if 'rebalance_result' in st.session_state:
+            st.success(st.session_state.pop('rebalance_result'))
+
+        col1, col2 = st.columns(2)
+        with col1:
+            strategy = st.radio("Strategy", REBALANCE_STRATEGIES, key="rebalance_strategy")
+        with col2:
+            scope_options = ["All"] + sorted(all_workspaces)
+            scope_workspace = st.selectbox(
+                "Workspace",
+                scope_options,
+                index=scope_options.index(selected_workspace) if selected_workspace in scope_options else 0,
+                key="rebalance_workspace"
+            )
+        scoped = get_membership_frame(store.payload(scope_workspace), workspace_names)
+
+        if strategy == REBALANCE_STRATEGIES[0]:
+            queue_names = st.multiselect(
+                "Queues",
+                sorted(scoped['queue_name'].unique()),
+                help="Leave empty to normalize every queue in the workspace"
+            )
+            proposed = rebalance.normalize_weights(rebalance.filter_scope(scoped, queue_names=queue_names))
+        elif strategy == REBALANCE_STRATEGIES[1]:
+            rep_name = st.selectbox("Rep", sorted(scoped['rep_name'].unique()))
+            target_weight = st.number_input("Weight", min_value=1, max_value=100, value=50)
+            user_ids = scoped.loc[scoped['rep_name'] == rep_name, 'user_id'].unique()
+            proposed = rebalance.set_rep_weight(scoped, user_ids, target_weight)
+        else:
+            factor = st.number_input("Factor", min_value=0.1, max_value=10.0, value=1.0, step=0.1)
+            proposed = rebalance.scale_weights(scoped, factor)
+
+        plan = rebalance.plan_weight_updates(proposed)
+        preview = rebalance.preview_changes(proposed)
+        st.write(f"**{len(preview)}** membership changes in **{len(plan)}** API calls")
+        st.dataframe(preview, hide_index=True, use_container_width=True)
+
+        if plan and st.button("Apply Rebalance", type="primary") and not mutations_paused():
+            progress = st.progress(0.0)
+            failed_queues = []
+            audit_rows = []
+            with logs.correlate(batch_id=logs.new_id(), batch="rebalance"):
+                logger.info("Applying rebalance: %d calls", len(plan))
+                # Calls run concurrently through the tenant's rate-limited client; the audit rows go out in one write
+                try:
+                    for n, (call, error) in enumerate(
+                            reconcile.apply_plan(get_tenant_client(), plan, max_workers=RECONCILE_WORKERS), 1):
+                        if error is None:
+                            audit_rows.append((
+                                ACTION_TYPES["WEIGHT_UPDATE"],
+                                call['queue_name'],
+                                ", ".join(call['rep_names']),
+                                f"Updated weight to {call['weight']}"
+                            ))
+                        else:
+                            failed_queues.append(call['queue_name'])
+                        progress.progress(n / len(plan), text=f"{n}/{len(plan)} calls")
+                finally:
+                    log_actions(audit_rows)
+            for queue_id in {call['queue_id'] for call in plan}:
+                store.invalidate_queue(queue_id)
+            if failed_queues:
+                st.error(f"Failed to update some queues: {', '.join(sorted(set(failed_queues)))}")
+            else:
+                st.session_state['rebalance_result'] = f"✅ Applied {len(preview)} weight changes in {len(plan)} API calls"
+                st.rerun()
+
+    # What-if: expected meetings per rep for edited weights and queue volumes
+    if current_section == "routing_simulator":
+        st.header('Routing Simulator')
+        model = get_routing_model(json_data, workspace_names)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            default_volume = st.number_input("Meetings per queue", min_value=0, value=simulate.DEFAULT_QUEUE_VOLUME,
+                                             help="Inbound volume for queues not edited below")
+        with col2:
+            monte_carlo = st.checkbox("Show P10-P90 range",
+                                      help="Monte Carlo over Poisson-distributed queue volumes")
+        queue_names = st.multiselect("Queues to edit", sorted(model.queue_names))
+
+        # Editors are keyed by snapshot version so edits never land on rows of a newer snapshot
+        editor_key = f"{tenant.slug}-{json_data['snapshotVersion']}-{default_volume}"
+        queue_mask = np.isin(model.queue_names, queue_names) if queue_names else np.ones(model.n_queues, dtype=bool)
+        volume_df = pd.DataFrame({'Queue': model.queue_names, 'Meetings': float(default_volume)})[queue_mask]
+        member_mask = model.memberships['queue_name'].isin(queue_names) if queue_names else slice(None)
+        weight_df = model.memberships.loc[member_mask, ['queue_name', 'rep_name', 'weight']]
+        weight_df.columns = ['Queue', 'Rep', 'Weight']
+
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            edited_volumes = st.data_editor(volume_df, disabled=['Queue'], hide_index=True,
+                                            key=f"sim_volumes-{editor_key}")
+        with col2:
+            edited_weights = st.data_editor(weight_df, disabled=['Queue', 'Rep'], hide_index=True,
+                                            key=f"sim_weights-{editor_key}")
+
+        with metrics.span("simulate.run") as sim_span:
+            volumes = np.full(model.n_queues, float(default_volume))
+            volumes[np.flatnonzero(queue_mask)] = edited_volumes['Meetings'].fillna(0).to_numpy(dtype=float)
+            weights = model.weights.copy()
+            weights[edited_weights.index.to_numpy()] = np.clip(
+                edited_weights['Weight'].fillna(0).to_numpy(dtype=float), rebalance.MIN_WEIGHT, rebalance.MAX_WEIGHT
+            )
+            simulation = model.simulate(volumes, weights) if monte_carlo else None
+            comparison = model.compare(volumes, weights, simulation)
+        elapsed = sim_span.duration
+        changed = int((weights != model.weights).sum())
+        st.caption(f"{changed} weights changed · simulated {model.n_queues} queues and {model.n_reps} reps "
+                   f"in {elapsed * 1000:.0f} ms")
+        st.dataframe(comparison, hide_index=True, use_container_width=True)
+
+    # Reconcile memberships against an uploaded desired-state file
+    if current_section == "reconcile_memberships":
+        st.header('Reconcile Memberships')
+        st.write("Upload a CSV or XLSX with **queue**, **rep** and optional **weight** columns. "
+                 "Queues and reps can be given by name or id.")
+
+        uploaded = st.file_uploader("Desired memberships", type=["csv", "xlsx"])
+        prune = st.checkbox(
+            "Remove members not listed in the file",
+            help="Only affects queues that appear in the file"
+        )
+
+        if uploaded is not None:
+            # Names in the file may refer to queues in any workspace
+            account_data = store.payload("All")
+            raw = uploaded.getvalue()
+            checkpoint = reconcile.Checkpoint(os.path.join(CHECKPOINT_DIR, tenant.slug),
+                                              reconcile.file_digest(raw, prune))
+            try:
+                desired = reconcile.read_desired(io.BytesIO(raw), uploaded.name)
+            except Exception as e:
+                st.error(f"Could not read {uploaded.name}: {str(e)}")
+                desired = None
+
+            if desired is not None:
+                resolved, unresolved = reconcile.resolve_desired(desired, account_data)
+                if not unresolved.empty:
+                    st.warning(f"{len(unresolved)} rows could not be matched and will be skipped")
+                    st.dataframe(unresolved, hide_index=True)
+
+                diff = reconcile.diff_memberships(resolved, account_data, prune=prune)
+                plan = reconcile.build_plan(diff)
+
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Adds", int((diff['action'] == 'add').sum()))
+                col2.metric("Removes", int((diff['action'] == 'remove').sum()))
+                col3.metric("Weight Updates", int((diff['action'] == 'update').sum()))
+                col4.metric("API Calls", len(plan))
+                st.subheader("Dry Run")
+                st.dataframe(reconcile.preview_diff(diff), hide_index=True, use_container_width=True)
+
+                # Pending calls in the checkpoint mean an earlier run of this file was interrupted
+                done, total = checkpoint.progress()
+                resuming = done < total
+                if resuming:
+                    st.info(f"A previous run of this file stopped after {done}/{total} calls. "
+                            "Resuming applies only the remaining calls from that run's plan.")
+                    if st.button("Discard Checkpoint"):
+                        checkpoint.clear()
+                        st.rerun()
+
+                if ((plan or resuming) and st.button("Resume" if resuming else "Apply Plan", type="primary")
+                        and not mutations_paused(tenant)):
+                    pending = checkpoint.start(plan)
+                    progress = st.progress(0.0)
+                    results = []
+                    client = get_tenant_client(tenant)
+                    # The checkpoint records each call as it finishes; the audit rows go out in one write
+                    audit_rows = []
+                    with logs.correlate(batch_id=logs.new_id(), batch="reconcile"):
+                        try:
+                            for n, (op, error) in enumerate(
+                                    reconcile.apply_plan(client, pending, checkpoint, RECONCILE_WORKERS), 1):
+                                if error is None:
+                                    details = f"Reconcile upload {uploaded.name}"
+                                    if op['weight'] is not None:
+                                        details += f", weight {op['weight']}"
+                                    audit_rows.append((
+                                        RECONCILE_ACTIONS[op['op']],
+                                        op['queue_name'],
+                                        ", ".join(op['rep_names']),
+                                        details
+                                    ))
+                                results.append({
+                                    'Action': reconcile.OP_LABELS[op['op']],
+                                    'Queue': op['queue_name'],
+                                    'Reps': ", ".join(op['rep_names']),
+                                    'Weight': op['weight'],
+                                    'Result': "✅ OK" if error is None else f"❌ {error}"
+                                })
+                                progress.progress(n / len(pending), text=f"{n}/{len(pending)} calls")
+                        finally:
+                            log_actions(audit_rows)
+                    for queue_id in {op['queue_id'] for op in pending}:
+                        store.invalidate_queue(queue_id)
+
+                    failures = sum(1 for r in results if not r['Result'].startswith("✅"))
+                    if failures:
+                        st.error(f"{failures} of {len(results)} calls failed. "
+                                 "Upload the same file again to retry the remaining calls.")
+                    else:
+                        checkpoint.clear()
+                        st.success(f"✅ Applied {len(results)} calls")
+                    st.dataframe(pd.DataFrame(results), hide_index=True, use_container_width=True)
+
+    # Download memberships and participation matrices
+    if current_section == "export":
+        st.header('Export')
+        # Participation exports follow the current filters, so the filters are part of the cache key
+        filter_key = "-".join(
+            "".join(c if c.isalnum() else "_" for c in value)
+            for value in (selected_workspace, selected_size, selected_rep)
+        )
+
+        def participation_export(queue_names, reps=None):
+            return build_participation_matrix(stats, queue_names, reps=reps).iter_frames(export.CHUNK_ROWS)
+
+        account_data = store.payload("All")
+        datasets = {
+            'memberships': (
+                "Queue memberships (active queues, all workspaces)",
+                lambda: get_membership_frame(account_data, workspace_names),
+                False
+            ),
+            f'sales_participation-{filter_key}': (
+                "Sales participation matrix (current filters)",
+                lambda: participation_export(stats['sales_queues']),
+                True
+            ),
+            f'cs_participation-{filter_key}': (
+                "CS participation matrix (current filters)",
+                lambda: participation_export(stats['cs_queues'], reps=stats['cs_users']),
+                True
+            )
+        }
+        formats = [fmt for fmt in export.EXPORT_FORMATS if fmt != 'Parquet' or export.parquet_available()]
+
+        col1, col2 = st.columns(2)
+        with col1:
+            dataset_label = st.selectbox("Dataset", [label for label, _, _ in datasets.values()])
+            dataset = next(key for key, (label, _, _) in datasets.items() if label == dataset_label)
+        with col2:
+            fmt = st.selectbox("Format", formats)
+
+        label, frame_fn, with_index = datasets[dataset]
+        source = account_data if dataset == 'memberships' else json_data
+        version = source.get('snapshotVersion', 'unversioned')
+        if st.button("Prepare Download", type="primary"):
+            try:
+                with st.spinner(f"Writing {label.lower()}..."):
+                    st.session_state['export_path'] = export.spool_export(
+                        os.path.join(EXPORT_DIR, tenant.slug), version, dataset, fmt, frame_fn,
+                        index=with_index
+                    )
+            except Exception as e:
+                logger.error(f"Export failed: dataset={dataset}, format={fmt}, error={str(e)}")
+                st.error(f"Export failed: {str(e)}")
+
+        export_path = st.session_state.get('export_path')
+        extension, mime = export.EXPORT_FORMATS[fmt]
+        if export_path and os.path.exists(export_path) and export_path.endswith(f"{version}_{dataset}.{extension}"):
+            # Streamlit has no streaming downloads: the button holds the whole file in
+            # the server's memory for this session while it is shown
+            st.caption("The spooled file is reused across sessions, but the download is served "
+                       "from memory, so very large exports use server memory while this button is shown.")
+            with open(export_path, "rb") as f:
+                st.download_button(
+                    f"Download {os.path.getsize(export_path) / 1024:.0f} KiB",
+                    data=f,
+                    file_name=f"{dataset.split('-')[0]}_{datetime.now().strftime('%Y%m%d')}.{extension}",
+                    mime=mime
+                )
+
+    # Coverage and anomaly alerts across all workspaces of the tenant
+    if current_section == "alerts":
+        st.header("Alerts")
+        if alert_engine is None:
+            st.info("Alerts are turned off (CHILI_ALERTS=0).")
+        elif alert_engine.evaluated_at is None:
+            st.info("Alerts are being evaluated, check back in a moment.")
+        else:
+            open_alerts = alert_engine.current()
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Open alerts", len(open_alerts))
+            col2.metric("Critical", sum(alert['severity'] == 'critical' for alert in open_alerts))
+            col3.metric("Rules enabled", len(alert_engine.rules))
+            checked_queues, checked_reps = alert_engine.last_checked
+            st.caption(f"Last evaluated at {datetime.fromtimestamp(alert_engine.evaluated_at).strftime('%H:%M:%S')}: "
+                       f"{checked_queues} changed queues and {checked_reps} reps re-checked")
+
+            rule_filter = st.multiselect("Filter by Rule", list(alerts.RULES))
+            shown = [alert for alert in open_alerts if not rule_filter or alert['rule'] in rule_filter]
+            if shown:
+                st.dataframe(
+                    pd.DataFrame({
+                        'Severity': [alert['severity'] for alert in shown],
+                        'Rule': [alert['rule'] for alert in shown],
+                        'Queue / Rep': [alert['subject'] for alert in shown],
+                        'Message': [alert['message'] for alert in shown],
+                        'Since': [datetime.fromtimestamp(alert['since']) for alert in shown],
+                    }),
+                    column_config={
+                        'Since': st.column_config.DatetimeColumn('Since', format="DD/MM/YY HH:mm:ss"),
+                        'Message': st.column_config.TextColumn('Message', width='large'),
+                    },
+                    hide_index=True
+                )
+            else:
+                st.success("No open alerts.")
+
     # New: Audit Log section
     if current_section == "audit_log":
         st.header("Audit Log")
@@ -1205,55 +1582,73 @@ def main():
         # Add filters
         col1, col2, col3 = st.columns(3)
         with col1:
-            date_filter = st.date_input("Filter by Date")
+            today = datetime.now().date()
+            date_range = st.date_input("Date range", value=(today - pd.Timedelta(days=30), today))
         with col2:
-            action_filter = st.selectbox(
-                "Filter by Action",
-                ["All"] + list(ACTION_TYPES.values())
-            )
+            action_filter = st.multiselect("Filter by Action", list(ACTION_TYPES.values()))
         with col3:
             user_filter = st.text_input("Filter by User")
-        
+        col1, col2 = st.columns(2)
+        with col1:
+            group_by = st.selectbox("Group by", ["Action", "User", "Queue", "Rep"])
+        with col2:
+            frequency = st.selectbox("Period", list(audit.FREQUENCIES), index=1)
+
         try:
-            # Get the audit log data
-            sheet = get_google_sheet()
-            if sheet:
-                # Get all records
-                records = sheet.get_all_records()
-                df = pd.DataFrame(records)
-                
-                # Apply filters
-                if date_filter:
-                    df['Date'] = pd.to_datetime(df['Timestamp']).dt.date
-                    df = df[df['Date'] == date_filter]
-                
-                if action_filter != "All":
-                    df = df[df['Action'] == action_filter]
-                    
-                if user_filter:
-                    df = df[df['User'].str.contains(user_filter, case=False)]
-                
-                # Display the filtered log
-                st.dataframe(
-                    df,
-                    column_config={
-                        'Timestamp': st.column_config.DatetimeColumn(
-                            'Time',
-                            format="DD/MM/YY HH:mm:ss"
-                        ),
-                        'Details': st.column_config.TextColumn(
-                            'Details',
-                            width='large'
-                        )
-                    },
-                    hide_index=True
-                )
+            log = get_audit_cache().get()
+            # The range picker returns one date while the second is being chosen
+            start_date = date_range[0] if date_range else None
+            end_date = date_range[1] if len(date_range) > 1 else start_date
+            filters = (start_date, end_date, tuple(action_filter), user_filter.strip())
+            df = log.filtered(*filters)
+
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Changes", len(df))
+            col2.metric("Users", df['User'].nunique())
+            col3.metric("Queues touched", df.loc[df['Queue'].astype(str) != "", 'Queue'].nunique())
+            col4.metric("Weight changes", int(df['Weight'].notna().sum()))
+
+            if df.empty:
+                st.info("No audit entries match these filters.")
             else:
-                st.error("Could not connect to Google Sheets")
-                
+                st.subheader(f"Changes by {group_by.lower()} per {frequency.lower()}")
+                st.bar_chart(log.counts_over_time(filters, group_by, audit.FREQUENCIES[frequency]))
+
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.subheader("Most changed queues")
+                    st.dataframe(log.most_changed(filters, 'Queue'), hide_index=True)
+                with col2:
+                    st.subheader("Most changed reps")
+                    st.dataframe(log.most_changed(filters, 'Rep'), hide_index=True)
+
+                st.subheader("Weight volatility")
+                st.caption("Spread of the weights set per rep, and jumps from the previous weight in the same queue")
+                st.dataframe(log.weight_volatility(filters), hide_index=True)
+
+            # Display the filtered log
+            st.subheader("Entries")
+            st.dataframe(
+                df[audit.COLUMNS].sort_values('Timestamp', ascending=False),
+                column_config={
+                    'Timestamp': st.column_config.DatetimeColumn(
+                        'Time',
+                        format="DD/MM/YY HH:mm:ss"
+                    ),
+                    'Details': st.column_config.TextColumn(
+                        'Details',
+                        width='large'
+                    )
+                },
+                hide_index=True
+            )
+
         except Exception as e:
+            metrics.inc("sheets_errors", call="get_all_records")
             st.error(f"Error loading audit log: {str(e)}")
 
+    section_span.stop()
+
     # Footer with copyright notice
     st.markdown(
         """
@@ -1264,5 +1659,113 @@ def main():
         unsafe_allow_html=True
     )
 
+    if st.sidebar.toggle("Performance", key="show_performance", help="Show timing breakdowns for recent reruns"):
+        show_performance_panel()
+
+# Sidebar panel with the current rerun's spans and totals of recent reruns
+def show_performance_panel():
+    with st.sidebar.expander("Performance", expanded=True):
+        rerun = metrics.current_rerun()
+        if rerun:
+            st.caption(f"This rerun so far: {rerun.elapsed_ms():.0f} ms")
+            st.dataframe(
+                pd.DataFrame(
+                    [("\u2003" * depth + name, duration) for name, depth, _, duration in rerun.spans if duration is not None],
+                    columns=['Span', 'ms']
+                ).round(1),
+                hide_index=True
+            )
+        history = st.session_state.get('perf_history', [])
+        if history:
+            st.caption("Recent reruns")
+            st.dataframe(pd.DataFrame(history[::-1]).round(1), hide_index=True)
+        st.caption(
+            f"API errors: {metrics.counter_value('api_errors'):.0f} · "
+            f"Sheets errors: {metrics.counter_value('sheets_errors'):.0f} · "
+            f"Cache hits/misses: {metrics.counter_value('cache_hits'):.0f}/{metrics.counter_value('cache_misses'):.0f} · "
+            f"Coalesced: {metrics.counter_value('coalesced'):.0f}"
+        )
+
+# Reruns left to profile because of CHILI_PROFILE, shared by every session
+@st.cache_resource
+def get_profile_budget():
+    return {'left': PROFILE_RERUNS, 'lock': threading.Lock()}
+
+# Check whether this rerun should run under the profiler
+def profiling_requested():
+    budget = get_profile_budget()
+    with budget['lock']:
+        if budget['left'] > 0:
+            budget['left'] -= 1
+            return True
+    if st.query_params.get("profile") not in ("1", "true"):
+        return False
+    # The query parameter is one-shot and only honoured for admins
+    del st.query_params["profile"]
+    if get_user_email().lower() not in ADMIN_EMAILS:
+        logger.warning(f"Ignoring profile request from non-admin user: {get_user_email()}")
+        return False
+    return True
+
+# Run fn under cProfile and save the stats as a timestamped .prof plus a text summary
+def run_profiled(fn):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        fn()
+    finally:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.prof")
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        with open(path[:-len(".prof")] + ".txt", "w") as f:
+            f.write(summary.getvalue())
+        logger.info(f"Saved profile report to {path}")
+        prune_profiles()
+    show_profile_report(stats, path)
+
+# Remove all but the PROFILE_KEEP most recent .prof/.txt pairs (names sort by time)
+def prune_profiles(keep=PROFILE_KEEP):
+    profiles = sorted(name for name in os.listdir(PROFILE_DIR)
+                      if name.startswith("profile_") and name.endswith(".prof"))
+    for name in profiles[:-keep]:
+        for old in (name, name[:-len(".prof")] + ".txt"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old))
+            except OSError as e:
+                logger.warning(f"Could not remove old profile {old}: {str(e)}")
+
+# Inline table of the functions with the most time spent in their own code
+def show_profile_report(stats, path):
+    rows = []
+    for (filename, line, func), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'Function': f"{func} ({os.path.basename(filename)}:{line})",
+            'Calls': ncalls,
+            'Own (ms)': tottime * 1000,
+            'Cumulative (ms)': cumtime * 1000,
+        })
+    hot = pd.DataFrame(rows).sort_values('Own (ms)', ascending=False).head(PROFILE_TOP_N)
+    with st.expander(f"Profile report ({stats.total_tt * 1000:.0f} ms)", expanded=True):
+        st.caption(f"Saved to {path}")
+        st.dataframe(hot.round(2), hide_index=True, use_container_width=True)
+
 if __name__ == "__main__":
-    main()
+    rerun = metrics.start_rerun()
+    try:
+        # Everything logged during this rerun carries its id
+        with logs.correlate(rerun_id=logs.new_id()):
+            if profiling_requested():
+                run_profiled(main)
+            else:
+                main()
+    finally:
+        metrics.finish_rerun(rerun)
+        # Keep a short per-session history of top-level phase timings
+        phases = {name: duration for name, depth, _, duration in rerun.spans if depth == 0 and duration is not None}
+        history = st.session_state.setdefault('perf_history', [])
+        history.append({'time': datetime.fromtimestamp(rerun.started).strftime('%H:%M:%S'), 'total': rerun.total_ms, **phases})
+        del history[:-PERF_HISTORY_SIZE]
@@ -0,0 +1,273 @@
+"""Thin Chili Piper edge API client.
+
+Raises on failure instead of reporting to the UI, so it can be used from
+worker threads; chili.py wraps these calls with its st.error handling.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# orjson is optional; it parses large /queue pages several times faster
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+DEFAULT_BASE_URL = "https://edge.na.chilipiper.com"
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_TIMEOUT = 30
+
+# Circuit breaker: consecutive upstream failures before calls fail fast, and
+# how long (doubling per failed trial, up to the max) before one is tried again
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 15
+BREAKER_MAX_COOLDOWN = 300
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is known to be failing."""
+
+    def __init__(self, retry_in):
+        super().__init__(f"Chili Piper API is unavailable; calls are paused for another {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing.
+
+    After `threshold` consecutive failures the circuit opens and calls fail
+    fast. Once the cooldown has passed a single trial call goes through
+    (half-open): success closes the circuit, failure reopens it with the
+    cooldown doubled.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if self.trial_in_flight or time.monotonic() - self.opened_at >= self.cooldown:
+                return "half-open"
+            return "open"
+
+    # Seconds until the next trial call, 0 when calls go through
+    def retry_in(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.cooldown - (time.monotonic() - self.opened_at)
+            if remaining > 0 or self.trial_in_flight:
+                raise CircuitOpenError(max(remaining, 0))
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight:
+                self.trial_in_flight = False
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self.opened_at = time.monotonic()
+            elif self.opened_at is None and self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                metrics.inc("circuit_opened")
+
+
+# Failures that say the upstream is unhealthy, as opposed to a bad request
+def _is_upstream_failure(error):
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and (response.status_code >= 500 or response.status_code == 429)
+
+
+class RateLimiter:
+    """Token bucket shared by every thread using one client."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Block until a request may be sent; returns the seconds spent waiting
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class ChiliClient:
+    """Pooled HTTP session for one API key. Safe to share between threads.
+
+    With rate_limit (requests per second) every call first takes a token from
+    the client's own bucket, so one tenant's bulk jobs can't eat another's quota.
+    Calls go through the client's CircuitBreaker and raise CircuitOpenError
+    while the upstream is considered down.
+    """
+
+    def __init__(self, base_url, api_key, pool_size=16, timeout=DEFAULT_TIMEOUT, rate_limit=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.breaker = CircuitBreaker()
+        # (workspace id, page size, page) -> {'etag', 'last_modified', 'digest', 'body'}
+        self._pages = {}
+        self._pages_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def _request(self, method, path, endpoint, **kwargs):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            metrics.inc("api_rejected", endpoint=endpoint)
+            raise
+        if self.limiter is not None and self.limiter.acquire():
+            metrics.inc("api_throttled", endpoint=endpoint)
+        started = time.perf_counter()
+        try:
+            with metrics.span(f"api.{endpoint}"):
+                response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+            logger.debug("%s %s -> %s in %.1fms", method, path, response.status_code,
+                         (time.perf_counter() - started) * 1000, extra={'endpoint': endpoint})
+            response.raise_for_status()
+        except Exception as e:
+            metrics.inc("api_errors", endpoint=endpoint)
+            if _is_upstream_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return response
+
+    # One parsed /queue page, and the digest of its raw bytes. Pages are fetched
+    # conditionally (If-None-Match / If-Modified-Since) when the API sent an ETag or
+    # Last-Modified, and a page whose bytes hash the same as last time is not parsed
+    # again; either way the previously parsed body is reused.
+    def _queue_page(self, params, cache_key):
+        with self._pages_lock:
+            cached = self._pages.get(cache_key)
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers["If-None-Match"] = cached['etag']
+            if cached['last_modified']:
+                headers["If-Modified-Since"] = cached['last_modified']
+        response = self._request("GET", "/queue", "queue.list", params=params, headers=headers)
+
+        if response.status_code == 304 and cached is not None:
+            metrics.inc("cache_hits", cache="queue_page", check="http")
+            return cached['digest'], cached['body']
+        digest = hashlib.blake2b(response.content, digest_size=8).hexdigest()
+        if cached is not None and cached['digest'] == digest:
+            metrics.inc("cache_hits", cache="queue_page", check="hash")
+            body = cached['body']
+        else:
+            metrics.inc("cache_misses", cache="queue_page")
+            with metrics.span("api.queue.parse"):
+                body = _loads(response.content)
+        with self._pages_lock:
+            self._pages[cache_key] = {
+                'etag': response.headers.get("ETag"),
+                'last_modified': response.headers.get("Last-Modified"),
+                'digest': digest,
+                'body': body,
+            }
+        return digest, body
+
+    # All queues, following pagination when the response reports a larger total.
+    # 'snapshotVersion' is a digest of the raw response bytes, so identical
+    # payloads always get the same version and an unchanged refresh costs a
+    # 304 or a hash compare instead of a parse. With workspace_id the API is
+    # asked for that workspace only, and the result is filtered again in case
+    # the filter is not honoured.
+    def list_queues(self, page_size=DEFAULT_PAGE_SIZE, workspace_id=None):
+        params = {"pageSize": str(page_size)}
+        if workspace_id:
+            params["workspaceId"] = workspace_id
+        page_digest, body = self._queue_page(params, (workspace_id, page_size, 0))
+        digest = hashlib.blake2b(page_digest.encode(), digest_size=8)
+        elements = list(body['elements'])
+        total = body.get('total', 0)
+        page = 0
+        while len(elements) < total:
+            page += 1
+            page_digest, body = self._queue_page({**params, "page": str(page)}, (workspace_id, page_size, page))
+            if not body.get('elements'):
+                break
+            digest.update(page_digest.encode())
+            elements.extend(body['elements'])
+        self._drop_pages(workspace_id, page_size, page)
+        if workspace_id:
+            elements = [q for q in elements if q['workspaceId'] == workspace_id]
+        return {'elements': elements, 'total': total, 'snapshotVersion': digest.hexdigest()}
+
+    # Forget cached pages past the last one fetched, e.g. after the account shrank
+    def _drop_pages(self, workspace_id, page_size, last_page):
+        with self._pages_lock:
+            for key in [k for k in self._pages if k[:2] == (workspace_id, page_size) and k[2] > last_page]:
+                del self._pages[key]
+
+    def assign(self, queue_id, user_ids, weight=None):
+        if weight is not None:
+            return self._request("POST", f"/queue/{queue_id}/user/assign/weighted", "user.assign_weighted",
+                                 json={"users": list(user_ids), "weight": weight})
+        return self._request("POST", f"/queue/{queue_id}/user/assign", "user.assign", json=list(user_ids))
+
+    def unassign(self, queue_id, user_ids):
+        return self._request("POST", f"/queue/{queue_id}/user/unassign", "user.unassign", json=list(user_ids))
+
+    def update_weight(self, queue_id, user_ids, weight):
+        return self._request("POST", f"/queue/{queue_id}/user/update/weighted", "user.update_weighted",
+                             json={"users": list(user_ids), "weight": weight})
@@ -0,0 +1,136 @@
+"""Chunked exports of the membership table and participation matrices.
+
+Exports are written chunk by chunk to a spool file per (snapshot version,
+dataset, format), so the serialized output never exists as one big string
+and repeat downloads of the same snapshot reuse the file. Datasets are
+either a DataFrame or an iterable of DataFrame chunks (e.g. the dense
+slices of a sparse participation matrix). The download itself still goes
+through st.download_button, which loads the file into Streamlit's in-memory
+media store for the session; it doesn't stream.
+"""
+import logging
+import os
+import threading
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'CSV': ('csv', "text/csv"),
+    'Parquet': ('parquet', "application/vnd.apache.parquet"),
+    'JSON lines': ('jsonl', "application/x-ndjson"),
+}
+
+CHUNK_ROWS = 5000
+
+# Spool files of this many most recent snapshot versions are kept on disk
+KEEP_VERSIONS = 3
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# Row slices of a DataFrame, or the chunks of an already chunked dataset as they come.
+# Always yields at least one (possibly empty) chunk so headers and schemas get written.
+def iter_chunks(frames, chunk_rows=CHUNK_ROWS):
+    if isinstance(frames, pd.DataFrame):
+        for start in range(0, max(len(frames), 1), chunk_rows):
+            yield frames.iloc[start:start + chunk_rows]
+    else:
+        yield from frames
+
+
+def iter_csv(frames, chunk_rows=CHUNK_ROWS, index=False):
+    for n, chunk in enumerate(iter_chunks(frames, chunk_rows)):
+        yield chunk.to_csv(header=n == 0, index=index)
+
+
+def iter_jsonl(frames, chunk_rows=CHUNK_ROWS, index=False):
+    for chunk in iter_chunks(frames, chunk_rows):
+        if chunk.empty:
+            continue
+        if index:
+            chunk = chunk.reset_index()
+        lines = chunk.to_json(orient='records', lines=True)
+        yield lines if lines.endswith("\n") else lines + "\n"
+
+
+def write_parquet(frames, path, chunk_rows=CHUNK_ROWS, index=False):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in iter_chunks(frames, chunk_rows):
+            if index:
+                chunk = chunk.reset_index()
+            if writer is None:
+                # The first chunk fixes the schema; an empty frame still gets a valid file
+                schema = pa.Table.from_pandas(chunk, preserve_index=False).schema
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _lock_for(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+# Path of the spooled export, building it with frame_fn() only if it doesn't exist yet.
+# Concurrent requests for the same export wait for a single build.
+def spool_export(directory, version, dataset, fmt, frame_fn, index=False):
+    extension = EXPORT_FORMATS[fmt][0]
+    path = os.path.join(directory, f"{version}_{dataset}.{extension}")
+    with _lock_for(path):
+        if os.path.exists(path):
+            return path
+        os.makedirs(directory, exist_ok=True)
+        frames = frame_fn()
+        tmp_path = f"{path}.tmp"
+        try:
+            if extension == 'parquet':
+                write_parquet(frames, tmp_path, index=index)
+            else:
+                chunks = iter_csv(frames, index=index) if extension == 'csv' else iter_jsonl(frames, index=index)
+                with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.info(f"Spooled {dataset} export for snapshot {version} to {path}")
+    prune_exports(directory, version)
+    return path
+
+
+# Remove spool files belonging to all but the most recent snapshot versions
+def prune_exports(directory, current_version, keep=KEEP_VERSIONS):
+    try:
+        entries = [e for e in os.scandir(directory) if e.is_file() and not e.name.endswith(".tmp")]
+    except FileNotFoundError:
+        return
+    latest = {}
+    for entry in entries:
+        version = entry.name.split("_", 1)[0]
+        latest[version] = max(latest.get(version, 0), entry.stat().st_mtime)
+    recent = sorted(latest, key=latest.get, reverse=True)[:keep]
+    for entry in entries:
+        version = entry.name.split("_", 1)[0]
+        if version not in recent and version != current_version:
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                logger.warning(f"Could not remove old export {entry.path}: {str(e)}")
@@ -0,0 +1,155 @@
+"""Non-blocking, structured logging for the dashboard process.
+
+setup_logging() puts a queue in front of the real handlers: the logging call
+only enqueues the record, and a listener thread formats and writes it, so
+API calls and bulk mutations never wait on log I/O. Message arguments are
+passed %-style ("%s", user_ids), so they are only rendered for records that
+pass the level check and the sampler; the message is rendered when it is
+enqueued, so it shows the arguments as they were when logged.
+
+Records are written as JSON lines (CHILI_LOG_FORMAT=text for the old plain
+format) with the correlation ids active where they were logged: the
+rerun_id of the Streamlit rerun and the batch_id of a bulk mutation (see
+correlate()). Fields passed as extra={...} are included. DEBUG records are
+sampled: the first of each message template is kept and then one in
+DEBUG_SAMPLE_EVERY.
+"""
+import atexit
+import contextlib
+import copy
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import uuid
+
+LOG_FORMAT = os.getenv("CHILI_LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("CHILI_LOG_LEVEL", "INFO").upper()
+DEBUG_SAMPLE_EVERY = int(os.getenv("CHILI_LOG_DEBUG_SAMPLE", "100"))
+
+# Message templates tracked by the sampler before its counts start over
+SAMPLER_MAX_KEYS = 10000
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {'message', 'asctime', 'correlation'}
+
+_context = contextvars.ContextVar("log_context", default={})
+_lock = threading.Lock()
+_listener = None
+
+
+def new_id():
+    return uuid.uuid4().hex[:12]
+
+
+# Correlation ids (e.g. rerun_id, batch_id) attached to every record logged inside
+# the block, including from threads started with contextvars.copy_context()
+@contextlib.contextmanager
+def correlate(**ids):
+    token = _context.set({**_context.get(), **ids})
+    try:
+        yield ids
+    finally:
+        _context.reset(token)
+
+
+def current_ids():
+    return dict(_context.get())
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamps records with the correlation ids of the thread that logged them."""
+
+    def filter(self, record):
+        record.correlation = _context.get()
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Keeps the first DEBUG record of each logger and message template, then one in `every`."""
+
+    def __init__(self, every=DEBUG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = max(every, 1)
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG or self.every == 1:
+            return True
+        key = (record.name, record.msg)
+        with self.lock:
+            if len(self.seen) >= SAMPLER_MAX_KEYS and key not in self.seen:
+                self.seen.clear()
+            count = self.seen.get(key, 0)
+            self.seen[key] = count + 1
+        if count % self.every:
+            return False
+        record.sampled = self.every if count else 1
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that renders only the message on the logging thread.
+
+    prepare() runs after the level check and the filters, so dropped records
+    are never rendered. The message is rendered here, since arguments such as
+    lists may change before the listener gets to them. The stock handler
+    also applies the formatter; that part (JSON, timestamps) is left to the
+    listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName,
+        }
+        entry.update(getattr(record, 'correlation', {}))
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Route the root logger through the queue once per process; later calls (one per
+# Streamlit rerun) return the running listener
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return _listener
+        output = logging.StreamHandler(stream)
+        output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+        records = queue.SimpleQueue()
+        handler = LazyQueueHandler(records)
+        handler.addFilter(CorrelationFilter())
+        handler.addFilter(DebugSampler())
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        return _listener
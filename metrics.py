@@ -0,0 +1,235 @@
+"""Process-wide timing spans and counters for the dashboard.
+
+Lives in its own module because Streamlit re-executes chili.py on every
+rerun; imported modules keep their state for the life of the process.
+Metrics are exported in Prometheus text format by start_metrics_server().
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "chili"
+
+# Histogram buckets in seconds, tuned for UI phases and API round trips
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Counters exported even before they are first incremented
+COUNTER_HELP = {
+    'reruns': "Script reruns that were timed.",
+    'cache_hits': "Cache lookups served from memory.",
+    'cache_misses': "Cache lookups that had to be recomputed or fetched.",
+    'api_errors': "Failed Chili Piper API calls.",
+    'api_throttled': "API calls delayed by a tenant rate limit.",
+    'api_rejected': "API calls refused without a request because the circuit breaker was open.",
+    'circuit_opened': "Times the API circuit breaker opened after repeated upstream failures.",
+    'coalesced': "Callers that waited for an in-flight fetch or computation instead of starting their own.",
+    'sheets_errors': "Failed Google Sheets calls.",
+    'webhook_events': "Change events received, by what they did to the cache.",
+    'alerts': "Coverage and anomaly alerts opened and resolved, by rule.",
+}
+
+_lock = threading.Lock()
+_histograms = {}  # span name -> {'buckets': [...], 'sum': float, 'count': int}
+_counters = defaultdict(float)  # (name, sorted label items) -> value
+_current_rerun = contextvars.ContextVar("current_rerun", default=None)
+_server = None
+
+
+class RerunRecord:
+    """Spans recorded during a single script run, in start order."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.total_ms = None
+        self.spans = []  # [name, depth, offset_ms, duration_ms]
+        self.depth = 0
+        self.open = []  # Spans started and not stopped yet, innermost last
+
+    def elapsed_ms(self):
+        if self.total_ms is not None:
+            return self.total_ms
+        return (time.perf_counter() - self.start) * 1000
+
+
+class Span:
+    """Times a block. Use as a context manager, or call start()/stop() directly."""
+
+    def __init__(self, name):
+        self.name = name
+        self.entry = None
+        self.rerun = None
+        self.begin = None
+        self.duration = None  # seconds, once stopped
+
+    def start(self):
+        self.begin = time.perf_counter()
+        self.rerun = _current_rerun.get()
+        if self.rerun is not None:
+            self.entry = [self.name, self.rerun.depth, (self.begin - self.rerun.start) * 1000, None]
+            self.rerun.spans.append(self.entry)
+            self.rerun.depth += 1
+            self.rerun.open.append(self)
+        return self
+
+    def stop(self):
+        if self.begin is None:
+            return 0.0
+        duration = self.duration = time.perf_counter() - self.begin
+        self.begin = None
+        observe(self.name, duration)
+        if self.entry is not None:
+            self.entry[3] = duration * 1000
+            self.rerun.depth -= 1
+            if self in self.rerun.open:
+                self.rerun.open.remove(self)
+        return duration
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def span(name):
+    return Span(name)
+
+
+# Decorator form of span(), named after the function unless given a name
+def timed(name=None):
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name, seconds):
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist['buckets'][i] += 1
+        hist['sum'] += seconds
+        hist['count'] += 1
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        _counters[(name, tuple(sorted(labels.items())))] += amount
+
+
+def counter_value(name, **labels):
+    with _lock:
+        if labels:
+            return _counters.get((name, tuple(sorted(labels.items()))), 0)
+        return sum(v for (n, _), v in _counters.items() if n == name)
+
+
+# Per-rerun breakdowns: chili.py wraps each script run with these. Spans started with
+# start() and left open (an exception, or st.rerun() raising) are stopped by finish_rerun.
+def start_rerun():
+    record = RerunRecord()
+    record.token = _current_rerun.set(record)
+    return record
+
+
+def finish_rerun(record):
+    for span in reversed(list(record.open)):
+        span.stop()
+    record.total_ms = (time.perf_counter() - record.start) * 1000
+    _current_rerun.reset(record.token)
+    observe("rerun", record.total_ms / 1000)
+    inc("reruns")
+    return record
+
+
+def current_rerun():
+    return _current_rerun.get()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(items):
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def render_prometheus():
+    with _lock:
+        histograms = {name: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                      for name, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = [
+        f"# HELP {PREFIX}_span_duration_seconds Time spent in instrumented phases, API and Sheets calls.",
+        f"# TYPE {PREFIX}_span_duration_seconds histogram",
+    ]
+    for name in sorted(histograms):
+        hist = histograms[name]
+        for bound, count in zip(BUCKETS, hist['buckets']):
+            lines.append(f"{PREFIX}_span_duration_seconds_bucket{_labels([('span', name), ('le', bound)])} {count}")
+        lines.append(f"{PREFIX}_span_duration_seconds_bucket{_labels([('span', name), ('le', '+Inf')])} {hist['count']}")
+        lines.append(f"{PREFIX}_span_duration_seconds_sum{_labels([('span', name)])} {hist['sum']:.6f}")
+        lines.append(f"{PREFIX}_span_duration_seconds_count{_labels([('span', name)])} {hist['count']}")
+
+    names = sorted(set(COUNTER_HELP) | {name for name, _ in counters})
+    for name in names:
+        lines.append(f"# HELP {PREFIX}_{name}_total {COUNTER_HELP.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+        samples = sorted((labels, value) for (n, labels), value in counters.items() if n == name)
+        if not samples:
+            lines.append(f"{PREFIX}_{name}_total 0")
+        for labels, value in samples:
+            lines.append(f"{PREFIX}_{name}_total{_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format, *args)
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Start the /metrics endpoint once per process; later calls are no-ops
+def start_metrics_server(port, host="127.0.0.1"):
+    global _server
+    with _lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.error(f"Could not start metrics endpoint on {host}:{port}: {str(e)}")
+            return None
+        _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return _server
@@ -0,0 +1,401 @@
+"""Local stand-in for the Chili Piper edge API.
+
+Serves a synthetic account so the dashboard and bench.py can be exercised
+without a real API key:
+
+    python mock_server.py --queues 300 --reps 800 --latency-ms 40 --error-rate 0.02
+    CHILI_API_BASE_URL=http://127.0.0.1:8765 CHILI_API_KEY=mock streamlit run chili.py
+
+Implements GET /queue (paginated, with an optional workspaceId filter and
+ETag / If-None-Match support) and the assign / weighted assign / unassign /
+weighted update member endpoints used by chili.py. Every change is recorded
+as a webhook event (see webhooks.py), which can be written to a JSON lines
+file with --events-out or delivered live with --webhook-url.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import queue as queue_module
+import random
+import re
+import threading
+import time
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+# Same ids as WORKSPACE_NAMES in queue_data.py so the dashboard shows Sales / CS
+DEFAULT_WORKSPACE_IDS = ["64ad3cc865a4906cd3cc2dcf", "61b9daad2747672e7282273d"]
+
+SIZE_RANGES = ["1-10", "11-30", "31-50", "51-100", "101-250", "251-1000", None]
+
+DEFAULT_ASSIGN_WEIGHT = 50
+
+MEMBER_PATH = re.compile(r"^/queue/([^/]+)/user/(assign|assign/weighted|unassign|update/weighted)$")
+
+# Webhook event type per member endpoint
+EVENT_TYPES = {
+    'assign': "member.assigned",
+    'assign/weighted': "member.assigned",
+    'unassign': "member.unassigned",
+    'update/weighted': "member.updated",
+}
+
+
+# Build a synthetic account payload shaped like the /queue response
+def generate_account(n_queues=100, n_reps=300, n_workspaces=2, max_members=25, seed=0):
+    rng = random.Random(seed)
+    workspace_ids = DEFAULT_WORKSPACE_IDS[:n_workspaces]
+    while len(workspace_ids) < n_workspaces:
+        workspace_ids.append(f"{rng.getrandbits(96):024x}")
+
+    reps = [{'id': f"{0xa000000 + i:024x}", 'name': f"Rep {i:05d}"} for i in range(n_reps)]
+    # Every rep has a home workspace; a few also show up in other workspaces' queues
+    reps_by_workspace = {ws: [] for ws in workspace_ids}
+    for i, rep in enumerate(reps):
+        reps_by_workspace[workspace_ids[i % n_workspaces]].append(rep)
+
+    queues = []
+    for q in range(n_queues):
+        workspace_id = workspace_ids[q % n_workspaces]
+        pool = reps_by_workspace[workspace_id] or reps
+        size = min(len(pool), rng.randint(1, max_members))
+        chosen = rng.sample(pool, size)
+        if rng.random() < 0.1:
+            chosen.append(rng.choice(reps))
+        members = []
+        seen = set()
+        for order, rep in enumerate(chosen):
+            if rep['id'] in seen:
+                continue
+            seen.add(rep['id'])
+            members.append({
+                'id': rep['id'],
+                'name': rep['name'],
+                'weight': rng.choice([0, 10, 25, 50, 50, 75, 100]),
+                'order': order,
+                'initialOrder': order,
+                'main': rng.random() < 0.2,
+                'mandatory': rng.random() < 0.05,
+            })
+        size_range = rng.choice(SIZE_RANGES)
+        rules = []
+        if size_range:
+            rules.append({'entity': 'Contact', 'field': 'numofemployeesrange', 'operator': '=', 'value': size_range})
+        queues.append({
+            'id': f"{0xb000000 + q:024x}",
+            'name': f"Queue {q:04d}",
+            'workspaceId': workspace_id,
+            'active': rng.random() < 0.9,
+            'members': members,
+            'rules': rules,
+        })
+
+    # The dashboard special-cases this queue, so the mock carries one too
+    queues.append({
+        'id': f"{0xbffffff:024x}",
+        'name': "Existing Customer - Owner",
+        'workspaceId': workspace_ids[0],
+        'active': True,
+        'members': [{'id': r['id'], 'name': r['name'], 'weight': 1, 'order': i, 'initialOrder': i,
+                     'main': False, 'mandatory': False} for i, r in enumerate(reps[:10])],
+        'rules': [],
+    })
+    return {'queues': queues, 'users': {r['id']: r['name'] for r in reps}}
+
+
+class MockAccount:
+    """Mutable in-memory account shared by all request handler threads."""
+
+    def __init__(self, account):
+        self.lock = threading.Lock()
+        self.queues = account['queues']
+        self.queues_by_id = {q['id']: q for q in self.queues}
+        self.users = account['users']
+        self.events = []
+        # Callables invoked with each new event, under the account lock
+        self.listeners = []
+        # (method, endpoint, API key) -> request count
+        self.requests = Counter()
+
+    def count_request(self, method, endpoint, api_key):
+        with self.lock:
+            self.requests[(method, endpoint, api_key)] += 1
+
+    # Record a change to a queue as a webhook event carrying the queue's new state
+    def record(self, event_type, queue_id):
+        with self.lock:
+            queue = self.queues_by_id[queue_id]
+            event = {
+                'type': event_type,
+                'queueId': queue_id,
+                'workspaceId': queue['workspaceId'],
+                'occurredAt': time.time(),
+                'queue': json.loads(json.dumps(queue)),
+            }
+            self.events.append(event)
+            for listener in self.listeners:
+                listener(event)
+
+    def page(self, page, page_size, workspace_id=None):
+        with self.lock:
+            queues = self.queues
+            if workspace_id:
+                queues = [q for q in queues if q['workspaceId'] == workspace_id]
+            elements = queues[page * page_size:(page + 1) * page_size]
+            return {
+                'elements': json.loads(json.dumps(elements)),
+                'page': page,
+                'pageSize': page_size,
+                'total': len(queues),
+            }
+
+    def assign(self, queue_id, user_ids, weight):
+        with self.lock:
+            queue = self.queues_by_id[queue_id]
+            existing = {m['id'] for m in queue['members']}
+            added = 0
+            for user_id in user_ids:
+                if user_id in existing or user_id not in self.users:
+                    continue
+                order = len(queue['members'])
+                queue['members'].append({
+                    'id': user_id, 'name': self.users[user_id], 'weight': weight,
+                    'order': order, 'initialOrder': order, 'main': False, 'mandatory': False,
+                })
+                added += 1
+            return added
+
+    def unassign(self, queue_id, user_ids):
+        with self.lock:
+            queue = self.queues_by_id[queue_id]
+            before = len(queue['members'])
+            remove = set(user_ids)
+            queue['members'] = [m for m in queue['members'] if m['id'] not in remove]
+            for order, member in enumerate(queue['members']):
+                member['order'] = order
+            return before - len(queue['members'])
+
+    def update_weight(self, queue_id, user_ids, weight):
+        with self.lock:
+            queue = self.queues_by_id[queue_id]
+            targets = set(user_ids)
+            updated = 0
+            for member in queue['members']:
+                if member['id'] in targets:
+                    member['weight'] = weight
+                    updated += 1
+            return updated
+
+
+class MockChiliHandler(BaseHTTPRequestHandler):
+    server_version = "MockChiliPiper/1.0"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status, body, etag=False):
+        payload = json.dumps(body).encode()
+        if etag:
+            tag = f'"{hashlib.blake2b(payload, digest_size=12).hexdigest()}"'
+            if self.headers.get("If-None-Match") == tag:
+                self.send_response(304)
+                self.send_header("ETag", tag)
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if etag:
+            self.send_header("ETag", tag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Shared preamble: auth check plus injected latency and errors
+    def _preflight(self):
+        config = self.server.config
+        authorization = self.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer "):
+            self._send_json(401, {'error': 'missing bearer token'})
+            return False
+        endpoint = "/queue" if self.command == "GET" else "/queue/members"
+        self.server.account.count_request(self.command, endpoint, authorization[len("Bearer "):])
+        delay = config['latency_ms'] + random.uniform(0, config['jitter_ms'])
+        if delay:
+            time.sleep(delay / 1000)
+        if config['error_rate'] and random.random() < config['error_rate']:
+            self._send_json(config['error_status'], {'error': 'injected failure'})
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/queue":
+            self._send_json(404, {'error': 'not found'})
+            return
+        if not self._preflight():
+            return
+        query = parse_qs(url.query)
+        try:
+            page = int(query.get('page', ['0'])[0])
+            page_size = int(query.get('pageSize', ['100'])[0])
+        except ValueError:
+            self._send_json(400, {'error': 'page and pageSize must be integers'})
+            return
+        workspace_id = query.get('workspaceId', [None])[0]
+        self._send_json(200, self.server.account.page(page, page_size, workspace_id), etag=self.server.config['etags'])
+
+    def do_POST(self):
+        match = MEMBER_PATH.match(urlparse(self.path).path)
+        if not match:
+            self._send_json(404, {'error': 'not found'})
+            return
+        if not self._preflight():
+            return
+        queue_id, action = match.groups()
+        account = self.server.account
+        if queue_id not in account.queues_by_id:
+            self._send_json(404, {'error': f'queue {queue_id} not found'})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"null")
+            if action in ("assign", "unassign"):
+                user_ids, weight = list(body), DEFAULT_ASSIGN_WEIGHT
+            else:
+                user_ids, weight = list(body['users']), int(body['weight'])
+        except (ValueError, TypeError, KeyError):
+            self._send_json(400, {'error': 'malformed request body'})
+            return
+
+        if action == "unassign":
+            count = account.unassign(queue_id, user_ids)
+        elif action == "update/weighted":
+            count = account.update_weight(queue_id, user_ids, weight)
+        else:
+            count = account.assign(queue_id, user_ids, weight)
+        if count:
+            account.record(EVENT_TYPES[action], queue_id)
+        self._send_json(200, {'queueId': queue_id, 'updated': count})
+
+
+class MockChiliServer:
+    """Run the mock API on a background thread, e.g. from bench.py."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0, jitter_ms=0, error_rate=0.0,
+                 error_status=503, etags=True, **account_options):
+        self.httpd = ThreadingHTTPServer((host, port), MockChiliHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.account = MockAccount(generate_account(**account_options))
+        self.httpd.config = {
+            'latency_ms': latency_ms,
+            'jitter_ms': jitter_ms,
+            'error_rate': error_rate,
+            'error_status': error_status,
+            'etags': etags,
+        }
+        self.thread = None
+
+    @property
+    def config(self):
+        return self.httpd.config
+
+    @property
+    def account(self):
+        return self.httpd.account
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-chili", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class EventForwarder:
+    """POSTs the account's change events to a webhook URL from a background thread."""
+
+    def __init__(self, account, url):
+        self.url = url
+        self.pending = queue_module.Queue()
+        account.listeners.append(self.pending.put)
+        threading.Thread(target=self._run, name="mock-webhooks", daemon=True).start()
+
+    def _run(self):
+        while True:
+            event = self.pending.get()
+            request = urllib.request.Request(self.url, data=json.dumps(event).encode(), method="POST",
+                                             headers={"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(request, timeout=10).close()
+            except OSError as e:
+                logger.warning(f"Could not deliver {event['type']} event to {self.url}: {str(e)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Chili Piper queue API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--queues", type=int, default=100, help="number of synthetic queues")
+    parser.add_argument("--reps", type=int, default=300, help="number of synthetic reps")
+    parser.add_argument("--workspaces", type=int, default=2)
+    parser.add_argument("--max-members", type=int, default=25, help="max members per queue")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0, help="fixed latency added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="random extra latency up to this value")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--no-etags", action="store_true", help="never answer 304 Not Modified")
+    parser.add_argument("--events-out", help="append every change event to this JSON lines file")
+    parser.add_argument("--webhook-url", help="deliver change events to this receiver, e.g. http://127.0.0.1:8766/events")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    server = MockChiliServer(
+        host=args.host, port=args.port,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, error_status=args.error_status, etags=not args.no_etags,
+        n_queues=args.queues, n_reps=args.reps, n_workspaces=args.workspaces,
+        max_members=args.max_members, seed=args.seed,
+    )
+    if args.events_out:
+        events_file = open(args.events_out, "a")
+
+        def write_event(event):
+            events_file.write(json.dumps(event) + "\n")
+            events_file.flush()
+        server.account.listeners.append(write_event)
+    if args.webhook_url:
+        EventForwarder(server.account, args.webhook_url)
+    logger.info(f"Mock Chili Piper API listening on {server.base_url} "
+                f"({args.queues} queues, {args.reps} reps)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
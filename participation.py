@@ -0,0 +1,133 @@
+"""Sparse rep x queue participation matrix.
+
+Most reps sit in a handful of queues, so the matrix is stored CSR-style:
+for row i, indices[indptr[i]:indptr[i + 1]] are the queue columns the rep
+belongs to and data[...] their weights. Memory scales with memberships, and
+dense frames are only materialized for the rows and columns being shown or
+exported.
+"""
+import numpy as np
+import pandas as pd
+
+
+class ParticipationMatrix:
+    def __init__(self, rep_names, queue_names, indptr, indices, data):
+        self.rep_names = np.asarray(rep_names, dtype=object)
+        self.queue_names = np.asarray(queue_names, dtype=object)
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    # Build from parallel (rep, queue, weight) sequences. Rows and columns keep the
+    # order in which reps and queues first appear; a repeated (rep, queue) pair keeps its last weight.
+    @classmethod
+    def from_entries(cls, reps, queues, weights, queue_names=None):
+        row_codes, rep_names = pd.factorize(pd.Series(reps, dtype=object))
+        if queue_names is None:
+            col_codes, queue_names = pd.factorize(pd.Series(queues, dtype=object))
+        else:
+            queue_names = pd.Index(queue_names)
+            col_codes = queue_names.get_indexer(pd.Series(queues, dtype=object))
+        return cls._from_codes(rep_names, queue_names, row_codes, col_codes, np.asarray(weights, dtype=np.int64))
+
+    # One matrix with the entries of `matrices` in order, as if from_entries had been
+    # given all their entries at once (used to merge the shards of a parallel build)
+    @classmethod
+    def concat(cls, matrices):
+        row_offsets = np.cumsum([0] + [len(m.rep_names) for m in matrices])
+        col_offsets = np.cumsum([0] + [len(m.queue_names) for m in matrices])
+        row_map, rep_names = pd.factorize(pd.Series(np.concatenate([m.rep_names for m in matrices]), dtype=object))
+        col_map, queue_names = pd.factorize(pd.Series(np.concatenate([m.queue_names for m in matrices]),
+                                                      dtype=object))
+        row_codes = np.concatenate([row_map[offset + m._row_of_entries()] for m, offset in zip(matrices, row_offsets)])
+        col_codes = np.concatenate([col_map[offset + m.indices] for m, offset in zip(matrices, col_offsets)])
+        weights = np.concatenate([m.data for m in matrices])
+        return cls._from_codes(rep_names, queue_names, row_codes, col_codes, weights)
+
+    @classmethod
+    def _from_codes(cls, rep_names, queue_names, row_codes, col_codes, weights):
+        pairs = pd.DataFrame({'row': row_codes, 'col': col_codes, 'weight': weights})
+        pairs = pairs[pairs['col'] >= 0].drop_duplicates(['row', 'col'], keep='last').sort_values(['row', 'col'])
+        rows = pairs['row'].to_numpy()
+        indptr = np.zeros(len(rep_names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(rep_names)), out=indptr[1:])
+        return cls(rep_names, queue_names, indptr,
+                   pairs['col'].to_numpy(dtype=np.int32), pairs['weight'].to_numpy(dtype=np.int64))
+
+    @property
+    def shape(self):
+        return len(self.rep_names), len(self.queue_names)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    # Row index of every stored entry
+    def _row_of_entries(self):
+        return np.repeat(np.arange(len(self.rep_names)), np.diff(self.indptr))
+
+    def row_sums(self):
+        return np.bincount(self._row_of_entries(), weights=self.data, minlength=len(self.rep_names))
+
+    def col_sums(self):
+        return np.bincount(self.indices, weights=self.data, minlength=len(self.queue_names))
+
+    # Memberships per rep / per queue (zero weights included)
+    def row_counts(self):
+        return np.diff(self.indptr)
+
+    def col_counts(self):
+        return np.bincount(self.indices, minlength=len(self.queue_names))
+
+    # Sub-matrix of the given reps and queues (labels), in the order given
+    def select(self, reps=None, queues=None):
+        rows = np.arange(len(self.rep_names)) if reps is None else self._positions(self.rep_names, reps)
+        cols = np.arange(len(self.queue_names)) if queues is None else self._positions(self.queue_names, queues)
+        return self.take(rows, cols)
+
+    # Sub-matrix by row and column positions
+    def take(self, rows, cols):
+        col_map = np.full(len(self.queue_names), -1, dtype=np.int64)
+        col_map[cols] = np.arange(len(cols))
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        lengths = ends - starts
+        entry = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths) + np.arange(lengths.sum())
+        new_cols = col_map[self.indices[entry]]
+        keep = new_cols >= 0
+        new_rows = np.repeat(np.arange(len(rows)), lengths)[keep]
+        order = np.lexsort((new_cols[keep], new_rows))
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(new_rows, minlength=len(rows)), out=indptr[1:])
+        return ParticipationMatrix(self.rep_names[rows], self.queue_names[cols], indptr,
+                                   new_cols[keep][order].astype(np.int32), self.data[entry][keep][order])
+
+    @staticmethod
+    def _positions(labels, wanted):
+        index = pd.Index(labels)
+        positions = index.get_indexer(pd.Index(wanted).unique())
+        return positions[positions >= 0]
+
+    # The k largest rows (axis=0) or columns (axis=1) by weight sum, as (label, sum) pairs
+    def top_k(self, k, axis=0):
+        sums, labels = (self.row_sums(), self.rep_names) if axis == 0 else (self.col_sums(), self.queue_names)
+        k = min(k, len(sums))
+        if k <= 0:
+            return []
+        top = np.argpartition(-sums, k - 1)[:k]
+        top = top[np.argsort(-sums[top], kind='stable')]
+        return [(labels[i], float(sums[i])) for i in top]
+
+    # Dense rep x queue frame with zeros for missing memberships
+    def to_frame(self, start=0, stop=None):
+        stop = len(self.rep_names) if stop is None else min(stop, len(self.rep_names))
+        dense = np.zeros((max(stop - start, 0), len(self.queue_names)), dtype=np.int64)
+        lo, hi = self.indptr[start], self.indptr[stop]
+        rows = self._row_of_entries()[lo:hi] - start
+        dense[rows, self.indices[lo:hi]] = self.data[lo:hi]
+        return pd.DataFrame(dense, index=pd.Index(self.rep_names[start:stop], name='Rep Name'),
+                            columns=list(self.queue_names))
+
+    # Dense frames of at most chunk_rows reps each, for streaming exports
+    def iter_frames(self, chunk_rows):
+        for start in range(0, max(len(self.rep_names), 1), chunk_rows):
+            yield self.to_frame(start, start + chunk_rows)
@@ -0,0 +1,153 @@
+"""Compact storage for the queue and rep pivots of generate_statistics().
+
+Memberships are stored once, column-wise, in a MembershipTable: names and
+ids are interned into lookup lists and every membership is a row of small
+integer codes. queue_pivot and rep_pivot then hold PivotRows views (a
+slice of a sorted row permutation, created on lookup) instead of two
+dicts of lists of 6-tuples, and materialize the familiar tuples only
+while they are being iterated.
+"""
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+
+class MembershipTable:
+    """Append-only membership rows; call finish() before grouping."""
+
+    def __init__(self):
+        self.rep_names, self._rep_codes = [], {}
+        self.queue_names, self._queue_codes = [], {}
+        self.ids, self._id_codes = [], {}
+        self._columns = {name: [] for name in ('rep', 'queue', 'user_id', 'queue_id', 'weight', 'order', 'initial_order')}
+
+    @staticmethod
+    def _code(value, values, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def append(self, rep_name, queue_name, weight, order, initial_order, user_id, queue_id):
+        columns = self._columns
+        columns['rep'].append(self._code(rep_name, self.rep_names, self._rep_codes))
+        columns['queue'].append(self._code(queue_name, self.queue_names, self._queue_codes))
+        columns['user_id'].append(self._code(user_id, self.ids, self._id_codes))
+        columns['queue_id'].append(self._code(queue_id, self.ids, self._id_codes))
+        columns['weight'].append(weight)
+        columns['order'].append(order)
+        columns['initial_order'].append(initial_order)
+
+    # Freeze the columns into int32 arrays; the name -> code dicts stay for pivot lookups
+    def finish(self):
+        for name, values in self._columns.items():
+            setattr(self, name, np.asarray(values, dtype=np.int32))
+        self._columns = self._id_codes = None
+        return self
+
+    def __len__(self):
+        return len(self.rep)
+
+    # One finished table with the rows of `tables` in order, as if they had been
+    # appended to a single table (used to merge the shards of a parallel build)
+    @classmethod
+    def concat(cls, tables):
+        merged = cls()
+        id_codes = {}
+        columns = {name: [] for name in merged._columns}
+        for table in tables:
+            rep_map = np.array([cls._code(name, merged.rep_names, merged._rep_codes) for name in table.rep_names],
+                               dtype=np.int32)
+            queue_map = np.array([cls._code(name, merged.queue_names, merged._queue_codes)
+                                  for name in table.queue_names], dtype=np.int32)
+            id_map = np.array([cls._code(value, merged.ids, id_codes) for value in table.ids], dtype=np.int32)
+            columns['rep'].append(rep_map[table.rep] if len(table) else table.rep)
+            columns['queue'].append(queue_map[table.queue] if len(table) else table.queue)
+            columns['user_id'].append(id_map[table.user_id] if len(table) else table.user_id)
+            columns['queue_id'].append(id_map[table.queue_id] if len(table) else table.queue_id)
+            for name in ('weight', 'order', 'initial_order'):
+                columns[name].append(getattr(table, name))
+        for name, parts in columns.items():
+            setattr(merged, name, np.concatenate(parts).astype(np.int32) if parts else np.zeros(0, dtype=np.int32))
+        merged._columns = None
+        return merged
+
+    # Read-only {label: PivotRows} grouped by `key` ('queue' or 'rep'), with groups in
+    # order of first appearance and rows sorted by order, ties kept in append order
+    def group_by(self, key):
+        return Pivot(self, key)
+
+    # Rows as tuples of (name, weight, order, initial order, user id, queue id), where
+    # name is the rep name or the queue name depending on `first`
+    def rows(self, first, positions):
+        names = self.rep_names if first == 'rep' else self.queue_names
+        ids = self.ids
+        return [
+            (names[name], weight, order, initial_order, ids[user_id], ids[queue_id])
+            for name, weight, order, initial_order, user_id, queue_id in zip(
+                getattr(self, first)[positions].tolist(), self.weight[positions].tolist(),
+                self.order[positions].tolist(), self.initial_order[positions].tolist(),
+                self.user_id[positions].tolist(), self.queue_id[positions].tolist()
+            )
+        ]
+
+
+class Pivot(Mapping):
+    """Rows of a MembershipTable grouped by queue or by rep."""
+
+    __slots__ = ('table', 'labels', 'codes', 'first', 'permutation', 'bounds')
+
+    def __init__(self, table, key):
+        self.table = table
+        self.labels = table.queue_names if key == 'queue' else table.rep_names
+        self.codes = table._queue_codes if key == 'queue' else table._rep_codes
+        self.first = 'rep' if key == 'queue' else 'queue'
+        group_codes = getattr(table, key)
+        self.permutation = np.lexsort((table.order, group_codes)).astype(np.int32)
+        self.bounds = np.zeros(len(self.labels) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(group_codes, minlength=len(self.labels)), out=self.bounds[1:])
+
+    def __getitem__(self, label):
+        code = self.codes[label]
+        return PivotRows(self.table, self.first, self.permutation, int(self.bounds[code]), int(self.bounds[code + 1]))
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class PivotRows(Sequence):
+    """One queue's members or one rep's queues, read-only and tuple-compatible."""
+
+    __slots__ = ('table', 'first', 'permutation', 'start', 'stop')
+
+    def __init__(self, table, first, permutation, start, stop):
+        self.table = table
+        self.first = first
+        self.permutation = permutation
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.table.rows(self.first, self.permutation[self.start:self.stop][item])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        return self.table.rows(self.first, self.permutation[self.start + item:self.start + item + 1])[0]
+
+    def __iter__(self):
+        return iter(self.table.rows(self.first, self.permutation[self.start:self.stop]))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"PivotRows({list(self)!r})"
@@ -0,0 +1,253 @@
+"""Queue payload helpers shared by the dashboard and background workers.
+
+Kept free of Streamlit so it can be imported from worker threads, process
+pools and the benchmark without running the app.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from collections import Counter
+
+import metrics
+from participation import ParticipationMatrix
+from pivots import MembershipTable
+
+logger = logging.getLogger(__name__)
+
+# Workspace ID to name mapping
+DEFAULT_WORKSPACE_NAMES = {
+    "64ad3cc865a4906cd3cc2dcf": "Sales",
+    "61b9daad2747672e7282273d": "CS"
+}
+
+# Per-workspace settings. CHILI_WORKSPACES can override them with a JSON object
+# mapping workspace id to a name or to {"name": ..., "ttl": refresh seconds}.
+# Workspaces that only show up in the data are named by their id.
+def load_workspace_config(raw=None):
+    raw = os.getenv("CHILI_WORKSPACES") if raw is None else raw
+    config = {ws_id: {'name': name} for ws_id, name in DEFAULT_WORKSPACE_NAMES.items()}
+    if not raw:
+        return config
+    try:
+        parsed = json.loads(raw)
+        return {ws_id: dict(value) if isinstance(value, dict) else {'name': value}
+                for ws_id, value in parsed.items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Ignoring invalid CHILI_WORKSPACES: {str(e)}")
+        return config
+
+WORKSPACE_CONFIG = load_workspace_config()
+WORKSPACE_NAMES = {ws_id: cfg.get('name', ws_id) for ws_id, cfg in WORKSPACE_CONFIG.items()}
+
+# Admin center the queue links point to, for tenants that don't set their own
+DEFAULT_APP_URL = "https://connecteam.na.chilipiper.com"
+
+
+# 'sales' or 'cs' for workspaces named "Sales" / "CS" or ending in it ("EU Sales"), else None
+def workspace_role(name):
+    words = str(name).split()
+    role = words[-1].lower() if words else ""
+    return role if role in ('sales', 'cs') else None
+
+# Every value extract_size_range returns
+SIZE_RANGES = ("1-50", "51-100", "101 and above", "No Size")
+
+# Modify the extract_size_range function:
+def extract_size_range(queue):
+    for rule in queue.get('rules', []):
+        if (rule.get('entity') == 'Contact' and 
+            rule.get('field') == 'numofemployeesrange' and 
+            rule.get('operator') == '='):
+            value = rule.get('value')
+            # Group the ranges
+            if value:
+                try:
+                    # Extract first number from range (e.g., "11-30" -> 11)
+                    first_number = int(value.split('-')[0])
+                    if first_number <= 50:
+                        return "1-50"
+                    elif first_number <= 100:
+                        return "51-100"
+                    else:
+                        return "101 and above"
+                except:
+                    return "No Size"
+    return "No Size"  # Return "No Size" if no size rule is found
+
+# Statistics of very large payloads are built on a pool of forked processes, in
+# shards of the sorted active queues. Forked workers inherit the shards instead of
+# receiving them pickled, which would cost about as much as building them.
+# CHILI_STATS_WORKERS=1 keeps every build in the calling thread, as do payloads
+# with fewer memberships than PARALLEL_MIN_MEMBERSHIPS and platforms without fork.
+STATS_WORKERS = int(os.getenv("CHILI_STATS_WORKERS", str(min(os.cpu_count() or 1, 8))))
+PARALLEL_MIN_MEMBERSHIPS = int(os.getenv("CHILI_PARALLEL_STATS_MIN", "100000"))
+# Seconds to wait for the workers before building in process instead
+PARALLEL_TIMEOUT = float(os.getenv("CHILI_PARALLEL_STATS_TIMEOUT", "60"))
+# The dashboard process forks while other threads (HTTP servers, refresh and report
+# pools, the log listener) are running. A child only gets the forking thread, and a
+# lock another thread held at that moment stays locked in the child forever; the
+# workers only touch the inherited shards, but a child stuck on such a lock is
+# killed after PARALLEL_TIMEOUT and the build is redone in process.
+CAN_FORK = "fork" in multiprocessing.get_all_start_methods()
+
+# One parallel build at a time; _fork_shards holds its shards for the workers
+_fork_lock = threading.Lock()
+_fork_shards = None
+
+
+def _forked_shard(index, selected_rep, cs_workspaces):
+    return _shard_statistics(_fork_shards[index], selected_rep, cs_workspaces)
+
+
+# Member-level statistics of a slice of the sorted active queues; shards are merged in
+# order by _merge_shards, so the result matches a build over all queues at once
+def _shard_statistics(queues, selected_rep, cs_workspaces):
+    memberships = MembershipTable()
+    participation_reps, participation_queues, participation_weights = [], [], []
+    main_reps = mandatory_reps = 0
+    cs_users = set()
+    for queue in queues:
+        queue_name = queue['name']
+        is_cs = queue['workspaceId'] in cs_workspaces
+        for member in queue.get('members', []):
+            if selected_rep == "All" or member['name'] == selected_rep:
+                memberships.append(member['name'], queue_name, member['weight'], member['order'],
+                                   member['initialOrder'], member['id'], queue['id'])
+            participation_reps.append(member['name'])
+            participation_queues.append(queue_name)
+            participation_weights.append(member['weight'])
+            if member.get('main', False):
+                main_reps += 1
+            if member.get('mandatory', False):
+                mandatory_reps += 1
+            if is_cs:
+                cs_users.add(member['name'])
+    return {
+        'memberships': memberships.finish(),
+        # Users that only appear in "Existing Customer - Owner" never get a row, since
+        # that queue is excluded from the active queues
+        'participation': ParticipationMatrix.from_entries(
+            participation_reps, participation_queues, participation_weights
+        ),
+        'main_reps': main_reps,
+        'mandatory_reps': mandatory_reps,
+        'cs_users': cs_users,
+    }
+
+
+def _merge_shards(shards):
+    if len(shards) == 1:
+        return shards[0]
+    return {
+        'memberships': MembershipTable.concat([s['memberships'] for s in shards]),
+        'participation': ParticipationMatrix.concat([s['participation'] for s in shards]),
+        'main_reps': sum(s['main_reps'] for s in shards),
+        'mandatory_reps': sum(s['mandatory_reps'] for s in shards),
+        'cs_users': set().union(*(s['cs_users'] for s in shards)),
+    }
+
+
+# Split queues into about `count` contiguous shards of similar membership counts
+def _split_shards(queues, count):
+    sizes = [len(q.get('members', [])) for q in queues]
+    target = sum(sizes) / count
+    shards, start, filled = [], 0, 0
+    for i, size in enumerate(sizes):
+        filled += size
+        if filled >= target * (len(shards) + 1) and len(shards) < count - 1:
+            shards.append(queues[start:i + 1])
+            start = i + 1
+    shards.append(queues[start:])
+    return [shard for shard in shards if shard] or [queues]
+
+
+# _shard_statistics over all queues, on forked workers when there are enough memberships
+def _member_statistics(active_queues, selected_rep, cs_workspaces, workers, membership_count):
+    global _fork_shards
+    if workers <= 1 or membership_count < PARALLEL_MIN_MEMBERSHIPS or not CAN_FORK:
+        return _shard_statistics(active_queues, selected_rep, cs_workspaces)
+    shards = _split_shards(active_queues, workers)
+    with _fork_lock, metrics.span("stats.parallel"):
+        _fork_shards = shards
+        try:
+            # Workers are forked when the pool starts, after the shards are in place,
+            # and only send back the compact per-shard tables. Leaving the block
+            # terminates them, including any that hang or were killed.
+            with multiprocessing.get_context("fork").Pool(len(shards)) as pool:
+                results = pool.starmap_async(_forked_shard,
+                                             [(i, selected_rep, cs_workspaces) for i in range(len(shards))])
+                return _merge_shards(results.get(PARALLEL_TIMEOUT))
+        except multiprocessing.TimeoutError:
+            logger.warning(f"Statistics workers didn't finish in {PARALLEL_TIMEOUT:.0f}s, building in process")
+        finally:
+            _fork_shards = None
+    return _shard_statistics(active_queues, selected_rep, cs_workspaces)
+
+
+# Function to generate statistics. workspace_names (id -> name) and app_url are the
+# tenant's; they default to the CHILI_WORKSPACES names and the NA admin center.
+@metrics.timed()
+def generate_statistics(json_data, selected_workspace, selected_rep, selected_size, workers=None,
+                        workspace_names=None, app_url=DEFAULT_APP_URL):
+    workspace_names = WORKSPACE_NAMES if workspace_names is None else workspace_names
+    # Filter active queues with members and sort by name, excluding "Existing Customer - Owner"
+    active_queues = sorted(
+        [q for q in json_data['elements'] if q['active'] and q.get('members') and 
+         q['name'] != "Existing Customer - Owner" and
+         (selected_workspace == "All" or workspace_names.get(q['workspaceId'], q['workspaceId']) == selected_workspace) and
+         (selected_size == "All" or extract_size_range(q) == selected_size)],
+        key=lambda x: len(x.get('members', [])),
+        reverse=True
+    )
+    membership_count = sum(len(q.get('members', [])) for q in active_queues)
+    roles = {ws_id: workspace_role(workspace_names.get(ws_id, ws_id))
+             for ws_id in {q['workspaceId'] for q in active_queues}}
+    cs_workspaces = {ws_id for ws_id, role in roles.items() if role == 'cs'}
+    # Everything per member (pivots, participation, rep counts) is built per shard
+    members = _member_statistics(active_queues, selected_rep, cs_workspaces,
+                                 STATS_WORKERS if workers is None else workers, membership_count)
+
+    stats = {
+        'total_queues': len(active_queues),
+        'total_reps': membership_count,
+        'queues_by_size': Counter(len(q.get('members', [])) for q in active_queues),
+        'reps_by_queue': {q['name']: len(q.get('members', [])) for q in active_queues},
+        'main_reps': members['main_reps'],
+        'mandatory_reps': members['mandatory_reps'],
+        'queue_pivot': {},
+        'rep_pivot': {},
+        'workspaces': set(),
+        'queue_links': {}
+    }
+
+    for queue in active_queues:
+        queue_name = queue['name']
+        stats['workspaces'].add(workspace_names.get(queue['workspaceId'], queue['workspaceId']))
+        # Add queue link
+        stats['queue_links'][queue_name] = f"{app_url}/admin-center/meetings/{queue['workspaceId']}/queues/edit/{queue['id']}"
+
+    # Generate queue pivot and rep pivot. Both are views over one compact table:
+    # queue_pivot rows are (rep name, weight, order, initial order, user id, queue id)
+    # and rep_pivot rows (queue name, ...), each sorted by order.
+    stats['queue_pivot'] = members['memberships'].group_by('queue')
+    stats['rep_pivot'] = members['memberships'].group_by('rep')
+
+    # New: Generate AE participation data (sparse rep x queue weights)
+    stats['ae_participation'] = members['participation']
+
+    sales_queues = []
+    cs_queues = []
+    for queue in active_queues:
+        queue_name = queue['name']
+        role = roles[queue['workspaceId']]
+        if role == 'sales':
+            sales_queues.append(queue_name)
+        elif role == 'cs':
+            cs_queues.append(queue_name)
+    stats['sales_queues'] = sorted(sales_queues)
+    stats['cs_queues'] = sorted(cs_queues)
+    stats['cs_users'] = list(members['cs_users'])
+
+    return stats
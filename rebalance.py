@@ -0,0 +1,114 @@
+"""Weight rebalancing over the flattened queue membership table.
+
+Strategies compute the new weight column for every membership in one
+vectorized pass; plan_weight_updates() then groups the changed rows into the
+fewest /user/update/weighted calls (one per queue and target weight).
+"""
+import numpy as np
+import pandas as pd
+
+MIN_WEIGHT = 0
+MAX_WEIGHT = 100
+
+MEMBERSHIP_COLUMNS = ['queue_id', 'queue_name', 'workspace', 'user_id', 'rep_name', 'weight', 'order']
+
+
+# Flatten the /queue payload into one row per (queue, member), by default of active queues only
+def membership_frame(json_data, workspace_names, active_only=True):
+    columns = {name: [] for name in MEMBERSHIP_COLUMNS}
+    for queue in json_data['elements']:
+        if active_only and not queue['active']:
+            continue
+        workspace = workspace_names.get(queue['workspaceId'], queue['workspaceId'])
+        for member in queue.get('members', []):
+            columns['queue_id'].append(queue['id'])
+            columns['queue_name'].append(queue['name'])
+            columns['workspace'].append(workspace)
+            columns['user_id'].append(member['id'])
+            columns['rep_name'].append(member['name'])
+            columns['weight'].append(member['weight'])
+            columns['order'].append(member['order'])
+    df = pd.DataFrame(columns, columns=MEMBERSHIP_COLUMNS)
+    df['weight'] = df['weight'].astype('int64')
+    return df
+
+
+# Restrict the membership table to a workspace and/or a set of queues
+def filter_scope(df, workspace="All", queue_names=None):
+    mask = np.ones(len(df), dtype=bool)
+    if workspace != "All":
+        mask &= (df['workspace'] == workspace).to_numpy()
+    if queue_names:
+        mask &= df['queue_name'].isin(queue_names).to_numpy()
+    return df[mask]
+
+
+# Scale each queue's weights so they sum to `total`, using largest-remainder
+# rounding so the integer weights still add up exactly. Queues whose weights
+# sum to zero are left unchanged.
+def normalize_weights(df, total=100):
+    weights = df['weight'].to_numpy(dtype=float)
+    queue_sums = df.groupby('queue_id')['weight'].transform('sum').to_numpy(dtype=float)
+    has_total = queue_sums > 0
+    exact = np.divide(weights * total, queue_sums, out=weights.copy(), where=has_total)
+    floored = np.floor(exact)
+    remainder = exact - floored
+
+    # Hand the leftover units to the rows with the largest remainders in each queue
+    shortfall = total - pd.Series(floored).groupby(df['queue_id'].to_numpy()).transform('sum').to_numpy()
+    rank = (pd.DataFrame({'queue_id': df['queue_id'].to_numpy(), 'remainder': remainder})
+            .groupby('queue_id')['remainder'].rank(method='first', ascending=False).to_numpy())
+    new_weights = np.where(has_total, floored + (rank <= shortfall), weights)
+    return _with_new_weights(df, new_weights)
+
+
+# Set the given reps (by user id) to one weight in every queue they belong to
+def set_rep_weight(df, user_ids, weight):
+    new_weights = np.where(df['user_id'].isin(user_ids).to_numpy(), weight, df['weight'].to_numpy())
+    return _with_new_weights(df, new_weights)
+
+
+# Multiply weights by `factor`; non-zero weights stay at least 1 so nobody drops out of rotation
+def scale_weights(df, factor):
+    weights = df['weight'].to_numpy()
+    scaled = np.clip(np.rint(weights * factor), 1, MAX_WEIGHT)
+    return _with_new_weights(df, np.where(weights > 0, scaled, weights))
+
+
+def _with_new_weights(df, new_weights):
+    result = df.copy()
+    result['new_weight'] = np.clip(np.asarray(new_weights), MIN_WEIGHT, MAX_WEIGHT).astype('int64')
+    return result
+
+
+# Group changed rows into one update call per (queue, new weight). Calls are shaped
+# like reconcile plan ops, so reconcile.apply_plan can run them concurrently.
+def plan_weight_updates(df):
+    changed = df[df['new_weight'].to_numpy() != df['weight'].to_numpy()]
+    if changed.empty:
+        return []
+    grouped = changed.groupby(['queue_id', 'new_weight'], sort=False).agg(
+        queue_name=('queue_name', 'first'),
+        user_ids=('user_id', list),
+        rep_names=('rep_name', list),
+    ).reset_index()
+    return [
+        {
+            'key': f"update:{row.queue_id}:{int(row.new_weight)}",
+            'op': 'update',
+            'queue_id': row.queue_id,
+            'queue_name': row.queue_name,
+            'weight': int(row.new_weight),
+            'user_ids': row.user_ids,
+            'rep_names': row.rep_names,
+        }
+        for row in grouped.sort_values(['queue_name', 'new_weight']).itertuples(index=False)
+    ]
+
+
+# Old -> new weights of the rows a plan would change, for previewing
+def preview_changes(df):
+    changed = df[df['new_weight'] != df['weight']]
+    preview = changed[['workspace', 'queue_name', 'rep_name', 'weight', 'new_weight']]
+    preview.columns = ['Workspace', 'Queue', 'Rep', 'Current Weight', 'New Weight']
+    return preview.sort_values(['Queue', 'Rep']).reset_index(drop=True)
@@ -0,0 +1,290 @@
+"""Desired-state reconciliation of queue memberships.
+
+An uploaded table of (queue, rep, weight) rows is resolved to ids with hash
+joins against the current snapshot, diffed against the current memberships
+and turned into a plan of grouped assign / unassign / weight update calls.
+Plans are applied concurrently and checkpointed to a JSON file after every
+call, so an interrupted run can be resumed instead of restarted.
+"""
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import rebalance
+
+logger = logging.getLogger(__name__)
+
+COLUMN_ALIASES = {
+    'queue': 'queue', 'queue name': 'queue', 'queue_name': 'queue', 'queue id': 'queue', 'queue_id': 'queue',
+    'rep': 'rep', 'rep name': 'rep', 'rep_name': 'rep', 'name': 'rep',
+    'user': 'rep', 'user id': 'rep', 'user_id': 'rep',
+    'weight': 'weight',
+}
+
+# Upper bound on users sent in a single assign / unassign / update call
+MAX_USERS_PER_CALL = 100
+
+# Chili Piper ids are 24-character hex strings; unknown reps given by id are passed through
+OBJECT_ID = re.compile(r"^[0-9a-f]{24}$")
+
+OP_LABELS = {'add': "Add", 'remove': "Remove", 'update': "Update weight"}
+
+
+def file_digest(data, *options):
+    digest = hashlib.sha256(data)
+    for option in options:
+        digest.update(repr(option).encode())
+    return digest.hexdigest()[:16]
+
+
+# Read a CSV or XLSX upload into a (queue, rep, weight) frame
+def read_desired(file, filename):
+    if filename.lower().endswith((".xlsx", ".xls")):
+        try:
+            df = pd.read_excel(file, dtype=str)
+        except ImportError:
+            raise ValueError("Reading Excel files requires openpyxl; upload a CSV instead")
+    else:
+        df = pd.read_csv(file, dtype=str)
+
+    df.columns = [COLUMN_ALIASES.get(str(c).strip().lower(), str(c).strip().lower()) for c in df.columns]
+    missing = {'queue', 'rep'} - set(df.columns)
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(sorted(missing))}")
+    if 'weight' not in df.columns:
+        df['weight'] = None
+
+    df = df.loc[:, ~df.columns.duplicated()][['queue', 'rep', 'weight']].dropna(subset=['queue', 'rep'])
+    df['queue'] = df['queue'].str.strip()
+    df['rep'] = df['rep'].str.strip()
+    df['weight'] = pd.to_numeric(df['weight'], errors='coerce')
+    invalid = df['weight'].notna() & ~df['weight'].between(rebalance.MIN_WEIGHT, rebalance.MAX_WEIGHT)
+    if invalid.any():
+        raise ValueError(f"Weights must be between {rebalance.MIN_WEIGHT} and {rebalance.MAX_WEIGHT} "
+                         f"(rows {', '.join(str(i + 2) for i in df.index[invalid][:10])})")
+    return df.reset_index(drop=True)
+
+
+# Lookup table mapping both ids and case-folded names to (id, name). A key shared by
+# several ids (e.g. two reps with the same name) keeps no id and is flagged in
+# `ambiguous_column` instead, so it is never silently resolved to one of them.
+def _key_table(ids, names, id_column, name_column, ambiguous_column):
+    table = pd.DataFrame({id_column: ids, name_column: names}).drop_duplicates(id_column)
+    by_id = table.assign(key=table[id_column].str.casefold())
+    by_name = table.assign(key=table[name_column].str.casefold())
+    keys = pd.concat([by_id, by_name], ignore_index=True).drop_duplicates(['key', id_column])
+    ambiguous = keys.groupby('key')[id_column].transform('size') > 1
+    keys = keys.assign(**{ambiguous_column: ambiguous})
+    keys.loc[ambiguous, [id_column, name_column]] = None
+    return keys.drop_duplicates('key')
+
+
+# Resolve queue and rep names/ids with hash joins; returns (resolved, unresolved) frames
+def resolve_desired(desired, json_data):
+    queues = json_data['elements']
+    queue_keys = _key_table([q['id'] for q in queues], [q['name'] for q in queues],
+                            'queue_id', 'queue_name', 'queue_ambiguous')
+    members = [m for q in queues for m in q.get('members', [])]
+    user_keys = _key_table([m['id'] for m in members], [m['name'] for m in members],
+                           'user_id', 'rep_name', 'rep_ambiguous')
+
+    resolved = (desired.assign(queue_key=desired['queue'].str.casefold(), rep_key=desired['rep'].str.casefold())
+                .merge(queue_keys.rename(columns={'key': 'queue_key'}), on='queue_key', how='left')
+                .merge(user_keys.rename(columns={'key': 'rep_key'}), on='rep_key', how='left'))
+    # Keys with no match come back as NaN
+    resolved[['queue_ambiguous', 'rep_ambiguous']] = resolved[['queue_ambiguous', 'rep_ambiguous']].eq(True)
+
+    # Reps who are not in any queue yet can still be added by user id
+    passthrough = (resolved['user_id'].isna() & ~resolved['rep_ambiguous']
+                   & resolved['rep_key'].str.match(OBJECT_ID))
+    resolved.loc[passthrough, 'user_id'] = resolved.loc[passthrough, 'rep_key']
+    resolved.loc[passthrough, 'rep_name'] = resolved.loc[passthrough, 'rep']
+
+    ok = resolved['queue_id'].notna() & resolved['user_id'].notna()
+    unresolved = resolved.loc[~ok, ['queue', 'rep', 'weight']].assign(
+        problem=[("ambiguous queue" if queue_ambiguous else "unknown queue") if pd.isna(queue_id)
+                 else ("ambiguous rep" if rep_ambiguous else "unknown rep")
+                 for queue_id, queue_ambiguous, rep_ambiguous
+                 in resolved.loc[~ok, ['queue_id', 'queue_ambiguous', 'rep_ambiguous']].itertuples(index=False)]
+    )
+    resolved = (resolved.loc[ok, ['queue_id', 'queue_name', 'user_id', 'rep_name', 'weight']]
+                .drop_duplicates(['queue_id', 'user_id'], keep='last'))
+    return resolved.reset_index(drop=True), unresolved.reset_index(drop=True)
+
+
+# Outer-join desired against current memberships of the queues named in the upload.
+# Each row gets an 'action' of add / remove / update / keep; members missing from
+# the upload are only removed when `prune` is set.
+def diff_memberships(resolved, json_data, prune=False):
+    current = rebalance.membership_frame(json_data, {}, active_only=False)
+    current = current[current['queue_id'].isin(resolved['queue_id'].unique())]
+    merged = resolved.merge(
+        current[['queue_id', 'queue_name', 'user_id', 'rep_name', 'weight']],
+        on=['queue_id', 'user_id'], how='outer', suffixes=('', '_current'), indicator=True
+    )
+    merged['queue_name'] = merged['queue_name'].fillna(merged['queue_name_current'])
+    merged['rep_name'] = merged['rep_name'].fillna(merged['rep_name_current'])
+    merged = merged.rename(columns={'weight': 'new_weight', 'weight_current': 'current_weight'})
+
+    both = merged['_merge'] == 'both'
+    changed_weight = both & merged['new_weight'].notna() & (merged['new_weight'] != merged['current_weight'])
+    merged['action'] = 'keep'
+    merged.loc[merged['_merge'] == 'left_only', 'action'] = 'add'
+    merged.loc[changed_weight, 'action'] = 'update'
+    if prune:
+        merged.loc[merged['_merge'] == 'right_only', 'action'] = 'remove'
+    return merged[['action', 'queue_id', 'queue_name', 'user_id', 'rep_name', 'current_weight', 'new_weight']]
+
+
+# Row-level dry run of a diff, for display
+def preview_diff(diff):
+    changes = diff[diff['action'] != 'keep']
+    preview = pd.DataFrame({
+        'Action': changes['action'].map(OP_LABELS),
+        'Queue': changes['queue_name'],
+        'Rep': changes['rep_name'],
+        'Current Weight': changes['current_weight'],
+        'New Weight': changes['new_weight'],
+    })
+    return preview.sort_values(['Queue', 'Action', 'Rep']).reset_index(drop=True)
+
+
+# Group diff rows into the fewest API calls: one per (action, queue, weight),
+# split into chunks of MAX_USERS_PER_CALL users
+def build_plan(diff):
+    plan = []
+    changes = diff[diff['action'] != 'keep'].assign(
+        group_weight=lambda df: df['new_weight'].where(df['action'] != 'remove')
+    )
+    grouped = changes.groupby(['action', 'queue_id', 'group_weight'], sort=True, dropna=False)
+    for (action, queue_id, weight), rows in grouped:
+        weight = None if pd.isna(weight) else int(weight)
+        user_ids = rows['user_id'].tolist()
+        rep_names = rows['rep_name'].tolist()
+        for chunk, start in enumerate(range(0, len(user_ids), MAX_USERS_PER_CALL)):
+            plan.append({
+                'key': f"{action}:{queue_id}:{weight}:{chunk}",
+                'op': action,
+                'queue_id': queue_id,
+                'queue_name': rows['queue_name'].iloc[0],
+                'weight': weight,
+                'user_ids': user_ids[start:start + MAX_USERS_PER_CALL],
+                'rep_names': rep_names[start:start + MAX_USERS_PER_CALL],
+            })
+    return plan
+
+
+def _execute(client, op):
+    logger.debug("Reconcile %s: %d users in queue_id=%s", op['op'], len(op['user_ids']), op['queue_id'])
+    if op['op'] == 'add':
+        client.assign(op['queue_id'], op['user_ids'], op['weight'])
+    elif op['op'] == 'remove':
+        client.unassign(op['queue_id'], op['user_ids'])
+    else:
+        client.update_weight(op['queue_id'], op['user_ids'], op['weight'])
+
+
+# _execute, recording the outcome in the checkpoint as soon as the call returns
+def _execute_recorded(client, op, checkpoint):
+    try:
+        _execute(client, op)
+    except Exception as e:
+        logger.warning("Reconcile %s failed: queue_id=%s, error=%s", op['op'], op['queue_id'], e,
+                       extra={'queue_id': op['queue_id'], 'user_count': len(op['user_ids'])})
+        if checkpoint is not None:
+            checkpoint.record(op, e)
+        raise
+    if checkpoint is not None:
+        checkpoint.record(op, None)
+
+
+# Run plan items on a thread pool; yields (op, error or None) as each call finishes.
+# Only max_workers calls are in flight at a time, and each is recorded in the
+# checkpoint by its worker, so when the caller stops iterating (e.g. the rerun is
+# interrupted) the calls not started yet are dropped and the checkpoint matches what
+# ran. Each call runs in a copy of the caller's context, so its logs carry the
+# caller's correlation ids.
+def apply_plan(client, plan, checkpoint=None, max_workers=8):
+    ops = iter(plan)
+    futures = {}
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reconcile")
+
+    def submit_next():
+        op = next(ops, None)
+        if op is not None:
+            futures[pool.submit(contextvars.copy_context().run, _execute_recorded, client, op, checkpoint)] = op
+
+    try:
+        for _ in range(max_workers):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                op = futures.pop(future)
+                submit_next()
+                yield op, future.exception()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class Checkpoint:
+    """JSON record of a plan and which of its calls already succeeded."""
+
+    def __init__(self, directory, digest):
+        self.path = os.path.join(directory, f"reconcile_{digest}.json")
+        self.state = None
+        # apply_plan's workers record their calls concurrently
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state = json.load(f)
+
+    def start(self, plan):
+        if self.state is None:
+            self.state = {'created': time.time(), 'plan': plan, 'done': [], 'failed': {}}
+            self.save()
+        return self.pending()
+
+    def pending(self):
+        if self.state is None:
+            return []
+        done = set(self.state['done'])
+        return [op for op in self.state['plan'] if op['key'] not in done]
+
+    def progress(self):
+        if self.state is None:
+            return 0, 0
+        return len(self.state['done']), len(self.state['plan'])
+
+    def record(self, op, error):
+        with self.lock:
+            if error is None:
+                self.state['done'].append(op['key'])
+                self.state['failed'].pop(op['key'], None)
+            else:
+                self.state['failed'][op['key']] = str(error)
+            self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.state = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
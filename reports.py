@@ -0,0 +1,107 @@
+"""Materialized dashboard views, precomputed after every snapshot refresh.
+
+The heavy views (statistics, per-rep queue lists and the AE participation
+tables) are cached on the snapshot they come from. ReportScheduler builds
+them for the workspaces a store publishes new versions of (and "All") x
+size range, on a background thread, so the first visit after a refresh finds
+them ready; other filter combinations are still computed live on first use.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from queue_data import extract_size_range
+from snapshots import Debounced
+
+logger = logging.getLogger(__name__)
+
+
+# Slice the sparse rep x queue participation matrix down to the given queues.
+# Without `reps`, reps that don't appear in any of the queues are dropped.
+@metrics.timed()
+def build_participation_matrix(stats, queue_names, reps=None):
+    matrix = stats['ae_participation'].select(queues=queue_names)
+    if reps is None:
+        rows = np.flatnonzero(matrix.row_sums() > 0)
+    else:
+        rows = np.flatnonzero(pd.Index(matrix.rep_names).isin(list(reps)))
+    # Sort columns based on the total weight in each queue
+    matrix = matrix.take(rows, np.arange(matrix.shape[1]))
+    return matrix.take(np.arange(matrix.shape[0]), np.argsort(-matrix.col_sums(), kind='stable'))
+
+
+# Dense table of the participation slice, only for the rows and columns being shown
+def build_participation_df(stats, queue_names, reps=None):
+    return build_participation_matrix(stats, queue_names, reps=reps).to_frame()
+
+
+# Render the participation table as HTML with a sticky header and first column
+@metrics.timed()
+def create_scrollable_table(df, queue_links):
+    df = df.applymap(lambda x: f"{x:.0f}")  # Remove decimal places
+    table_html = f"""
+    <div class="scrollable-table-container">
+        <table class="scrollable-table">
+            <thead>
+                <tr>
+                    <th>Rep Name</th>
+                    {''.join(f'<th><a href="{queue_links.get(col, "#")}" class="queue-link" target="_blank">{col}</a></th>' for col in df.columns)}
+                </tr>
+            </thead>
+            <tbody>
+                {''.join(f'<tr><td>{index}</td>' + ''.join(f'<td class="{"zero-value" if cell == "0" else ""}">{cell}</td>' for cell in row) + '</tr>' for index, row in df.iterrows())}
+            </tbody>
+        </table>
+    </div>
+    """
+    return table_html
+
+
+# (Sales HTML, CS HTML) of the AE Participation section; None when there are no
+# queues of that kind. Cached on the snapshot the statistics were built from; the
+# tables of all reps are materialized, so they are kept for the whole version.
+def participation_tables(snapshot, stats, selected_rep="All", selected_size="All"):
+    def build():
+        sales = cs = None
+        if stats['sales_queues']:
+            sales = create_scrollable_table(build_participation_df(stats, stats['sales_queues']), stats['queue_links'])
+        if stats['cs_queues']:
+            # Only reps that are in the CS workspace
+            cs = create_scrollable_table(build_participation_df(stats, stats['cs_queues'], reps=stats['cs_users']),
+                                         stats['queue_links'])
+        return sales, cs
+    derive = snapshot.derive_index if selected_rep == "All" else snapshot.derive
+    return derive(('participation_tables', selected_rep, selected_size), build)
+
+
+# Size ranges of the queues the size filter offers (active queues with members)
+def size_ranges(snapshot):
+    return sorted({extract_size_range(q) for q in snapshot.elements if q['active'] and q.get('members')})
+
+
+class ReportScheduler:
+    """Materializes a WorkspaceStore's common views whenever it publishes a new version."""
+
+    def __init__(self, store):
+        self.store = store
+        store.listeners.append(Debounced(self.materialize, "reports"))
+
+    # Statistics and participation tables x size range for "All" and the workspaces of
+    # `workspace_ids` (every workspace when None); views of the others are unchanged
+    def materialize(self, workspace_ids=None):
+        with metrics.span("reports.materialize"):
+            workspace_names = self.store.workspace_names()
+            if workspace_ids is None:
+                workspace_ids = workspace_names
+            names = ["All"] + sorted({workspace_names[ws_id] for ws_id in workspace_ids if ws_id in workspace_names})
+            built = 0
+            for name in names:
+                snapshot = self.store.payload(name)
+                for size in ["All"] + size_ranges(snapshot):
+                    stats = self.store.statistics(name, "All", size)
+                    participation_tables(snapshot, stats, "All", size)
+                    built += 1
+        logger.info(f"Materialized {built} report views")
+        return built
@@ -0,0 +1,137 @@
+"""Typeahead search over the reps and queues of one snapshot.
+
+The index keeps a sorted list of search terms (full names, name words,
+emails and ids), so prefix matches are a binary search instead of a scan.
+Substring and typo-tolerant matches are only looked for when there aren't
+enough prefix matches to fill the result list, and typos are only corrected in
+alphabetic name words, never in ids or emails.
+"""
+import bisect
+import difflib
+import re
+
+MAX_RESULTS = 20
+
+# Prefix lookups stop after this many terms, e.g. for a one-letter query
+MAX_PREFIX_TERMS = 2000
+
+# Longer query words are ids or pasted text, not names worth correcting
+FUZZY_MAX_LENGTH = 20
+
+# difflib's ratio is at most 2 * shorter / (len(a) + len(b)), so words whose
+# length differs by more than this factor can never reach FUZZY_CUTOFF
+FUZZY_CUTOFF = 0.75
+FUZZY_LENGTH_RATIO = FUZZY_CUTOFF / (2 - FUZZY_CUTOFF)
+
+# Match quality, best first
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+
+WORD_SPLIT = re.compile(r"[\s\-_/|,.()@]+")
+
+
+class SearchIndex:
+    """Reps and queues of a queue payload, searchable by name, email or id."""
+
+    def __init__(self, json_data, workspace_names):
+        self.entries = []  # {'kind', 'label', 'id', 'workspace', 'detail', 'size'}
+        rep_entries = {}  # user id -> entry position
+        for queue in json_data['elements']:
+            workspace = workspace_names.get(queue['workspaceId'], queue['workspaceId'])
+            members = queue.get('members', [])
+            self.entries.append({
+                'kind': 'queue', 'label': queue['name'], 'id': queue['id'], 'workspace': workspace,
+                'detail': f"{len(members)} reps" + ("" if queue['active'] else ", inactive"),
+                'size': len(members),
+            })
+            for member in members:
+                position = rep_entries.get(member['id'])
+                if position is None:
+                    rep_entries[member['id']] = len(self.entries)
+                    self.entries.append({
+                        'kind': 'rep', 'label': member['name'], 'id': member['id'], 'workspace': workspace,
+                        'detail': member.get('email', ""), 'size': 1,
+                    })
+                else:
+                    self.entries[position]['size'] += 1
+
+        terms = []
+        for position, entry in enumerate(self.entries):
+            for term in self._terms(entry):
+                terms.append((term, position))
+        terms.sort()
+        self.terms = [term for term, _ in terms]
+        self.term_entries = [position for _, position in terms]
+        self.labels = [entry['label'].lower() for entry in self.entries]
+        # Fuzzy candidates: alphabetic words of names, by first letter
+        self.words = {}
+        for word in sorted({word for label in self.labels for word in WORD_SPLIT.split(label) if word.isalpha()}):
+            self.words.setdefault(word[0], []).append(word)
+
+    @staticmethod
+    def _terms(entry):
+        label = entry['label'].lower()
+        terms = {label, entry['id'].lower()}
+        terms.update(word for word in WORD_SPLIT.split(label) if word)
+        if entry['detail'] and "@" in entry['detail']:
+            email = entry['detail'].lower()
+            terms.add(email)
+            terms.add(email.split("@")[0])
+        return terms
+
+    def _prefix_hits(self, prefix):
+        start = bisect.bisect_left(self.terms, prefix)
+        for i in range(start, min(start + MAX_PREFIX_TERMS, len(self.terms))):
+            if not self.terms[i].startswith(prefix):
+                break
+            yield self.term_entries[i]
+
+    # Name words sharing the token's first letter, with a length that can still be a close match
+    def _fuzzy_candidates(self, token):
+        shortest, longest = len(token) * FUZZY_LENGTH_RATIO, len(token) / FUZZY_LENGTH_RATIO
+        return [word for word in self.words.get(token[0], ()) if shortest <= len(word) <= longest]
+
+    # Ranked matches for the query: exact name, name prefix, prefix of a word /
+    # email / id, substring, then close spellings. kind limits to 'rep' or 'queue'.
+    def search(self, query, limit=MAX_RESULTS, kind=None):
+        query = query.strip().lower()
+        if not query:
+            return []
+        ranks = {}
+
+        def consider(position, rank):
+            if kind is not None and self.entries[position]['kind'] != kind:
+                return
+            if rank < ranks.get(position, FUZZY + 1):
+                ranks[position] = rank
+
+        for position in self._prefix_hits(query):
+            label = self.labels[position]
+            consider(position, EXACT if label == query else PREFIX if label.startswith(query) else WORD_PREFIX)
+
+        # Every word of a multi-word query must prefix some word of the name
+        tokens = [token for token in WORD_SPLIT.split(query) if token]
+        if len(tokens) > 1:
+            candidates = None
+            for token in tokens:
+                hits = set(self._prefix_hits(token))
+                candidates = hits if candidates is None else candidates & hits
+            for position in candidates:
+                consider(position, WORD_PREFIX)
+
+        if len(ranks) < limit:
+            for position, label in enumerate(self.labels):
+                if query in label:
+                    consider(position, SUBSTRING)
+
+        # Only name-like words are corrected: not punctuation-only queries ("---"),
+        # ids, emails or long pasted text
+        if (tokens and len(ranks) < limit and len(query) >= 3 and "@" not in query
+                and tokens[-1].isalpha() and len(tokens[-1]) <= FUZZY_MAX_LENGTH):
+            for word in difflib.get_close_matches(tokens[-1], self._fuzzy_candidates(tokens[-1]),
+                                                  n=limit, cutoff=FUZZY_CUTOFF):
+                for position in self._prefix_hits(word):
+                    if word in WORD_SPLIT.split(self.labels[position]):
+                        consider(position, FUZZY)
+
+        best = sorted(ranks, key=lambda p: (ranks[p], -self.entries[p]['size'], self.labels[p]))[:limit]
+        return [dict(self.entries[p], rank=ranks[p]) for p in best]
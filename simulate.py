@@ -0,0 +1,91 @@
+"""What-if simulation of weighted round-robin meeting distribution.
+
+Within a queue, weighted round robin hands each member a share of the
+inbound meetings proportional to their weight (`order` only decides who goes
+first, which evens out over any real volume). RoutingModel compiles the
+membership table into integer index arrays once, after which every what-if
+run over the whole account is a handful of NumPy bincounts over those
+arrays.
+"""
+import numpy as np
+import pandas as pd
+
+# Percentiles reported by the Monte Carlo run
+LOW_PERCENTILE = 10
+HIGH_PERCENTILE = 90
+
+# Monte Carlo runs; 200 keeps a 1000-queue account well under 100 ms
+SIMULATION_RUNS = 200
+
+# Default inbound meetings per queue
+DEFAULT_QUEUE_VOLUME = 20
+
+
+class RoutingModel:
+    """Membership table (see rebalance.membership_frame) compiled for fast reruns."""
+
+    def __init__(self, memberships):
+        self.memberships = memberships.reset_index(drop=True)
+        self.queue_codes, self.queue_ids = pd.factorize(self.memberships['queue_id'])
+        self.rep_codes, self.user_ids = pd.factorize(self.memberships['user_id'])
+        self.n_queues = len(self.queue_ids)
+        self.n_reps = len(self.user_ids)
+        self.weights = self.memberships['weight'].to_numpy(dtype=float)
+
+        first = ~pd.Series(self.queue_codes).duplicated().to_numpy()
+        self.queue_names = self.memberships['queue_name'].to_numpy()[first][np.argsort(self.queue_codes[first])]
+        first = ~pd.Series(self.rep_codes).duplicated().to_numpy()
+        self.rep_names = self.memberships['rep_name'].to_numpy()[first][np.argsort(self.rep_codes[first])]
+        self.queue_counts = np.bincount(self.rep_codes, minlength=self.n_reps)
+
+    # Queue volumes as an array aligned with queue_ids, from a {queue_id: volume} mapping
+    def volume_vector(self, volumes=None, default=0.0):
+        vector = np.full(self.n_queues, float(default))
+        if volumes:
+            for code, queue_id in enumerate(self.queue_ids):
+                if queue_id in volumes:
+                    vector[code] = volumes[queue_id]
+        return vector
+
+    # Each membership's share of its queue. Queues whose weights sum to zero route nothing.
+    def shares(self, weights=None):
+        weights = self.weights if weights is None else np.asarray(weights, dtype=float)
+        totals = np.bincount(self.queue_codes, weights=weights, minlength=self.n_queues)
+        member_totals = totals[self.queue_codes]
+        return np.divide(weights, member_totals, out=np.zeros_like(weights), where=member_totals > 0)
+
+    # Expected meetings per rep (aligned with user_ids) for the given queue volumes
+    def expected(self, volumes, weights=None):
+        per_member = self.shares(weights) * np.asarray(volumes, dtype=float)[self.queue_codes]
+        return np.bincount(self.rep_codes, weights=per_member, minlength=self.n_reps)
+
+    # Monte Carlo over Poisson-distributed queue volumes. Returns (mean, low, high)
+    # meetings per rep, the bounds being the LOW/HIGH_PERCENTILE of the runs.
+    def simulate(self, volumes, weights=None, runs=SIMULATION_RUNS, seed=0):
+        rng = np.random.default_rng(seed)
+        draws = rng.poisson(np.asarray(volumes, dtype=float), size=(runs, self.n_queues))
+        # Each membership's meetings in every run, summed per (run, rep) by one bincount
+        per_member = draws[:, self.queue_codes] * self.shares(weights)
+        bins = (np.arange(runs)[:, None] * self.n_reps + self.rep_codes).ravel()
+        per_run = np.bincount(bins, weights=per_member.ravel(), minlength=runs * self.n_reps)
+        per_run = per_run.reshape(runs, self.n_reps)
+        low, high = np.percentile(per_run, [LOW_PERCENTILE, HIGH_PERCENTILE], axis=0)
+        return per_run.mean(axis=0), low, high
+
+    # Per-rep comparison of the current weights against `weights`
+    def compare(self, volumes, weights, simulation=None):
+        baseline = self.expected(volumes)
+        what_if = self.expected(volumes, weights)
+        result = pd.DataFrame({
+            'Rep': self.rep_names,
+            'Queues': self.queue_counts,
+            'Current': baseline.round(1),
+            'What-if': what_if.round(1),
+            'Change': (what_if - baseline).round(1),
+        })
+        if simulation is not None:
+            _, low, high = simulation
+            result[f'P{LOW_PERCENTILE}'] = low.round(1)
+            result[f'P{HIGH_PERCENTILE}'] = high.round(1)
+        order = np.lexsort((-what_if, -np.abs(what_if - baseline)))
+        return result.iloc[order].reset_index(drop=True)
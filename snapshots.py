@@ -0,0 +1,554 @@
+"""Workspace-sharded, immutable queue snapshots shared by every session.
+
+Each workspace's queues are fetched, versioned and refreshed on their own
+cadence. A fetch produces one read-only Snapshot per version that all
+sessions get by reference; filters are index views over it, and anything
+derived from it (statistics, search index, routing model...) is cached on
+the snapshot itself, so it is computed once per version and released
+together with the version once no session holds it any more.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from queue_data import DEFAULT_APP_URL, extract_size_range, generate_statistics
+
+logger = logging.getLogger(__name__)
+
+# Default refresh interval per workspace, in seconds
+DEFAULT_TTL = float(os.getenv("CHILI_CACHE_TTL", "60"))
+
+# How often a full fetch looks for workspaces that aren't known yet
+DISCOVERY_TTL = 900
+
+# Publishes arriving within this many seconds reach a Debounced listener together,
+# e.g. every workspace of a discovery fetch
+SETTLE_SECONDS = 0.5
+
+# Per-filter derived values (per-rep statistics, charts per top_n...) kept per snapshot.
+# Values derived once per version (indexes, size views, the materialized reports) are
+# kept separately and not counted against it.
+DERIVED_CACHE_SIZE = 64
+
+
+def combine_versions(versions):
+    return hashlib.blake2b("|".join(versions).encode(), digest_size=8).hexdigest()
+
+
+class _Selection(Sequence):
+    """Read-only elements of a parent tuple picked by an index array."""
+
+    __slots__ = ('base', 'indices')
+
+    def __init__(self, base, indices):
+        self.base = base
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.base[i] for i in self.indices[item].tolist()]
+        return self.base[int(self.indices[item])]
+
+    def __iter__(self):
+        base = self.base
+        return (base[i] for i in self.indices.tolist())
+
+
+class Snapshot(Mapping):
+    """Immutable queue payload at one version, shaped like the /queue response.
+
+    Reads like the `json_data` dict ('elements', 'snapshotVersion'); the
+    elements are a tuple (or an index view of one) and must be treated as
+    read-only, since every session shares them.
+    """
+
+    def __init__(self, elements, version, workspace_ids):
+        self._data = {'elements': elements, 'snapshotVersion': version}
+        self.version = version
+        self.workspace_ids = tuple(workspace_ids)
+        self._derived = OrderedDict()
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def elements(self):
+        return self._data['elements']
+
+    # fn() computed at most once per snapshot and key; concurrent callers wait for the
+    # first one. Least recently used values beyond DERIVED_CACHE_SIZE are dropped.
+    def derive(self, key, fn):
+        return self._derive(key, fn, self._derived)
+
+    # Like derive(), for values built once per version rather than per filter (search
+    # index, routing model, size views...). They are kept as long as the snapshot, so
+    # browsing filters can't evict them.
+    def derive_index(self, key, fn):
+        return self._derive(key, fn, self._indexes)
+
+    def _derive(self, key, fn, cache):
+        with self._lock:
+            if key in cache:
+                if cache is self._derived:
+                    cache.move_to_end(key)
+                metrics.inc("cache_hits", cache="snapshot")
+                return cache[key]
+            building = self._building.get(key)
+            if building is None:
+                building = self._building[key] = threading.Lock()
+            else:
+                metrics.inc("coalesced", what="derive")
+        with building:
+            with self._lock:
+                if key in cache:
+                    metrics.inc("cache_hits", cache="snapshot")
+                    return cache[key]
+            metrics.inc("cache_misses", cache="snapshot")
+            value = fn()
+            with self._lock:
+                cache[key] = value
+                self._building.pop(key, None)
+                while len(self._derived) > DERIVED_CACHE_SIZE:
+                    self._derived.popitem(last=False)
+            return value
+
+    # View of the elements at `indices`, sharing the queue dicts with this snapshot
+    def select(self, indices, tag):
+        indices = np.asarray(indices, dtype=np.int32)
+        return Snapshot(_Selection(self.elements, indices), combine_versions([self.version, tag]),
+                        self.workspace_ids)
+
+    # View of the queues in one size range (see extract_size_range)
+    def with_size(self, size):
+        if size == "All":
+            return self
+        sizes = self.derive_index('size_ranges', lambda: np.array([extract_size_range(q) for q in self.elements],
+                                                             dtype=object))
+        return self.derive_index(('size', size), lambda: self.select(np.flatnonzero(sizes == size), f"size={size}"))
+
+
+class WorkspaceEntry:
+    """Cache slot of one workspace. `current` is replaced as a whole on refresh."""
+
+    def __init__(self, workspace_id, name, ttl):
+        self.workspace_id = workspace_id
+        self.name = name
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.current = None  # (Snapshot, fetched_at)
+        # Bumped by invalidate(); a refresh that started before the bump stays stale
+        self.generation = 0
+        self.fresh_generation = -1
+        # Finished refresh attempts, and the error of the last one if it failed
+        self.attempts = 0
+        self.last_error = None
+        self.revalidating = False
+
+    def is_fresh(self, now):
+        return (self.current is not None and self.fresh_generation == self.generation
+                and now - self.current[1] < self.ttl)
+
+    # Past its TTL but neither empty nor invalidated: fine to serve while refetching
+    def is_servable(self):
+        return self.current is not None and self.fresh_generation == self.generation
+
+
+class Debounced:
+    """Store listener running fn(workspace ids) on its own background thread.
+
+    A publish queues one run SETTLE_SECONDS later; publishes arriving while it
+    is queued join it, and it gets the ids of every workspace published in the
+    meantime. Listeners are called with the store's entry lock held, so this
+    only takes its own lock for a moment and never waits for fn.
+    """
+
+    def __init__(self, fn, thread_name, settle=SETTLE_SECONDS):
+        self.fn = fn
+        self.name = thread_name
+        self.settle = settle
+        self.lock = threading.Lock()
+        self.workspace_ids = None  # ids queued for the next run; None when none is queued
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name)
+
+    def __call__(self, workspace_id=None):
+        with self.lock:
+            queued = self.workspace_ids is not None
+            if not queued:
+                self.workspace_ids = set()
+            if workspace_id is not None:
+                self.workspace_ids.add(workspace_id)
+        if not queued:
+            self.pool.submit(self._run)
+
+    def _run(self):
+        time.sleep(self.settle)
+        with self.lock:
+            workspace_ids, self.workspace_ids = self.workspace_ids, None
+        try:
+            self.fn(workspace_ids)
+        except Exception as e:
+            logger.warning(f"Snapshot listener {self.name} failed: {str(e)}")
+
+
+class WorkspaceStore:
+    """Per-workspace snapshots for one API client.
+
+    Workspaces come from `workspace_config` (id -> {'name', 'ttl'}) and, when
+    `discover` is set, from a periodic full fetch of the account.
+    """
+
+    def __init__(self, client, workspace_config, discover=True, default_ttl=DEFAULT_TTL, max_workers=4,
+                 app_url=DEFAULT_APP_URL):
+        self.client = client
+        self.config = workspace_config
+        self.app_url = app_url
+        self.discover_enabled = discover
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # workspace id -> WorkspaceEntry
+        self.queue_workspaces = {}  # queue id -> workspace id
+        self.discovered_at = None
+        self.discover_lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="workspace-fetch")
+        # Latest multi-workspace snapshot per workspace name ("All", or names shared by several ids)
+        self._combined = {}
+        # Callables run with the workspace id after it gets a new snapshot version
+        # (see Debounced)
+        self.listeners = []
+
+    def _entry(self, workspace_id):
+        with self.lock:
+            entry = self.entries.get(workspace_id)
+            if entry is None:
+                config = self.config.get(workspace_id, {})
+                entry = WorkspaceEntry(
+                    workspace_id,
+                    config.get('name', workspace_id),
+                    float(config.get('ttl', self.default_ttl))
+                )
+                self.entries[workspace_id] = entry
+            return entry
+
+    # Full fetch of the account, split by workspace to seed every entry at once
+    def discover(self):
+        with metrics.span("store.discover"):
+            with self.lock:
+                generations = {workspace_id: e.generation for workspace_id, e in self.entries.items()}
+            data = self.client.list_queues()
+            by_workspace = defaultdict(list)
+            for queue in data['elements']:
+                by_workspace[queue['workspaceId']].append(queue)
+            for workspace_id in set(self.config) | set(by_workspace):
+                entry = self._entry(workspace_id)
+                with entry.lock:
+                    version = combine_versions([data['snapshotVersion'], workspace_id])
+                    self._store(entry, by_workspace.get(workspace_id, []), version,
+                                generations.get(workspace_id, 0))
+            self.discovered_at = time.time()
+
+    def _discovery_due(self):
+        return self.discovered_at is None or time.time() - self.discovered_at > DISCOVERY_TTL
+
+    # Only one discovery runs at a time; callers that arrive meanwhile wait for it
+    # instead of fetching the account again. Once the workspaces are known,
+    # rediscovery runs in the background.
+    def _ensure_discovered(self):
+        if not self.discover_enabled:
+            for workspace_id in self.config:
+                self._entry(workspace_id)
+            return
+        if not self._discovery_due():
+            return
+        if self.discovered_at is not None:
+            if self.discover_lock.acquire(blocking=False):
+                self.pool.submit(self._rediscover)
+            return
+        if not self.discover_lock.acquire(blocking=False):
+            metrics.inc("coalesced", what="discovery")
+            self.discover_lock.acquire()
+        try:
+            if self._discovery_due():
+                self.discover()
+        finally:
+            self.discover_lock.release()
+
+    # Background discovery; the caller acquired discover_lock
+    def _rediscover(self):
+        try:
+            self.discover()
+        except Exception as e:
+            logger.warning(f"Workspace discovery failed, keeping the known workspaces: {str(e)}")
+        finally:
+            self.discover_lock.release()
+
+    # Workspace id -> display name for every known workspace
+    def workspace_names(self):
+        self._ensure_discovered()
+        return self._names()
+
+    def _names(self):
+        with self.lock:
+            return {workspace_id: entry.name for workspace_id, entry in self.entries.items()}
+
+    def ids_for(self, workspace_name="All"):
+        names = self.workspace_names()
+        return sorted(workspace_id for workspace_id, name in names.items()
+                      if workspace_name == "All" or name == workspace_name)
+
+    def _store(self, entry, elements, version, generation):
+        previous = entry.current
+        if previous is not None and previous[0].version == version:
+            # Unchanged data keeps the old snapshot, and with it everything derived from it
+            entry.current = (previous[0], time.time())
+            entry.fresh_generation = generation
+            return
+        self._publish(entry, elements, version, time.time())
+        entry.fresh_generation = generation
+        with self.lock:
+            for queue in elements:
+                self.queue_workspaces[queue['id']] = entry.workspace_id
+        self._notify(entry.workspace_id)
+
+    # Install a new snapshot version for the entry; the caller holds entry.lock. A
+    # refresh precomputes the workspace's unfiltered statistics; patches leave them to
+    # the first read, so a burst of webhook events doesn't rebuild them per event.
+    def _publish(self, entry, elements, version, fetched_at, precompute=True):
+        snapshot = Snapshot(tuple(elements), version, (entry.workspace_id,))
+        if precompute:
+            snapshot.derive_index(('stats', "All", "All"), lambda: generate_statistics(
+                snapshot, "All", "All", "All", workspace_names={entry.workspace_id: entry.name},
+                app_url=self.app_url))
+        entry.current = (snapshot, fetched_at)
+
+    def _notify(self, workspace_id):
+        for listener in self.listeners:
+            try:
+                listener(workspace_id)
+            except Exception as e:
+                logger.warning(f"Snapshot listener failed: {str(e)}")
+
+    # Single-flight refresh: while one caller fetches a workspace, the others wait for
+    # it and share its outcome (the new snapshot, or its error) instead of fetching too
+    def _refresh(self, entry):
+        attempts = entry.attempts
+        if not entry.lock.acquire(blocking=False):
+            metrics.inc("coalesced", what="workspace")
+            entry.lock.acquire()
+        try:
+            if entry.is_fresh(time.time()):
+                return
+            # An attempt that finished while we waited failed; share its error
+            if entry.attempts != attempts and entry.last_error is not None:
+                raise entry.last_error
+            try:
+                with metrics.span("store.refresh_workspace"):
+                    generation = entry.generation
+                    data = self.client.list_queues(workspace_id=entry.workspace_id)
+                    self._store(entry, data['elements'], data['snapshotVersion'], generation)
+            except Exception as e:
+                entry.last_error = e
+                raise
+            finally:
+                entry.attempts += 1
+            entry.last_error = None
+            logger.info(f"Refreshed workspace {entry.name}: {len(data['elements'])} queues")
+        finally:
+            entry.lock.release()
+
+    # Bring the entries among workspace_ids up to date. Entries that are only past
+    # their TTL are served as they are and refreshed in the background
+    # (stale-while-revalidate); empty or invalidated ones are refreshed concurrently
+    # and waited for. A failed refresh keeps serving the previous data; it only
+    # raises when there is nothing cached.
+    def ensure(self, workspace_ids):
+        now = time.time()
+        entries = [self._entry(workspace_id) for workspace_id in workspace_ids]
+        stale = [e for e in entries if not e.is_fresh(now)]
+        metrics.inc("cache_hits", len(entries) - len(stale), cache="workspace")
+        if not stale:
+            return entries
+        metrics.inc("cache_misses", len(stale), cache="workspace")
+        for entry in stale:
+            if entry.is_servable():
+                self._revalidate(entry)
+        stale = [e for e in stale if not e.is_servable()]
+        if not stale:
+            return entries
+        if len(stale) == 1:
+            outcomes = [(stale[0], self._try_refresh(stale[0]))]
+        else:
+            futures = [(e, self.pool.submit(self._try_refresh, e)) for e in stale]
+            outcomes = [(e, future.result()) for e, future in futures]
+        for entry, error in outcomes:
+            if error is not None:
+                if entry.current is None:
+                    raise error
+                logger.warning(f"Serving cached data for workspace {entry.name}: refresh failed: {str(error)}")
+        return entries
+
+    def _try_refresh(self, entry):
+        try:
+            self._refresh(entry)
+            return None
+        except Exception as e:
+            return e
+
+    # Refresh the entry on the pool unless a background refresh is already queued
+    def _revalidate(self, entry):
+        with self.lock:
+            if entry.revalidating:
+                return
+            entry.revalidating = True
+
+        def run():
+            try:
+                error = self._try_refresh(entry)
+                if error is not None:
+                    logger.warning(f"Serving cached data for workspace {entry.name}: refresh failed: {str(error)}")
+            finally:
+                entry.revalidating = False
+        self.pool.submit(run)
+
+    # (fetch time of the oldest data, last refresh error or None) behind a workspace
+    # name, for the dashboard's "data as of" banner
+    def freshness(self, workspace_name="All"):
+        with self.lock:
+            entries = [e for e in self.entries.values() if workspace_name == "All" or e.name == workspace_name]
+        fetched = [e.current[1] for e in entries if e.current is not None]
+        errors = [e.last_error for e in entries if e.last_error is not None]
+        return min(fetched, default=None), errors[0] if errors else None
+
+    # Shared snapshot for one workspace name (or "All"). Every caller gets the same
+    # object until one of the underlying workspaces changes version.
+    def payload(self, workspace_name="All"):
+        parts = [entry.current[0] for entry in self.ensure(self.ids_for(workspace_name))]
+        if len(parts) == 1:
+            return parts[0]
+        versions = tuple(part.version for part in parts)
+        with self.lock:
+            combined = self._combined.get(workspace_name)
+            if combined is not None and combined[0] == versions:
+                return combined[1]
+        elements = tuple(queue for part in parts for queue in part.elements)
+        snapshot = Snapshot(elements, combine_versions(list(versions)),
+                            [workspace_id for part in parts for workspace_id in part.workspace_ids])
+        with self.lock:
+            # Replacing the entry drops the store's reference to the previous version
+            self._combined[workspace_name] = (versions, snapshot)
+        return snapshot
+
+    # generate_statistics() for the given filters, computed once per snapshot version.
+    # The snapshot is already scoped to the workspace, and the size filter is applied
+    # as an index view before the statistics are built. Statistics of all reps (one per
+    # size range, see reports.py) are kept for the whole version; per-rep ones are LRU,
+    # or not cached at all with cache=False (the stats API caches its own responses).
+    def statistics(self, workspace_name, selected_rep="All", selected_size="All", cache=True):
+        snapshot = self.payload(workspace_name)
+
+        def build():
+            return generate_statistics(snapshot.with_size(selected_size), "All", selected_rep, "All",
+                                       workspace_names=self._names(), app_url=self.app_url)
+        key = ('stats', selected_rep, selected_size)
+        if selected_rep == "All":
+            return snapshot.derive_index(key, build)
+        return snapshot.derive(key, build) if cache else build()
+
+    # Mark entries stale so the next read refetches them
+    def invalidate(self, workspace_id=None):
+        with self.lock:
+            targets = list(self.entries.values()) if workspace_id is None else \
+                [self.entries[workspace_id]] if workspace_id in self.entries else []
+        for entry in targets:
+            entry.generation += 1
+
+    def invalidate_queue(self, queue_id):
+        with self.lock:
+            workspace_id = self.queue_workspaces.get(queue_id)
+        if workspace_id is None:
+            self.invalidate()
+        else:
+            self.invalidate(workspace_id)
+
+    # Apply a change notification (see webhooks.py). An event that carries the full
+    # queue is patched into the workspace's current snapshot without an API call;
+    # otherwise, or when the entry is already due for a refetch, only that workspace
+    # is marked stale. Events for workspaces this store doesn't hold are ignored.
+    # Returns 'patched', 'invalidated' or 'ignored'.
+    def apply_event(self, event):
+        queue = event.get('queue')
+        queue_id = event.get('queueId') or (queue or {}).get('id')
+        with self.lock:
+            previous_workspace = self.queue_workspaces.get(queue_id)
+            workspace_id = (queue or {}).get('workspaceId') or event.get('workspaceId') or previous_workspace
+            known = workspace_id in self.entries
+        if not queue_id or not known:
+            return 'ignored'
+        if event.get('type') == 'queue.deleted':
+            queue = None
+        elif queue is None:
+            self.invalidate(workspace_id)
+            return 'invalidated'
+
+        # A queue that moved workspace leaves the old one's snapshot
+        if previous_workspace not in (None, workspace_id) and not self._patch(previous_workspace, queue_id, None):
+            self.invalidate(previous_workspace)
+        if not self._patch(workspace_id, queue_id, queue):
+            self.invalidate(workspace_id)
+            return 'invalidated'
+        return 'patched'
+
+    # Replace (or add, or with queue=None remove) one queue in the entry's current
+    # snapshot. The patched snapshot keeps the fetch time, so the regular refresh
+    # still comes due. False when there is nothing current to patch.
+    def _patch(self, workspace_id, queue_id, queue):
+        with self.lock:
+            entry = self.entries.get(workspace_id)
+        if entry is None:
+            return False
+        with entry.lock:
+            if entry.current is None or entry.fresh_generation != entry.generation:
+                return False
+            snapshot, fetched_at = entry.current
+            elements = list(snapshot.elements)
+            position = next((i for i, q in enumerate(elements) if q['id'] == queue_id), None)
+            if queue is None:
+                if position is None:
+                    return True
+                del elements[position]
+            elif position is None:
+                elements.append(queue)
+            elif elements[position] == queue:
+                return True
+            else:
+                elements[position] = queue
+            change = hashlib.blake2b(json.dumps(queue, sort_keys=True).encode(), digest_size=8).hexdigest()
+            self._publish(entry, elements, combine_versions([snapshot.version, queue_id, change]), fetched_at,
+                          precompute=False)
+        with self.lock:
+            if queue is None:
+                self.queue_workspaces.pop(queue_id, None)
+            else:
+                self.queue_workspaces[queue_id] = workspace_id
+        self._notify(workspace_id)
+        return True
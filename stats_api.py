@@ -0,0 +1,308 @@
+"""Read-only JSON API over the dashboard's shared snapshot cache.
+
+Lets other teams read queue coverage without scraping the dashboard or
+calling Chili Piper themselves: every answer comes from the same
+WorkspaceStore the app uses, so upstream traffic stays one refresh per
+workspace TTL however many consumers there are.
+
+    GET /api/workspaces
+    GET /api/queues?workspace=Sales&size=1-50
+    GET /api/memberships?workspace=Sales&rep=Jane%20Doe
+    GET /api/statistics?workspace=All&rep=All&size=All
+    GET /api/participation?workspace=CS
+
+Common parameters: tenant (slug, defaults to the first tenant), page and
+page_size for the list endpoints (shaped like the /queue response), and
+fields=a,b to keep only some keys of each element. Responses carry an ETag
+derived from the snapshot version, honour If-None-Match, and are gzipped
+when the client accepts it. With a token configured, requests need
+"Authorization: Bearer <token>".
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+from queue_data import SIZE_RANGES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Encoded responses kept in memory, across snapshot versions
+RESPONSE_CACHE_SIZE = 256
+
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 1024
+
+_lock = threading.Lock()
+_api = None
+
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _int_param(params, name, default, minimum, maximum):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise APIError(400, f"{name} must be an integer")
+    if not minimum <= value <= maximum:
+        raise APIError(400, f"{name} must be between {minimum} and {maximum}")
+    return value
+
+
+# Page of `total` rows, built by rows(start, stop), in the /queue response shape
+def _paged(params, total, rows, version):
+    page = _int_param(params, 'page', 0, 0, 10 ** 9)
+    page_size = _int_param(params, 'page_size', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    start = min(page * page_size, total)
+    stop = min(start + page_size, total)
+    return {'elements': rows(start, stop), 'page': page, 'pageSize': page_size, 'total': total,
+            'snapshotVersion': version}
+
+
+def _select_fields(body, fields):
+    if not fields:
+        return body
+    if 'elements' in body:
+        return dict(body, elements=[{k: v for k, v in e.items() if k in fields} for e in body['elements']])
+    return {k: v for k, v in body.items() if k in fields or k == 'snapshotVersion'}
+
+
+class StatsAPI:
+    """Routes and encodes requests against registered WorkspaceStores."""
+
+    def __init__(self, token=None):
+        self.token = token
+        self.httpd = None
+        self.stores = {}  # tenant slug -> WorkspaceStore
+        self.lock = threading.Lock()
+        self.responses = OrderedDict()  # etag -> (body, gzipped body or None)
+        self.endpoints = {
+            'queues': self._queues,
+            'memberships': self._memberships,
+            'statistics': self._statistics,
+            'participation': self._participation,
+        }
+
+    def register(self, name, store):
+        self.stores[name] = store
+
+    def _store(self, params):
+        name = params.get('tenant') or next(iter(self.stores), None)
+        if name not in self.stores:
+            raise APIError(404, f"unknown tenant {name}")
+        return self.stores[name]
+
+    # Unknown sizes would each leave an empty size view on the snapshot
+    @staticmethod
+    def _size(params):
+        size = params.get('size', "All")
+        if size != "All" and size not in SIZE_RANGES:
+            raise APIError(400, f"size must be All or one of {', '.join(SIZE_RANGES)}")
+        return size
+
+    @staticmethod
+    def _workspace(store, params):
+        workspace = params.get('workspace', "All")
+        if workspace != "All" and workspace not in store.workspace_names().values():
+            raise APIError(404, f"unknown workspace {workspace}")
+        return workspace
+
+    # (status, headers, body) for a GET of `path` with single-valued query `params`
+    def handle(self, path, params, accept_gzip=False, if_none_match=None):
+        parts = path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "api":
+            raise APIError(404, "not found")
+        store = self._store(params)
+        if parts[1] == 'workspaces':
+            names = store.workspace_names()
+            return 200, {}, self._encode(
+                {'elements': [{'id': ws_id, 'name': name} for ws_id, name in sorted(names.items())]},
+                accept_gzip)
+        endpoint = self.endpoints.get(parts[1])
+        if endpoint is None:
+            raise APIError(404, f"unknown endpoint {parts[1]}")
+
+        workspace = self._workspace(store, params)
+        snapshot = store.payload(workspace)
+        # The snapshot version identifies the data, the query what was asked of it
+        query = json.dumps(sorted(params.items()), separators=(",", ":"))
+        etag = '"' + hashlib.blake2b(f"{snapshot.version}|{parts[1]}|{query}".encode(),
+                                     digest_size=12).hexdigest() + '"'
+        headers = {'ETag': etag}
+        if if_none_match == etag:
+            return 304, headers, None
+        with self.lock:
+            cached = self.responses.get(etag)
+            if cached is not None:
+                self.responses.move_to_end(etag)
+        if cached is None:
+            metrics.inc("cache_misses", cache="stats_api")
+            fields = {f for f in params.get('fields', "").split(",") if f}
+            body = _select_fields(endpoint(store, snapshot, workspace, params), fields)
+            cached = self._compress(json.dumps(body, separators=(",", ":")).encode())
+            with self.lock:
+                self.responses[etag] = cached
+                while len(self.responses) > RESPONSE_CACHE_SIZE:
+                    self.responses.popitem(last=False)
+        else:
+            metrics.inc("cache_hits", cache="stats_api")
+        return 200, headers, self._pick(cached, accept_gzip)
+
+    @staticmethod
+    def _compress(raw):
+        return raw, gzip.compress(raw, compresslevel=5) if len(raw) >= GZIP_MIN_BYTES else None
+
+    @staticmethod
+    def _pick(encoded, accept_gzip):
+        raw, compressed = encoded
+        return (compressed, True) if accept_gzip and compressed is not None else (raw, False)
+
+    def _encode(self, body, accept_gzip):
+        return self._pick(self._compress(json.dumps(body, separators=(",", ":")).encode()), accept_gzip)
+
+    @staticmethod
+    def _queues(store, snapshot, workspace, params):
+        elements = snapshot.with_size(StatsAPI._size(params)).elements
+        return _paged(params, len(elements), lambda start, stop: list(elements[start:stop]), snapshot.version)
+
+    # Statistics for the query's filters. Only the rep-"All" ones the dashboard
+    # materializes are cached on the snapshot; per-rep answers are cached as responses,
+    # so consumers querying many reps don't evict the dashboard's cached views.
+    @staticmethod
+    def _filtered_statistics(store, workspace, params):
+        return store.statistics(workspace, params.get('rep', "All"), StatsAPI._size(params), cache=False)
+
+    # One row per membership of the filtered statistics, grouped by queue, by order
+    @staticmethod
+    def _memberships(store, snapshot, workspace, params):
+        stats = StatsAPI._filtered_statistics(store, workspace, params)
+        pivot = stats['queue_pivot']
+        table = pivot.table
+
+        def rows(start, stop):
+            positions = pivot.permutation[start:stop]
+            return [
+                {'queueId': table.ids[queue_id], 'queueName': table.queue_names[queue], 'userId': table.ids[user_id],
+                 'repName': table.rep_names[rep], 'weight': weight, 'order': order, 'initialOrder': initial_order}
+                for queue_id, queue, user_id, rep, weight, order, initial_order in zip(
+                    table.queue_id[positions].tolist(), table.queue[positions].tolist(),
+                    table.user_id[positions].tolist(), table.rep[positions].tolist(),
+                    table.weight[positions].tolist(), table.order[positions].tolist(),
+                    table.initial_order[positions].tolist()
+                )
+            ]
+        return _paged(params, len(table), rows, snapshot.version)
+
+    @staticmethod
+    def _statistics(store, snapshot, workspace, params):
+        stats = StatsAPI._filtered_statistics(store, workspace, params)
+        return {
+            'total_queues': stats['total_queues'],
+            'total_reps': stats['total_reps'],
+            'main_reps': stats['main_reps'],
+            'mandatory_reps': stats['mandatory_reps'],
+            'queues_by_size': {str(size): count for size, count in sorted(stats['queues_by_size'].items())},
+            'reps_by_queue': stats['reps_by_queue'],
+            'workspaces': sorted(stats['workspaces']),
+            'sales_queues': stats['sales_queues'],
+            'cs_queues': stats['cs_queues'],
+            'cs_users': sorted(stats['cs_users']),
+            'queue_links': stats['queue_links'],
+            'snapshotVersion': snapshot.version,
+        }
+
+    # Sparse participation matrix, one element per rep: {'rep', 'total', 'queues': {queue: weight}}
+    @staticmethod
+    def _participation(store, snapshot, workspace, params):
+        matrix = store.statistics(workspace, "All", StatsAPI._size(params))['ae_participation']
+        totals = matrix.row_sums()
+
+        def rows(start, stop):
+            return [
+                {'rep': matrix.rep_names[i], 'total': int(totals[i]), 'queues': {
+                    matrix.queue_names[col]: weight for col, weight in zip(
+                        matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]].tolist(),
+                        matrix.data[matrix.indptr[i]:matrix.indptr[i + 1]].tolist())
+                }}
+                for i in range(start, stop)
+            ]
+        return _paged(params, matrix.shape[0], rows, snapshot.version)
+
+
+class StatsAPIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("stats api: " + format, *args)
+
+    def _send(self, status, headers, body=None, gzipped=False):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if gzipped:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        api = self.server.api
+        with metrics.span("stats_api.request"):
+            if api.token and not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {api.token}"):
+                self._send(401, {}, json.dumps({'error': 'missing or invalid token'}).encode())
+                return
+            url = urlparse(self.path)
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            try:
+                status, headers, result = api.handle(
+                    url.path, params,
+                    accept_gzip="gzip" in self.headers.get("Accept-Encoding", ""),
+                    if_none_match=self.headers.get("If-None-Match")
+                )
+            except APIError as e:
+                self._send(e.status, {}, json.dumps({'error': str(e)}).encode())
+                return
+            except Exception as e:
+                logger.error(f"Stats API request {self.path} failed: {str(e)}")
+                self._send(503, {}, json.dumps({'error': 'data unavailable'}).encode())
+                return
+            if result is None:
+                self._send(status, headers)
+            else:
+                self._send(status, headers, *result)
+
+
+# Start the API once per process; later calls return the running one
+def start_stats_api(port, host="127.0.0.1", token=None):
+    global _api
+    with _lock:
+        if _api is not None:
+            return _api
+        api = StatsAPI(token)
+        try:
+            httpd = ThreadingHTTPServer((host, port), StatsAPIHandler)
+        except OSError as e:
+            logger.error(f"Could not start stats API on {host}:{port}: {str(e)}")
+            return None
+        httpd.daemon_threads = True
+        httpd.api = api
+        api.httpd = httpd
+        _api = api
+    threading.Thread(target=httpd.serve_forever, name="stats-api-http", daemon=True).start()
+    logger.info(f"Serving the stats API on http://{host}:{port}/api/")
+    return _api
@@ -0,0 +1,98 @@
+"""Chili Piper tenants: one (region, API key) pair each.
+
+CHILI_TENANTS holds a JSON list of tenants, e.g.
+
+    [{"name": "NA", "region": "na", "api_key_env": "CHILI_API_KEY_NA"},
+     {"name": "EU", "region": "eu", "api_key_env": "CHILI_API_KEY_EU", "rate_limit": 5,
+      "workspaces": {"65f0...": "EU Sales"}}]
+
+The region picks both the API and the admin center the queue links point
+to; "base_url" and "app_url" override them.
+
+Each tenant gets its own client, rate limiter and workspace store in
+chili.py. Without CHILI_TENANTS the single CHILI_API_BASE_URL /
+CHILI_API_KEY pair is the only tenant.
+"""
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+REGION_BASE_URLS = {
+    'na': "https://edge.na.chilipiper.com",
+    'eu': "https://edge.eu.chilipiper.com",
+}
+
+# Admin center per region, for the "View in Chili Piper" queue links
+REGION_APP_URLS = {
+    'na': "https://connecteam.na.chilipiper.com",
+    'eu': "https://connecteam.eu.chilipiper.com",
+}
+
+DEFAULT_TENANT = "Default"
+
+
+class Tenant:
+    def __init__(self, name, base_url, api_key, rate_limit=None, workspaces=None, discover=True, app_url=None):
+        self.name = name
+        self.base_url = base_url
+        # Admin center of the API's region; NA for custom API URLs
+        region = next((r for r, url in REGION_BASE_URLS.items() if url == base_url.rstrip("/")), 'na')
+        self.app_url = app_url or REGION_APP_URLS[region]
+        self.api_key = api_key
+        self.rate_limit = rate_limit
+        self.workspaces = workspaces or {}
+        self.discover = discover
+
+    # Filesystem-safe name for per-tenant checkpoint and export directories
+    @property
+    def slug(self):
+        return re.sub(r"[^a-z0-9]+", "-", self.name.lower()).strip("-") or "tenant"
+
+
+def _workspace_config(value):
+    return {ws_id: dict(cfg) if isinstance(cfg, dict) else {'name': cfg} for ws_id, cfg in value.items()}
+
+
+def _parse_tenant(entry):
+    name = entry['name']
+    region = entry.get('region', 'na').lower()
+    base_url = entry.get('base_url') or REGION_BASE_URLS[region]
+    api_key = entry.get('api_key') or os.getenv(entry.get('api_key_env', ''), "")
+    if not api_key:
+        raise ValueError(f"no API key (set {entry.get('api_key_env') or 'api_key_env'})")
+    workspaces = _workspace_config(entry.get('workspaces', {}))
+    return Tenant(
+        name, base_url, api_key,
+        rate_limit=entry.get('rate_limit'),
+        workspaces=workspaces,
+        # Pinned workspaces skip discovery unless asked for explicitly
+        discover=entry.get('discover', not workspaces),
+        app_url=entry.get('app_url') or REGION_APP_URLS[region]
+    )
+
+
+# Tenants by name, in configuration order. Misconfigured tenants are logged and skipped.
+def load_tenants(default_base_url, default_api_key, default_workspaces, default_discover=True, raw=None):
+    raw = os.getenv("CHILI_TENANTS") if raw is None else raw
+    if not raw:
+        if not default_api_key:
+            return {}
+        return {DEFAULT_TENANT: Tenant(DEFAULT_TENANT, default_base_url, default_api_key,
+                                       workspaces=default_workspaces, discover=default_discover)}
+    try:
+        entries = json.loads(raw)
+    except ValueError as e:
+        logger.error(f"Ignoring invalid CHILI_TENANTS: {str(e)}")
+        return {}
+    tenants = {}
+    for entry in entries:
+        try:
+            tenant = _parse_tenant(entry)
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Skipping tenant {entry.get('name', '?') if isinstance(entry, dict) else entry}: {str(e)}")
+            continue
+        tenants[tenant.name] = tenant
+    return tenants
@@ -0,0 +1,37 @@
+import search
+
+PAYLOAD = {'elements': [
+    {'id': 'q1', 'name': "Inbound - Enterprise", 'workspaceId': 'w1', 'active': True, 'members': [
+        {'id': 'u1', 'name': "Ada Lovelace", 'email': "ada@example.com", 'weight': 50},
+        {'id': 'u2', 'name': "Alan Turing", 'email': "alan@example.com", 'weight': 50},
+    ]},
+    {'id': 'q2', 'name': "Outbound", 'workspaceId': 'w1', 'active': False, 'members': []},
+]}
+
+
+def make_index():
+    return search.SearchIndex(PAYLOAD, {'w1': "Sales"})
+
+
+def test_punctuation_only_query_returns_no_fuzzy_matches():
+    index = make_index()
+    for query in ("---", "...", "-_/|"):
+        assert index.search(query) == []
+
+
+def test_punctuation_query_still_matches_substrings():
+    assert [hit['id'] for hit in make_index().search(" - ")] == ['q1']
+    assert [hit['id'] for hit in make_index().search("d - e")] == ['q1']
+
+
+def test_fuzzy_match():
+    hits = make_index().search("lovelce")
+    assert [hit['id'] for hit in hits] == ['u1']
+    assert hits[0]['rank'] == search.FUZZY
+
+
+def test_ids_and_emails_are_not_fuzzy_matched():
+    index = make_index()
+    assert all(word.isalpha() for words in index.words.values() for word in words)
+    assert index.search("u3") == []
+    assert [hit['id'] for hit in index.search("ada@example.con")] == []
@@ -0,0 +1,95 @@
+"""Per-session state of the queue and rep editors, keyed by stable ids.
+
+Open editors (edit weight, confirm removal, add reps, add to queues) and
+per-queue sort orders are stored under (queue id, user id) pairs instead of
+positions in the rendered list, so they stay on the right row when a
+refresh reorders queues or members. Everything lives in one dict in the
+session state: at most MAX_OPEN_EDITORS editors stay open (the oldest is
+closed first), and state for queues and memberships that are no longer in
+the snapshot is dropped once per snapshot version.
+"""
+import os
+from collections import OrderedDict
+
+# Editors open at once per session; opening one more closes the oldest
+MAX_OPEN_EDITORS = int(os.getenv("CHILI_MAX_OPEN_EDITORS", "8"))
+
+STATE_KEY = "ui_state"
+
+DEFAULT_SORT = ('Order', True)
+
+# Editor kinds and the ids they are keyed by
+EDIT = 'edit'            # (queue id, user id)
+REMOVE = 'remove'        # (queue id, user id)
+ADD_REPS = 'add_reps'    # (queue id,)
+ADD_QUEUES = 'add_queues'  # (user id,)
+
+
+# (queue ids, (queue id, user id) memberships, user ids) of a payload, for UIState.prune
+def snapshot_keys(elements):
+    queue_ids = set()
+    memberships = set()
+    user_ids = set()
+    for queue in elements:
+        queue_ids.add(queue['id'])
+        for member in queue.get('members', []):
+            memberships.add((queue['id'], member['id']))
+            user_ids.add(member['id'])
+    return frozenset(queue_ids), frozenset(memberships), frozenset(user_ids)
+
+
+class UIState:
+    """View over the session's editor and sort state."""
+
+    def __init__(self, session_state, max_open=MAX_OPEN_EDITORS):
+        if STATE_KEY not in session_state:
+            session_state[STATE_KEY] = {'open': OrderedDict(), 'sort': {}, 'version': None}
+        self.state = session_state[STATE_KEY]
+        self.max_open = max_open
+
+    def is_open(self, kind, *ids):
+        return (kind,) + ids in self.state['open']
+
+    def open(self, kind, *ids):
+        editors = self.state['open']
+        editors[(kind,) + ids] = True
+        editors.move_to_end((kind,) + ids)
+        while len(editors) > self.max_open:
+            editors.popitem(last=False)
+
+    def close(self, kind, *ids):
+        self.state['open'].pop((kind,) + ids, None)
+
+    @property
+    def open_count(self):
+        return len(self.state['open'])
+
+    # (column, ascending) of a queue's member table
+    def sort(self, queue_id):
+        return self.state['sort'].get(queue_id, DEFAULT_SORT)
+
+    # Sort by `column`, or flip the direction when it's already the sort column
+    def toggle_sort(self, queue_id, column):
+        current, ascending = self.sort(queue_id)
+        self.state['sort'][queue_id] = (column, not ascending if current == column else True)
+
+    # Drop state for queues and memberships missing from a snapshot version; a no-op
+    # until the version changes
+    def prune(self, version, keys):
+        if self.state['version'] == version:
+            return
+        queue_ids, memberships, user_ids = keys
+        editors = self.state['open']
+        for key in list(editors):
+            kind, ids = key[0], key[1:]
+            if kind in (EDIT, REMOVE):
+                alive = ids in memberships
+            elif kind == ADD_REPS:
+                alive = ids[0] in queue_ids
+            else:
+                alive = ids[0] in user_ids
+            if not alive:
+                del editors[key]
+        self.state['sort'] = {queue_id: order for queue_id, order in self.state['sort'].items()
+                              if queue_id in queue_ids}
+        self.state['version'] = version
@@ -0,0 +1,198 @@
+"""Local receiver for queue change notifications.
+
+Accepts POST /events (every registered store) or /events/<tenant slug> with
+one JSON event or a list of them:
+
+    {"type": "member.updated", "queueId": "...", "workspaceId": "...",
+     "queue": {...the queue as GET /queue returns it...}}
+
+Types are queue.updated, queue.deleted, member.assigned, member.unassigned
+and member.updated. An event with the full queue is patched into the
+cached snapshot; one without it marks the queue's workspace stale (see
+WorkspaceStore.apply_event). With a secret configured, the body must be
+signed: X-Chili-Signature: sha256=<hex HMAC-SHA256 of the body>.
+
+While the receiver runs, stores only poll at SAFETY_NET_TTL to catch
+missed events. Recorded events (JSON lines) can be replayed with:
+
+    python webhooks.py events.jsonl --url http://127.0.0.1:8766/events
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ("queue.updated", "queue.deleted", "member.assigned", "member.unassigned", "member.updated")
+
+SIGNATURE_HEADER = "X-Chili-Signature"
+
+# Refresh interval of every workspace while events keep the cache current
+SAFETY_NET_TTL = float(os.getenv("CHILI_WEBHOOK_POLL_TTL", "600"))
+
+# Request bodies above this size are rejected
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+_lock = threading.Lock()
+_receiver = None
+
+
+def sign(body, secret):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("webhooks: " + format, *args)
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[0] != "events" or len(parts) > 2:
+            self._send_json(404, {'error': 'not found'})
+            return
+        target = parts[1] if len(parts) == 2 else None
+        if target is not None and target not in receiver.stores:
+            self._send_json(404, {'error': f'unknown tenant {target}'})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {'error': 'body too large'})
+            return
+        body = self.rfile.read(length)
+        if receiver.secret and not hmac.compare_digest(self.headers.get(SIGNATURE_HEADER, ""),
+                                                       sign(body, receiver.secret)):
+            metrics.inc("webhook_events", action="rejected")
+            self._send_json(401, {'error': 'bad signature'})
+            return
+        try:
+            events = json.loads(body)
+        except ValueError:
+            self._send_json(400, {'error': 'malformed JSON'})
+            return
+        if isinstance(events, dict):
+            events = [events]
+        if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+            self._send_json(400, {'error': 'expected an event object or a list of them'})
+            return
+        self._send_json(202, receiver.dispatch(events, target))
+
+
+class WebhookReceiver:
+    """HTTP endpoint that feeds change events into registered WorkspaceStores."""
+
+    def __init__(self, host="127.0.0.1", port=0, secret=None):
+        self.secret = secret
+        self.stores = {}  # tenant slug -> WorkspaceStore
+        self.httpd = ThreadingHTTPServer((host, port), WebhookHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.receiver = self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/events"
+
+    def register(self, name, store):
+        self.stores[name] = store
+
+    # Apply events to one store, or to every store when target is None.
+    # Returns the number of events per outcome.
+    def dispatch(self, events, target=None):
+        stores = [self.stores[target]] if target is not None else list(self.stores.values())
+        outcome = {'patched': 0, 'invalidated': 0, 'ignored': 0}
+        for event in events:
+            if event.get('type') not in EVENT_TYPES:
+                logger.warning(f"Ignoring webhook event of unknown type {event.get('type')!r}")
+                action = 'ignored'
+            else:
+                actions = [store.apply_event(event) for store in stores]
+                action = next((a for a in ('patched', 'invalidated') if a in actions), 'ignored')
+            outcome[action] += 1
+            metrics.inc("webhook_events", action=action)
+        return outcome
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="webhooks-http", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# Start the receiver once per process; later calls return the running one
+def start_webhook_server(port, host="127.0.0.1", secret=None):
+    global _receiver
+    with _lock:
+        if _receiver is not None:
+            return _receiver
+        try:
+            _receiver = WebhookReceiver(host, port, secret).start()
+        except OSError as e:
+            logger.error(f"Could not start webhook receiver on {host}:{port}: {str(e)}")
+            return None
+    logger.info(f"Receiving change events on {_receiver.url}")
+    return _receiver
+
+
+# POST events to a receiver, keeping their original spacing ('occurredAt', in epoch
+# seconds) divided by `speed`; speed=0 sends them back to back. Returns the responses.
+def replay(events, url, secret=None, speed=1.0):
+    results = []
+    started = time.time()
+    first = None
+    for event in events:
+        occurred = event.get('occurredAt')
+        if speed and occurred is not None:
+            first = occurred if first is None else first
+            delay = (occurred - first) / speed - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+        body = json.dumps(event).encode()
+        request = urllib.request.Request(url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        if secret:
+            request.add_header(SIGNATURE_HEADER, sign(body, secret))
+        with urllib.request.urlopen(request, timeout=10) as response:
+            results.append(json.loads(response.read()))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded change events against a webhook receiver")
+    parser.add_argument("events", help="JSON lines file, e.g. written by mock_server.py --events-out")
+    parser.add_argument("--url", default="http://127.0.0.1:8766/events")
+    parser.add_argument("--secret", help="sign requests with this shared secret")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up; 0 sends without delays")
+    args = parser.parse_args()
+
+    with open(args.events) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    totals = {}
+    for result in replay(events, args.url, args.secret, args.speed):
+        for action, count in result.items():
+            totals[action] = totals.get(action, 0) + count
+    print(f"Replayed {len(events)} events: {totals}")
+
+
+if __name__ == "__main__":
+    main()